@@ -0,0 +1 @@
+"""Benchmarks för sommar.py och servera.py. Körs från projektroten med python -m bench.<namn>."""
@@ -0,0 +1,63 @@
+"""Mäter vad Atom och JSON Feed kostar utöver RSS-flödet i samma körning.
+
+    python -m bench.bench_formats --items 100 1000 10000 --repeat 3
+
+Alla format renderas ur samma lista med avsnitt, som i generate_rss. RSS
+mäts både som full rendering (feedgen plus FEED_STAGES) och inkrementellt
+med sparade <item>, vilket är det vanliga fallet när bara några avsnitt är
+nya. Atom och JSON Feed byggs om helt varje gång, så deras tid jämförs med
+båda. Resultaten tolkas och antalet poster kontrolleras.
+"""
+import argparse
+import datetime
+import json
+
+from lxml import etree
+
+import sommar
+from bench.common import synthetic_episodes, timed
+
+
+def entries(name, data):
+    if name == "json":
+        return len(json.loads(data)["items"])
+    root = etree.fromstring(data, sommar.FEED_PARSER)
+    if name == "atom":
+        return len(root.findall(f"{{{sommar.ATOM_NS}}}entry"))
+    return len(root.findall("channel/item"))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--items", type=int, nargs="+", default=[100, 1000, 10000])
+    parser.add_argument("--repeat", type=int, default=3)
+    args = parser.parse_args()
+
+    program = sommar.default_program()
+    build_date = datetime.datetime(2025, 8, 17, 7, 0, tzinfo=datetime.timezone.utc)
+    print(f"bästa av {args.repeat}; andel = tid / full RSS-rendering (inkrementell RSS inom parentes)")
+    print(f"{'avsnitt':>8} {'format':<16} {'tid (ms)':>10} {'andel':>16} {'storlek (kB)':>13}  poster")
+    for count in args.items:
+        episodes = synthetic_episodes(count)
+        # Som i en riktig körning: de sparade <item> finns från förra körningen
+        sommar.render_feed_incremental(episodes, sommar.FALLBACK_ICON, build_date, program)
+        variants = {
+            "rss (full)": lambda: sommar.render_feed(episodes, sommar.FALLBACK_ICON, build_date, program),
+            "rss (inkr.)": lambda: sommar.render_feed_incremental(episodes, sommar.FALLBACK_ICON, build_date, program)[0],
+            **{
+                fmt: (lambda render=render: render(episodes, sommar.FALLBACK_ICON, build_date, program))
+                for fmt, render in sommar.FORMAT_RENDERERS.items()
+            },
+        }
+        times = {}
+        for name, render in variants.items():
+            times[name], data = timed(render, args.repeat)
+            full, incremental = times.get("rss (full)", times[name]), times.get("rss (inkr.)", times[name])
+            share = f"{times[name] / full:.0%} ({times[name] / incremental:.0%})"
+            found = entries(name.split()[0], data)
+            check = "ok" if found == count else f"FEL: {found}"
+            print(f"{count:>8} {name:<16} {times[name] * 1000:>10.1f} {share:>16} {len(data) / 1024:>13.0f}  {check}")
+
+
+if __name__ == "__main__":
+    main()
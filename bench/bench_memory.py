@@ -0,0 +1,101 @@
+"""Minnet för avsnittscachen: gamla avsnittsdictar mot store.Episode.
+
+    python -m bench.bench_memory --items 10000
+
+Läser in samma syntetiska avsnitt på två sätt, som JsonStore gör när
+cache.json öppnas, och sorterar dem i flödets ordning:
+
+- dict: det gamla formatet, en dict per avsnitt med alla fält utskrivna
+  (itunes_summary och itunes_subtitle som egna kopior av beskrivningen)
+- Episode: det kompakta formatet från Episode.to_record(), inläst till
+  Episode-objekt med __slots__
+
+Mäts med tracemalloc: hur mycket som ligger kvar efter inläsningen
+(behållet) och högsta heap under den. Med och utan renderade <item>
+(renderingscachen), som tar det mesta av minnet i ett stort arkiv.
+"""
+import argparse
+import gc
+import json
+import tracemalloc
+from email.utils import parsedate_to_datetime
+
+import sommar
+import store
+from bench.common import synthetic_episodes
+
+
+def legacy_records(episodes, rendered):
+    """Avsnitten i det gamla cacheformatet."""
+    records = {}
+    for ep in episodes:
+        record = ep.content()
+        if rendered:
+            record["_rss_key"], record["_rss_item"] = ep.rss_key, ep.rss_item
+        records[ep.audio] = record
+    return records
+
+
+def load_legacy(text):
+    data = json.loads(text)
+    # Som i den gamla JsonStore: datumet tolkas om vid varje sortering
+    return sorted(data.values(), key=lambda ep: parsedate_to_datetime(ep["date"]), reverse=True)
+
+
+def load_episodes(text):
+    data = {audio: store.Episode.from_record(record) for audio, record in json.loads(text).items()}
+    return sorted(data.values(), key=sommar.episode_datetime, reverse=True)
+
+
+def measure(load, text):
+    """(avsnitten, behållna bytes, högsta heap i bytes) för load(text)."""
+    gc.collect()
+    tracemalloc.start()
+    result = load(text)
+    gc.collect()
+    current, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return result, current, peak
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--items", type=int, default=10000)
+    args = parser.parse_args()
+
+    episodes = synthetic_episodes(args.items)
+    _, _, nsmap = sommar.render_shell(sommar.FALLBACK_ICON, None, sommar.default_program())
+    sommar.render_items(episodes, nsmap)
+
+    print(f"{args.items} avsnitt")
+    print(f"{'variant':<22} {'fil (kB)':>9} {'behållet (MB)':>14} {'per avsnitt (B)':>16} {'högsta (MB)':>12}")
+    for rendered in (False, True):
+        legacy_text = json.dumps(legacy_records(episodes, rendered), ensure_ascii=False, separators=(",", ":"))
+        compact_text = json.dumps(
+            {ep.audio: ep.to_record(rendered=rendered) for ep in episodes},
+            ensure_ascii=False,
+            separators=(",", ":"),
+        )
+        legacy, legacy_bytes, legacy_peak = measure(load_legacy, legacy_text)
+        compact, compact_bytes, compact_peak = measure(load_episodes, compact_text)
+        same = [ep.content() for ep in compact] == [
+            {k: v for k, v in ep.items() if not k.startswith("_")} for ep in legacy
+        ]
+        suffix = " + <item>" if rendered else ""
+        for name, text, retained, peak in (
+            (f"dict{suffix}", legacy_text, legacy_bytes, legacy_peak),
+            (f"Episode{suffix}", compact_text, compact_bytes, compact_peak),
+        ):
+            print(
+                f"{name:<22} {len(text.encode('utf-8')) / 1024:>9.0f} {retained / 2**20:>14.1f} "
+                f"{retained / args.items:>16.0f} {peak / 2**20:>12.1f}"
+            )
+        print(
+            f"  {1 - compact_bytes / legacy_bytes:.0%} mindre behållet minne, "
+            f"samma avsnitt: {'ja' if same else 'NEJ'}"
+        )
+        del legacy, compact
+
+
+if __name__ == "__main__":
+    main()
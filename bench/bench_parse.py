@@ -0,0 +1,148 @@
+"""Jämför HTML-tolkarna för avsnittslistan: tid och minne per backend.
+
+    python -m bench.bench_parse --repeat 5
+    python -m bench.bench_parse --save 3     # spara SR:s första sidor som fixtures
+
+Mäter över de sparade sidorna bench/fixtures/listing-N.html och avbryter
+om det inte finns några. Med --synthetic används i stället syntetiska sidor
+(bench.common.synthetic_listing_html): en vanlig förstasida och en stor
+arkivsida.
+
+Varje backend körs i en egen process så att minnesmätningarna inte påverkar
+varandra: högsta Python-heap under tolkningen (tracemalloc) och hur mycket
+processens RSS växer, vilket också fångar libxml2:s minne som tracemalloc
+inte ser. Alla backends ska ge exakt samma avsnitt som "bs4" (html.parser).
+"""
+import argparse
+import hashlib
+import json
+import os
+import resource
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+from pathlib import Path
+
+import sommar
+from bench.common import FIXTURE_DIR, fixture_paths, synthetic_listing_html
+
+BACKENDS = list(sommar.LISTING_PARSERS)
+
+
+def extract(backend, pages):
+    """Tolkar sidorna och gör avsnitt av dem, som i fetch_episodes."""
+    results = []
+    for content in pages:
+        listing = sommar.parse_listing(content, backend)
+        results.append(
+            {
+                "episodes": [sommar.episode_from_item(item).content() for item in listing["items"]],
+                "program_image": sommar.extract_program_image(listing),
+                "last_page": listing["last_page"],
+            }
+        )
+    return results
+
+
+def measure(backend, paths, repeat):
+    """Körs i barnprocessen."""
+    pages = [Path(p).read_bytes() for p in paths]
+
+    rss_before = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    results = extract(backend, pages)
+    rss_growth = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss - rss_before
+
+    tracemalloc.start()
+    extract(backend, pages)
+    _, heap_peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    best = float("inf")
+    for _ in range(repeat):
+        started = time.perf_counter()
+        extract(backend, pages)
+        best = min(best, time.perf_counter() - started)
+
+    digest = hashlib.sha256(json.dumps(results, sort_keys=True).encode()).hexdigest()
+    return {
+        "seconds": best,
+        "heap_peak": heap_peak,
+        "rss_growth": rss_growth * 1024,  # ru_maxrss är i kB på Linux
+        "episodes": sum(len(r["episodes"]) for r in results),
+        "digest": digest,
+    }
+
+
+def save_fixtures(count):
+    FIXTURE_DIR.mkdir(exist_ok=True)
+    for page in range(1, count + 1):
+        resp = sommar.CLIENT.get(sommar.page_url(page))
+        resp.raise_for_status()
+        path = FIXTURE_DIR / f"listing-{page}.html"
+        path.write_bytes(resp.content)
+        print(f"💾 {path} ({len(resp.content) / 1024:.0f} kB)")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument("--items", type=int, default=200, help="avsnitt på den syntetiska arkivsidan")
+    parser.add_argument("--save", type=int, metavar="N", help="hämta och spara SR:s N första sidor")
+    parser.add_argument("--synthetic", action="store_true", help="syntetiska sidor i stället för bench/fixtures")
+    parser.add_argument("--child", choices=BACKENDS, help=argparse.SUPPRESS)
+    parser.add_argument("paths", nargs="*", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.child:
+        print(json.dumps(measure(args.child, args.paths, args.repeat)))
+        return
+    if args.save:
+        save_fixtures(args.save)
+        return
+
+    with tempfile.TemporaryDirectory() as tmp:
+        if args.synthetic:
+            paths = []
+            synthetic = {
+                "listing.html": synthetic_listing_html(10, pages=50),
+                "archive.html": synthetic_listing_html(args.items, page=2, pages=50, start_index=10),
+            }
+            for name, content in synthetic.items():
+                paths.append(os.path.join(tmp, name))
+                Path(paths[-1]).write_bytes(content)
+            source = f"syntetiska sidor (10 + {args.items} avsnitt)"
+        else:
+            try:
+                paths = [str(path) for path in fixture_paths()]
+            except FileNotFoundError as e:
+                sys.exit(f"❌ {e} (--synthetic)")
+            source = f"{len(paths)} sparade sidor i {FIXTURE_DIR}"
+        size = sum(os.path.getsize(p) for p in paths)
+        print(f"{source}, {size / 1024:.0f} kB HTML, bästa av {args.repeat}")
+
+        results = {}
+        for backend in BACKENDS:
+            out = subprocess.run(
+                [sys.executable, "-m", "bench.bench_parse", "--child", backend,
+                 "--repeat", str(args.repeat), *paths],
+                capture_output=True,
+                text=True,
+                check=True,
+                cwd=Path(__file__).resolve().parent.parent,
+            )
+            results[backend] = json.loads(out.stdout.splitlines()[-1])
+
+    reference = results["bs4"]
+    print(f"{'backend':<10} {'tid (ms)':>9} {'snabbare':>9} {'heap (MB)':>10} {'RSS (MB)':>9} {'avsnitt':>8}  samma")
+    for backend, r in results.items():
+        print(
+            f"{backend:<10} {r['seconds'] * 1000:>9.1f} {reference['seconds'] / r['seconds']:>8.1f}x "
+            f"{r['heap_peak'] / 2**20:>10.1f} {r['rss_growth'] / 2**20:>9.1f} {r['episodes']:>8}  "
+            f"{'✅' if r['digest'] == reference['digest'] else '❌'}"
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,99 @@
+"""Jämför efterbearbetningen av flödet: gamla regex-kedjan mot lxml-pipelinen.
+
+    python -m bench.bench_postprocess --items 5000 --repeat 3
+
+Båda varianterna utgår från samma FeedGenerator. Den gamla skriver filen med
+rss_file och kör sedan sex fix_*-funktioner som var och en läser och skriver
+om hela filen. Den nya tar feedgens lxml-träd, kör FEED_STAGES på det och
+skriver filen en gång. Resultaten jämförs i kanonisk form (C14N).
+
+Utöver hela kedjan mäts efterbearbetningen för sig: från färdiga feedgen-bytes
+till skriven fil, så att feedgens egen kostnad inte döljer skillnaden.
+"""
+import argparse
+import os
+import tempfile
+
+from lxml import etree
+
+import sommar
+from bench import legacy_postprocess
+from bench.common import synthetic_episodes, timed
+
+
+def canonical(data):
+    root = etree.fromstring(data, sommar.FEED_PARSER)
+    return etree.tostring(root, method="c14n")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--items", type=int, default=5000)
+    parser.add_argument("--repeat", type=int, default=3)
+    args = parser.parse_args()
+
+    episodes = synthetic_episodes(args.items)
+    fg = sommar.build_feed(episodes, sommar.FALLBACK_ICON)
+    guid = sommar.generate_podcast_guid(sommar.FEED_URL)
+
+    with tempfile.TemporaryDirectory() as tmp:
+        legacy_path = os.path.join(tmp, "legacy.xml")
+        pipeline_path = os.path.join(tmp, "pipeline.xml")
+
+        raw = fg.rss_str(pretty=True)
+
+        def legacy_post():
+            with open(legacy_path, "wb") as f:
+                f.write(raw)
+            legacy_postprocess.run_chain(
+                legacy_path, guid, sommar.CHANNEL_URL, sommar.API_IMAGE_URL
+            )
+
+        def pipeline_post():
+            root = etree.fromstring(raw, sommar.FEED_PARSER)
+            data = sommar.postprocess_feed(
+                root, guid, sommar.CHANNEL_URL, sommar.API_IMAGE_URL
+            )
+            with open(pipeline_path, "wb") as f:
+                f.write(data)
+
+        def legacy():
+            fg.rss_file(legacy_path, pretty=True)
+            legacy_postprocess.run_chain(
+                legacy_path, guid, sommar.CHANNEL_URL, sommar.API_IMAGE_URL
+            )
+
+        def pipeline():
+            root, _ = fg._create_rss()
+            data = sommar.postprocess_feed(
+                root, guid, sommar.CHANNEL_URL, sommar.API_IMAGE_URL
+            )
+            with open(pipeline_path, "wb") as f:
+                f.write(data)
+
+        legacy_post_time, _ = timed(legacy_post, args.repeat)
+        pipeline_post_time, _ = timed(pipeline_post, args.repeat)
+        legacy_time, _ = timed(legacy, args.repeat)
+        pipeline_time, _ = timed(pipeline, args.repeat)
+
+        with open(legacy_path, "rb") as f:
+            legacy_bytes = f.read()
+        with open(pipeline_path, "rb") as f:
+            pipeline_bytes = f.read()
+
+    same = canonical(legacy_bytes) == canonical(pipeline_bytes)
+    print(f"{args.items} avsnitt, bästa av {args.repeat}")
+    print(f"{'variant':<12} {'efterbearb. (ms)':>17} {'totalt (ms)':>12} {'storlek (kB)':>13}")
+    for name, post, total, data in (
+        ("regex-kedja", legacy_post_time, legacy_time, legacy_bytes),
+        ("lxml", pipeline_post_time, pipeline_time, pipeline_bytes),
+    ):
+        print(f"{name:<12} {post * 1000:>17.1f} {total * 1000:>12.1f} {len(data) / 1024:>13.0f}")
+    print(
+        f"Efterbearbetning {legacy_post_time / pipeline_post_time:.1f}x snabbare, "
+        f"totalt {legacy_time / pipeline_time:.1f}x, samma innehåll (C14N): {'ja' if same else 'NEJ'}"
+    )
+
+
+if __name__ == "__main__":
+    main()
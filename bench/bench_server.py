@@ -0,0 +1,255 @@
+"""Lasttest av servera.py över TLS på localhost.
+
+    python -m bench.bench_server --clients 16 --duration 5
+    python -m bench.bench_server --new-connections --slow-clients 2
+
+Startar varje serverkärna i en egen process med ett självsignerat certifikat
+(skapas med openssl) och ett syntetiskt flöde, och mäter requests per sekund
+och latens (p50/p99) från ett antal samtidiga klienter:
+
+- legacy: den gamla kärnan – HTTPServer med TLS på lyssnarsocketen och
+  HTTP/1.0, dvs. en anslutning och en handskakning per request, en i taget
+- threaded: FeedHTTPServer med HTTP/1.1 keep-alive, handskakning i
+  anslutningens tråd och TLS-sessionsåterupptagning
+
+Med --new-connections öppnar klienterna en ny anslutning per request (och
+återupptar TLS-sessionen om servern tillåter det). --slow-clients öppnar
+TCP-anslutningar som aldrig påbörjar någon handskakning, för att visa hur en
+enda långsam klient påverkar alla andra.
+"""
+import argparse
+import os
+import socket
+import ssl
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from pathlib import Path
+
+from bench.common import synthetic_episodes
+
+FEED_NAME = "feed.xml"
+SERVERS = ("legacy", "threaded")
+
+
+def make_certificate(directory):
+    cert = Path(directory) / "cert.pem"
+    key = Path(directory) / "key.pem"
+    subprocess.run(
+        [
+            "openssl", "req", "-x509", "-newkey", "rsa:2048", "-nodes",
+            "-keyout", str(key), "-out", str(cert), "-days", "1",
+            "-subj", "/CN=localhost",
+        ],
+        check=True,
+        capture_output=True,
+    )
+    return cert, key
+
+
+def serve(kind, port, directory):
+    """Körs i serverprocessen."""
+    os.chdir(directory)
+    os.environ["RSS_FILE"] = FEED_NAME
+    # Åtkomstloggen är avslagen om inte ACCESS_LOG sätts, så att mätningen
+    # gäller servern och inte terminalen
+    os.environ.setdefault("ACCESS_LOG", "false")
+    import servera
+
+    context = servera.make_ssl_context("cert.pem", "key.pem")
+    if kind == "legacy":
+        from http.server import HTTPServer
+
+        class LegacyHandler(servera.SimpleXMLHandler):
+            protocol_version = "HTTP/1.0"
+            timeout = None
+
+        httpd = HTTPServer(("127.0.0.1", port), LegacyHandler)
+        httpd.socket = context.wrap_socket(httpd.socket, server_side=True)
+    else:
+        httpd = servera.FeedHTTPServer(("127.0.0.1", port), servera.SimpleXMLHandler, context)
+    print("ready", flush=True)
+    httpd.serve_forever()
+
+
+class Client:
+    """Minimal HTTPS-klient som kan hålla anslutningen och TLS-sessionen."""
+
+    def __init__(self, port, context, keepalive, timeout):
+        self.port = port
+        self.context = context
+        self.keepalive = keepalive
+        self.timeout = timeout
+        self.sock = None
+        self.file = None
+        self.session = None
+        self.handshakes = 0
+        self.resumed = 0
+
+    def connect(self):
+        raw = socket.create_connection(("127.0.0.1", self.port), timeout=self.timeout)
+        self.sock = self.context.wrap_socket(raw, server_hostname="localhost", session=self.session)
+        self.handshakes += 1
+        self.resumed += self.sock.session_reused
+        self.file = self.sock.makefile("rb")
+
+    def close(self):
+        if self.sock is not None:
+            self.session = self.sock.session
+            self.file.close()
+            self.sock.close()
+            self.sock = self.file = None
+
+    def request(self):
+        if self.sock is None:
+            self.connect()
+        connection = b"keep-alive" if self.keepalive else b"close"
+        self.sock.sendall(
+            b"GET /" + FEED_NAME.encode() + b" HTTP/1.1\r\nHost: localhost\r\n"
+            b"Accept-Encoding: gzip\r\nConnection: " + connection + b"\r\n\r\n"
+        )
+        status = self.file.readline()
+        headers = {}
+        while True:
+            line = self.file.readline()
+            if line in (b"\r\n", b""):
+                break
+            name, _, value = line.decode("latin-1").partition(":")
+            headers[name.strip().lower()] = value.strip()
+        self.file.read(int(headers.get("content-length", 0)))
+        if (
+            not self.keepalive
+            or status.startswith(b"HTTP/1.0")
+            or headers.get("connection", "").lower() == "close"
+        ):
+            self.close()
+        if b" 200 " not in status:
+            raise RuntimeError(status.decode("latin-1").strip())
+
+
+def run_load(port, clients, duration, keepalive, timeout):
+    context = ssl.create_default_context()
+    context.check_hostname = False
+    context.verify_mode = ssl.CERT_NONE
+    deadline = time.perf_counter() + duration
+    latencies, errors, stats = [], [0], []
+    lock = threading.Lock()
+
+    def worker():
+        client = Client(port, context, keepalive, timeout)
+        local = []
+        while time.perf_counter() < deadline:
+            started = time.perf_counter()
+            try:
+                client.request()
+                local.append(time.perf_counter() - started)
+            except Exception:
+                client.close()
+                with lock:
+                    errors[0] += 1
+        client.close()
+        with lock:
+            latencies.extend(local)
+            stats.append((client.handshakes, client.resumed))
+
+    threads = [threading.Thread(target=worker) for _ in range(clients)]
+    started = time.perf_counter()
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    elapsed = time.perf_counter() - started
+
+    latencies.sort()
+
+    def pct(p):
+        return latencies[min(len(latencies) - 1, int(len(latencies) * p))] * 1000 if latencies else float("nan")
+
+    return {
+        "requests": len(latencies),
+        "errors": errors[0],
+        "rps": len(latencies) / elapsed,
+        "p50_ms": pct(0.50),
+        "p99_ms": pct(0.99),
+        "handshakes": sum(h for h, _ in stats),
+        "resumed": sum(r for _, r in stats),
+    }
+
+
+def start_server(kind, port, directory):
+    proc = subprocess.Popen(
+        [sys.executable, "-m", "bench.bench_server", "--serve", kind, "--port", str(port), "--dir", directory],
+        stdout=subprocess.PIPE,
+        stderr=subprocess.DEVNULL,
+        cwd=Path(__file__).resolve().parent.parent,
+        text=True,
+    )
+    proc.stdout.readline()  # "ready"
+    return proc
+
+
+def free_port():
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def bench(kind, args, directory):
+    port = free_port()
+    proc = start_server(kind, port, directory)
+    slow = []
+    try:
+        for _ in range(args.slow_clients):
+            slow.append(socket.create_connection(("127.0.0.1", port)))
+        time.sleep(0.2)
+        return run_load(port, args.clients, args.duration, not args.new_connections, args.timeout)
+    finally:
+        for s in slow:
+            s.close()
+        proc.terminate()
+        proc.wait()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--clients", type=int, default=16)
+    parser.add_argument("--duration", type=float, default=5.0)
+    parser.add_argument("--items", type=int, default=100, help="antal avsnitt i testflödet")
+    parser.add_argument("--new-connections", action="store_true", help="ny anslutning per request")
+    parser.add_argument("--slow-clients", type=int, default=0, help="anslutningar som aldrig handskakar")
+    parser.add_argument("--timeout", type=float, default=5.0, help="klientens socket-timeout")
+    parser.add_argument("--servers", default=",".join(SERVERS))
+    parser.add_argument("--serve", choices=SERVERS, help=argparse.SUPPRESS)
+    parser.add_argument("--port", type=int, help=argparse.SUPPRESS)
+    parser.add_argument("--dir", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.serve:
+        serve(args.serve, args.port, args.dir)
+        return
+
+    import sommar
+
+    with tempfile.TemporaryDirectory() as tmp:
+        make_certificate(tmp)
+        feed = sommar.render_feed(synthetic_episodes(args.items), sommar.FALLBACK_ICON)
+        (Path(tmp) / FEED_NAME).write_bytes(feed)
+
+        mode = "ny anslutning per request" if args.new_connections else "keep-alive"
+        print(
+            f"{args.clients} klienter i {args.duration:g} s, {mode}, flöde {len(feed) / 1024:.0f} kB"
+            + (f", {args.slow_clients} långsamma klienter" if args.slow_clients else "")
+        )
+        print(f"{'server':<10} {'req/s':>9} {'p50 (ms)':>9} {'p99 (ms)':>9} {'fel':>6} {'handsk.':>8} {'återupp.':>9}")
+        for kind in args.servers.split(","):
+            r = bench(kind, args, tmp)
+            print(
+                f"{kind:<10} {r['rps']:>9.0f} {r['p50_ms']:>9.1f} {r['p99_ms']:>9.1f} "
+                f"{r['errors']:>6} {r['handshakes']:>8} {r['resumed']:>9}"
+            )
+
+
+if __name__ == "__main__":
+    main()
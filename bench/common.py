@@ -0,0 +1,127 @@
+"""Gemensamma hjälpfunktioner för benchmarks."""
+import datetime
+import time
+from email.utils import format_datetime
+from pathlib import Path
+
+import store
+
+# Riktiga avsnittssidor från SR, sparade med `python -m bench.bench_parse --save N`
+FIXTURE_DIR = Path(__file__).resolve().parent / "fixtures"
+
+
+def fixture_paths():
+    """De sparade sidorna bench/fixtures/listing-N.html i sidordning.
+
+    Ger FileNotFoundError om det inte finns några, så att en körning som
+    skulle mäta riktiga sidor inte tyst mäter syntetiska i stället.
+    """
+    paths = sorted(FIXTURE_DIR.glob("listing-*.html"), key=lambda p: int(p.stem.rsplit("-", 1)[1]))
+    if not paths:
+        raise FileNotFoundError(
+            f"Inga sparade sidor i {FIXTURE_DIR}: spara dem med "
+            "`python -m bench.bench_parse --save N`, eller kör med syntetiska sidor"
+        )
+    return paths
+
+
+def synthetic_episodes(count, base_url="https://www.sverigesradio.se"):
+    """Skapar `count` påhittade avsnitt (store.Episode), nyast först."""
+    start = datetime.datetime(2025, 8, 17, 7, 0, tzinfo=datetime.timezone.utc)
+    episodes = []
+    for i in range(count):
+        episodes.append(
+            store.Episode(
+                title=f"Sommarpratare {i}",
+                link=f"{base_url}/avsnitt/sommarpratare-{i}",
+                audio=f"https://sverigesradio.se/topsy/ljudfil/srse/{9000000 + i}.mp3",
+                date=format_datetime(start - datetime.timedelta(days=i)),
+                description=f"Sommarpratare nummer {i} berättar om livet, havet & allt däremellan.",
+                image=f"https://static-cdn.sr.se/images/2071/{i:08x}-0000-4000-8000-000000000000.jpg",
+                duration=str(3300 + i % 600),
+                size=50_000_000 + i,
+            )
+        )
+    return episodes
+
+
+def synthetic_listing_html(count, page=1, pages=1, start_index=0, audio_base="//sverigesradio.se"):
+    """Skapar en avsnittssida i samma form som SR:s programsida.
+
+    Sidan har samma struktur och klasser som sommar.py letar efter, plus
+    menyer, skript och sidfot runt listan så att storleken liknar en riktig
+    sida (ca 7 kB per avsnitt). Ljudfilerna länkas under `audio_base`.
+    """
+    start = datetime.datetime(2025, 8, 17, 7, 0)
+    chrome = "".join(
+        f'<li class="main-menu__item"><a class="main-menu__link" href="/kanal/{i}">Kanal {i}</a></li>'
+        for i in range(60)
+    )
+    script = "<script>window.__data = {" + ",".join(f'"k{i}": {i}' for i in range(2000)) + "};</script>"
+    items = []
+    for n in range(start_index, start_index + count):
+        date = start - datetime.timedelta(days=n)
+        related = "".join(
+            f'<li class="related__item"><a href="/artikel/{n}-{r}" class="related__link">'
+            f'<span class="related__title">Relaterat {r} till avsnitt {n}</span></a></li>'
+            for r in range(40)
+        )
+        items.append(
+            f"""<div class="episode-list-item episode-list-item--compact" data-id="{n}">
+  <div class="episode-list-item__image">
+    <picture><img class="image" data-src="//static-cdn.sr.se/images/2071/{n:08x}-aaaa-bbbb-cccc-000000000000.jpg?preset=512x512" src="/img/placeholder.gif" alt=""></picture>
+  </div>
+  <div class="audio-heading">
+    <h2 class="audio-heading__title"><a href="/avsnitt/{9000000 + n}-sommarpratare-{n}" class="heading">Sommarpratare {n} &amp; vänner</a></h2>
+    <div class="audio-heading__meta">
+      <time datetime="{date:%Y-%m-%d %H:%M:%S}Z">{date:%-d %b %Y}</time>
+      <abbr title="1 timme {n % 60} minuter">1 tim {n % 60} min</abbr>
+    </div>
+  </div>
+  <div class="episode-list-item__description"><p>Sommarpratare {n} berättar om livet, havet &amp; allt däremellan. &nbsp;</p></div>
+  <div class="audio-button-group">
+    <button class="audio-button" data-audio-id="{9000000 + n}">Lyssna</button>
+    <a href="{audio_base}/topsy/ljudfil/srse/{9000000 + n}.mp3" download>Ladda ner</a>
+  </div>
+  <ul class="related">{related}</ul>
+</div>"""
+        )
+    pagination = " ".join(
+        f'<a class="pagination__link" href="/avsnitt?programid=2071&amp;page={p}">{p}</a>'
+        for p in range(1, pages + 1)
+    )
+    return f"""<!DOCTYPE html>
+<html lang="sv"><head><meta charset="utf-8"><title>Sommar &amp; Vinter i P1 - Alla avsnitt</title>{script}</head>
+<body><header><nav><ul class="main-menu">{chrome}</ul></nav></header>
+<div class="program-menu"><div class="program-menu__image-wrapper"><div class="image image--square">
+<img src="https://static-cdn.sr.se/images/2071/138fda3c-4e35-48e0-8fdb-e2ea8ef44758.jpg?preset=api-default-square" alt="Sommar">
+</div></div></div>
+<main><div class="episode-list">{"".join(items)}</div>
+<nav class="pagination">{pagination}</nav></main>
+<footer><ul class="footer">{chrome}</ul></footer>{script}</body></html>""".encode("utf-8")
+
+
+def synthetic_episode_html(n):
+    """Skapar avsnittets egen sida, med ingress och brödtext som hos SR."""
+    body = "".join(
+        f"<p>Stycke {k} om sommarpratare {n}: om livet, havet &amp; allt däremellan.</p>" for k in range(1, 4)
+    )
+    return f"""<!DOCTYPE html>
+<html lang="sv"><head><meta charset="utf-8"><title>Sommarpratare {n} &amp; vänner - Sommar &amp; Vinter i P1</title>
+<meta name="description" content="Sommarpratare {n} berättar om livet, havet &amp; allt däremellan.">
+<meta property="og:description" content="Sommarpratare {n} berättar om livet, havet &amp; allt däremellan."></head>
+<body><main><article class="article-details">
+<h1 class="heading h1">Sommarpratare {n} &amp; vänner</h1>
+<div class="publication-preamble text-preamble"><p>Sommarpratare {n} berättar om livet, havet &amp; allt däremellan, och om vad som hände sedan.</p></div>
+<div class="publication-text text-editorial-content">{body}</div>
+</article></main></body></html>""".encode("utf-8")
+
+
+def timed(func, repeat):
+    """Kör func `repeat` gånger och returnerar (bästa tid, sista resultat)."""
+    best, result = float("inf"), None
+    for _ in range(repeat):
+        started = time.perf_counter()
+        result = func()
+        best = min(best, time.perf_counter() - started)
+    return best, result
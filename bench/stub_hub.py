@@ -0,0 +1,140 @@
+"""Lokal WebSub-hubb för att prova pingarna från servera.py utan nätverk.
+
+    python -m bench.stub_hub --port 8766 --fail-rate 0.3 --fetch
+    WEBSUB_HUB=http://127.0.0.1:8766/ python servera.py
+
+Tar emot publish-pingar (POST med hub.mode=publish och hub.url eller
+hub.topic) och svarar 204. En andel `fail_rate` besvaras i stället med
+`fail_status` (och Retry-After: 1), så att nya försök syns. Med `fetch`
+hämtar hubben flödet efter varje ping, som en riktig hubb gör innan den
+skickar det vidare, med If-None-Match från förra hämtningen.
+
+GET /_published visar mottagna pingar och hämtningar som JSON.
+"""
+import argparse
+import json
+import random
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs
+
+import requests
+import urllib3
+
+
+class StubHubHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    def do_POST(self):
+        hub = self.server.hub
+        length = int(self.headers.get("Content-Length") or 0)
+        form = parse_qs(self.rfile.read(length).decode("utf-8"))
+        topic = (form.get("hub.url") or form.get("hub.topic") or [None])[0]
+        if form.get("hub.mode", [None])[0] != "publish" or not topic:
+            self.reply(400, b"hub.mode=publish and hub.url required\n")
+            return
+        if hub.draw_failure():
+            hub.record("failed", topic)
+            self.reply(hub.fail_status, b"try again\n", {"Retry-After": "1"})
+            return
+        hub.record("published", topic)
+        self.reply(204)
+        if hub.fetch:
+            threading.Thread(target=hub.fetch_topic, args=(topic,), daemon=True).start()
+
+    def do_GET(self):
+        if self.path != "/_published":
+            self.reply(404, b"Not found\n")
+            return
+        self.reply(200, json.dumps(self.server.hub.events, indent=2).encode("utf-8"), {"Content-Type": "application/json"})
+
+    def reply(self, status, body=b"", headers=None):
+        self.send_response(status)
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+class StubHub:
+    """En stub-hubb i en bakgrundstråd; `events` är det som hänt, i ordning."""
+
+    def __init__(self, port=0, fail_rate=0.0, fail_status=503, fetch=False, verbose=False, seed=0):
+        self.fail_rate = fail_rate
+        self.fail_status = fail_status
+        self.fetch = fetch
+        self.verbose = verbose
+        self.events = []
+        self._etags = {}
+        self._random = random.Random(seed)
+        self._lock = threading.Lock()
+        self._session = requests.Session()
+        # servera.py har ofta ett självsignerat certifikat lokalt
+        self._session.verify = False
+        urllib3.disable_warnings(urllib3.exceptions.InsecureRequestWarning)
+        self.httpd = ThreadingHTTPServer(("127.0.0.1", port), StubHubHandler)
+        self.httpd.daemon_threads = True
+        self.httpd.hub = self
+
+    @property
+    def url(self):
+        return f"http://127.0.0.1:{self.httpd.server_address[1]}/"
+
+    def __enter__(self):
+        threading.Thread(target=self.httpd.serve_forever, daemon=True).start()
+        return self
+
+    def __exit__(self, *exc):
+        self.httpd.shutdown()
+        self.httpd.server_close()
+
+    def draw_failure(self):
+        with self._lock:
+            return self._random.random() < self.fail_rate
+
+    def record(self, kind, topic, **details):
+        event = {"time": round(time.time(), 3), "kind": kind, "topic": topic, **details}
+        with self._lock:
+            self.events.append(event)
+        if self.verbose:
+            print(f"🧪 {kind}: {topic} {details or ''}")
+
+    def count(self, kind):
+        with self._lock:
+            return sum(1 for event in self.events if event["kind"] == kind)
+
+    def fetch_topic(self, topic):
+        headers = {"If-None-Match": self._etags[topic]} if topic in self._etags else {}
+        try:
+            r = self._session.get(topic, headers=headers, timeout=10)
+        except requests.RequestException as e:
+            self.record("fetch_failed", topic, error=repr(e))
+            return
+        if r.headers.get("ETag"):
+            self._etags[topic] = r.headers["ETag"]
+        self.record("fetched", topic, status=r.status_code, bytes=len(r.content))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--port", type=int, default=8766)
+    parser.add_argument("--fail-rate", type=float, default=0.0, help="andel pingar som besvaras med fel")
+    parser.add_argument("--fail-status", type=int, default=503)
+    parser.add_argument("--fetch", action="store_true", help="hämta flödet efter varje ping")
+    args = parser.parse_args()
+
+    hub = StubHub(args.port, args.fail_rate, args.fail_status, args.fetch, verbose=True)
+    print(f"🧪 Stub-hubb på {hub.url} (WEBSUB_HUB={hub.url})")
+    try:
+        hub.httpd.serve_forever()
+    except KeyboardInterrupt:
+        hub.httpd.server_close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,301 @@
+"""Lokal ersättare för sverigesradio.se, för benchmarks utan nätverk.
+
+    python -m bench.stub_origin --port 8765 --latency 50 --fail-rate 0.05
+
+Serverar avsnittslistan (/avsnitt?programid=…&page=N), avsnittens egna sidor
+(/avsnitt/<id>-…, för ENRICH) och svarar på HEAD och
+Range-anrop för ljudfilerna (/topsy/ljudfil/…) med en påhittad men stabil
+storlek, utan att skicka något ljud. Filerna börjar med en ID3v2-tagg (ibland
+stor, som med en inbäddad omslagsbild) och MP3-ramar: de flesta med ett
+Xing-huvud, var femte som CBR utan, så att speltiden kan läsas ur början.
+
+Sidorna tas från bench/fixtures/listing-N.html (sparade med
+`python -m bench.bench_parse --save N`); länkar till ljudfiler skrivs då om
+så att de pekar på stubben. Finns inga sparade sidor avbryts den med
+FileNotFoundError. Med fixtures=False (--no-fixtures) byggs syntetiska
+sidor med bench.common.synthetic_listing_html.
+
+Fördröjning och fel kan ändras medan stubben kör, antingen via attributen
+på StubOrigin eller med GET /_control?latency=0.05&fail_rate=0.1.
+Sidorna har ETag och svarar 304 på If-None-Match.
+"""
+import argparse
+import hashlib
+import random
+import re
+import struct
+import threading
+import time
+from collections import Counter
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlsplit
+
+from bench.common import fixture_paths, synthetic_episode_html, synthetic_listing_html
+
+SR_AUDIO_RE = re.compile(rb"(?:https?:)?//(?:www\.)?sverigesradio\.se(?=/topsy/)")
+RANGE_RE = re.compile(r"bytes=(\d+)-(\d*)$")
+# MPEG-1 Layer III, 128 kbit/s, 44,1 kHz, stereo: 417 byte och 1152 samplingar per ram
+FRAME_HEADER = b"\xff\xfb\x90\x00"
+FRAME_LENGTH = 417
+
+
+def audio_number(path):
+    # Numret före filändelsen, inte 3:an i ".mp3"
+    digits = re.findall(r"\d+", path.rsplit(".", 1)[0])
+    return int(digits[-1]) if digits else 0
+
+
+def audio_size(path):
+    """Stabil påhittad filstorlek (40–60 MB) utifrån numret i sökvägen."""
+    return 40_000_000 + (audio_number(path) * 7919) % 20_000_000
+
+
+def audio_duration(path):
+    """Speltiden i sekunder som Xing-huvudet anger, eller None för CBR-filer."""
+    n = audio_number(path)
+    return None if n % 5 == 0 else 3300 + n % 600
+
+
+def audio_head(path):
+    """Filens första byte: ID3v2-tagg och några MP3-ramar; resten är nollor."""
+    n = audio_number(path)
+    tag_size = 60_000 if n % 4 == 0 else 2_000
+    synchsafe = bytes((tag_size >> shift) & 0x7F for shift in (21, 14, 7, 0))
+    head = b"ID3\x04\x00\x00" + synchsafe + bytes(tag_size)
+    frames = [FRAME_HEADER + bytes(FRAME_LENGTH - 4) for _ in range(4)]
+    seconds = audio_duration(path)
+    if seconds is not None:
+        # Xing-huvudet ligger efter 32 byte sidoinformation i en stereoram
+        count = round(seconds * 44100 / 1152)
+        xing = b"Xing" + struct.pack(">II", 1, count)
+        frames[0] = FRAME_HEADER + bytes(32) + xing + bytes(FRAME_LENGTH - 4 - 32 - len(xing))
+    return head + b"".join(frames)
+
+
+class StubHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    def do_GET(self):
+        self.respond(head=False)
+
+    def do_HEAD(self):
+        self.respond(head=True)
+
+    def respond(self, head):
+        origin = self.server.origin
+        url = urlsplit(self.path)
+        if url.path == "/_control":
+            origin.configure(**{k: float(v[0]) for k, v in parse_qs(url.query).items()})
+            self.send_body(200, b"ok", head)
+            return
+
+        if url.path.startswith("/topsy/"):
+            kind = "audio"
+        elif url.path.startswith("/avsnitt/"):
+            kind = "detail"
+        else:
+            kind = "page"
+        origin.count(kind)
+        delay, fail = origin.draw(kind)
+        if delay:
+            time.sleep(delay)
+        if fail:
+            origin.count("failed")
+            self.send_body(origin.fail_status, b"", head)
+            return
+
+        if url.path == "/avsnitt":
+            page = int(parse_qs(url.query).get("page", ["1"])[0])
+            body = origin.page(page)
+            if body is None:
+                self.send_body(404, b"", head)
+                return
+            etag = '"' + hashlib.sha1(body).hexdigest()[:16] + '"'
+            if self.headers.get("If-None-Match") == etag:
+                origin.count("not_modified")
+                self.send_response(304)
+                self.send_header("ETag", etag)
+                self.send_header("Content-Length", "0")
+                self.end_headers()
+                return
+            self.send_body(200, body, head, {"ETag": etag, "Content-Type": "text/html; charset=utf-8"})
+        elif kind == "detail":
+            number = re.match(r"/avsnitt/(\d+)", url.path)
+            if number is None:
+                self.send_body(404, b"", head)
+                return
+            body = synthetic_episode_html(int(number.group(1)) - 9000000)
+            self.send_body(200, body, head, {"Content-Type": "text/html; charset=utf-8"})
+        elif kind == "audio":
+            size = audio_size(url.path)
+            requested = RANGE_RE.match(self.headers.get("Range") or "")
+            if requested:
+                start = int(requested.group(1))
+                end = min(int(requested.group(2) or size - 1), size - 1, start + 1_000_000)
+                data = audio_head(url.path)[start : end + 1]
+                body = data + bytes(end + 1 - start - len(data))
+                self.send_body(206, body, head, {"Content-Range": f"bytes {start}-{end}/{size}"})
+            elif origin.head_content_length or not head:
+                # Utan Content-Length på HEAD måste klienten ta Range-vägen
+                self.send_response(200)
+                self.send_header("Content-Type", "audio/mpeg")
+                self.send_header("Content-Length", str(size))
+                self.end_headers()
+                if not head:
+                    self.close_connection = True  # Vi skickar aldrig själva ljudet
+            else:
+                self.send_body(200, b"", head, {"Content-Type": "audio/mpeg"}, length=False)
+        else:
+            self.send_body(404, b"", head)
+
+    def send_body(self, status, body, head, headers=None, length=True):
+        self.send_response(status)
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        if length:
+            self.send_header("Content-Length", str(len(body)))
+        else:
+            self.close_connection = True
+        self.end_headers()
+        if not head:
+            self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+class StubOrigin:
+    """En stub-server i en bakgrundstråd.
+
+    `episodes` och `per_page` styr de syntetiska sidorna. `latency` (s) plus
+    upp till `jitter` (s) läggs på varje request, och en andel `fail_rate`
+    av dem besvaras med `fail_status` – bara för de slag ("page", "detail", "audio")
+    som finns i `fail_kinds`.
+    """
+
+    def __init__(
+        self,
+        port=0,
+        episodes=35,
+        per_page=10,
+        latency=0.0,
+        jitter=0.0,
+        fail_rate=0.0,
+        fail_status=503,
+        fail_kinds=("page", "detail", "audio"),
+        head_content_length=True,
+        fixtures=True,
+        seed=0,
+    ):
+        self.episodes = episodes
+        self.per_page = per_page
+        self.latency = latency
+        self.jitter = jitter
+        self.fail_rate = fail_rate
+        self.fail_status = fail_status
+        self.fail_kinds = tuple(fail_kinds)
+        self.head_content_length = head_content_length
+        self.counts = Counter()
+        self._random = random.Random(seed)
+        self._lock = threading.Lock()
+        self._pages = {}
+        self._fixtures = fixture_paths() if fixtures else []
+        self.httpd = ThreadingHTTPServer(("127.0.0.1", port), StubHandler)
+        self.httpd.daemon_threads = True
+        self.httpd.origin = self
+        self._thread = None
+
+    @property
+    def url(self):
+        return f"http://127.0.0.1:{self.httpd.server_address[1]}"
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc):
+        self.stop()
+
+    def start(self):
+        self._thread = threading.Thread(target=self.httpd.serve_forever, daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self.httpd.shutdown()
+        self.httpd.server_close()
+
+    def configure(self, **settings):
+        with self._lock:
+            for name, value in settings.items():
+                if name in ("latency", "jitter", "fail_rate"):
+                    setattr(self, name, value)
+                elif name == "fail_status":
+                    self.fail_status = int(value)
+
+    def count(self, kind):
+        with self._lock:
+            self.counts[kind] += 1
+
+    def draw(self, kind):
+        """(fördröjning, misslyckas?) för en request av slaget `kind`."""
+        with self._lock:
+            delay = self.latency + (self._random.uniform(0, self.jitter) if self.jitter else 0.0)
+            fail = kind in self.fail_kinds and self._random.random() < self.fail_rate
+            return delay, fail
+
+    def page_count(self):
+        if self._fixtures:
+            return len(self._fixtures)
+        return max(1, -(-self.episodes // self.per_page))
+
+    def page(self, number):
+        if not 1 <= number <= self.page_count():
+            return None
+        with self._lock:
+            if number not in self._pages:
+                self._pages[number] = self._build_page(number)
+            return self._pages[number]
+
+    def _build_page(self, number):
+        if self._fixtures:
+            return SR_AUDIO_RE.sub(self.url.encode(), self._fixtures[number - 1].read_bytes())
+        start = (number - 1) * self.per_page
+        count = min(self.per_page, self.episodes - start)
+        return synthetic_listing_html(
+            count, page=number, pages=self.page_count(), start_index=start, audio_base=self.url
+        )
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--episodes", type=int, default=35, help="antal syntetiska avsnitt")
+    parser.add_argument("--per-page", type=int, default=10)
+    parser.add_argument("--latency", type=float, default=0.0, help="fördröjning per request i ms")
+    parser.add_argument("--jitter", type=float, default=0.0, help="extra slumpmässig fördröjning i ms")
+    parser.add_argument("--fail-rate", type=float, default=0.0, help="andel requests som misslyckas")
+    parser.add_argument("--fail-status", type=int, default=503)
+    parser.add_argument("--fail-kinds", default="page,detail,audio", help="vilka requests som kan misslyckas")
+    parser.add_argument("--no-fixtures", action="store_true", help="använd syntetiska sidor")
+    args = parser.parse_args()
+
+    origin = StubOrigin(
+        port=args.port,
+        episodes=args.episodes,
+        per_page=args.per_page,
+        latency=args.latency / 1000,
+        jitter=args.jitter / 1000,
+        fail_rate=args.fail_rate,
+        fail_status=args.fail_status,
+        fail_kinds=args.fail_kinds.split(","),
+        fixtures=not args.no_fixtures,
+    )
+    print(f"🧪 Stub för SR på {origin.url}/avsnitt?programid=2071 ({origin.page_count()} sidor)")
+    try:
+        origin.httpd.serve_forever()
+    except KeyboardInterrupt:
+        origin.httpd.server_close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,274 @@
+"""Benchmarksvit som körs helt offline mot bench.stub_origin.
+
+    python -m bench.suite --output bench/results/$(git rev-parse --short HEAD).json
+    python -m bench.suite --quick --compare bench/results/abc1234.json
+
+Mäter:
+
+- fetch: fetch_episodes mot stubben, kall (tom databas) och varm (villkorlig
+  GET), i vanligt läge och arkivläge, med fördröjning, med injicerade fel och
+  med exakt speltid ur MP3-huvudet (EXACT_DURATION)
+- render: generate_rss för 10–10 000 syntetiska avsnitt: full rendering samt
+  inkrementell med kall och varm fragmentcache i SQLite
+- serve: servera.py:s genomströmning över TLS med keep-alive (bench_server)
+
+Resultatet är JSON med commit, miljö och ett mått per scenario; med
+--compare skrivs skillnaden mot en tidigare körning ut.
+"""
+import argparse
+import contextlib
+import datetime
+import io
+import json
+import os
+import platform
+import subprocess
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+import sommar
+import store
+from bench import bench_server
+from bench.common import synthetic_episodes
+from bench.stub_origin import StubOrigin
+
+ROOT = Path(__file__).resolve().parent.parent
+SIZES = (10, 100, 1000, 10000)
+QUICK_SIZES = (10, 100, 1000)
+
+
+def git(*args):
+    try:
+        return subprocess.run(
+            ["git", *args], cwd=ROOT, capture_output=True, text=True, check=True
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+@contextlib.contextmanager
+def workdir():
+    """Kör i en tom katalog så att databas, state och flöde inte rör repot."""
+    previous = os.getcwd()
+    with tempfile.TemporaryDirectory() as tmp:
+        os.chdir(tmp)
+        try:
+            yield Path(tmp)
+        finally:
+            os.chdir(previous)
+
+
+@contextlib.contextmanager
+def pointed_at(origin):
+    """Pekar sommar.py mot stubben och tystar dess utskrifter."""
+    saved = sommar.BASE_URL, sommar.PROGRAM_URL, sommar.ARCHIVE_DELAY
+    sommar.BASE_URL = origin.url
+    sommar.PROGRAM_URL = origin.url + "/avsnitt?programid=2071"
+    sommar.ARCHIVE_DELAY = 0.0
+    try:
+        with contextlib.redirect_stdout(io.StringIO()):
+            yield
+    finally:
+        sommar.BASE_URL, sommar.PROGRAM_URL, sommar.ARCHIVE_DELAY = saved
+
+
+@contextlib.contextmanager
+def patched(module, name, value):
+    saved = getattr(module, name)
+    setattr(module, name, value)
+    try:
+        yield
+    finally:
+        setattr(module, name, saved)
+
+
+def run_fetch(origin, db, state, archive, force, max_pages=sommar.ARCHIVE_MAX_PAGES):
+    before = origin.counts.copy()
+    started = time.perf_counter()
+    episodes = sommar.fetch_episodes(
+        db, archive=archive, retention="all", max_pages=max_pages, state=state, force=force
+    )
+    seconds = time.perf_counter() - started
+    episodes = list(episodes) if episodes is not None else None
+    requests = origin.counts - before
+    return {
+        "seconds": seconds,
+        "episodes": len(episodes) if episodes is not None else 0,
+        "unchanged": episodes is None,
+        "missing_size": sum(1 for ep in episodes or () if not ep.size),
+        "page_requests": requests["page"],
+        "audio_requests": requests["audio"],
+        "failed_requests": requests["failed"],
+    }
+
+
+def bench_fetch(args, results):
+    scenarios = [
+        # namn, arkivläge, stubbens inställningar
+        ("listing", False, {"episodes": 10, "latency": args.latency}),
+        ("listing.exact", False, {"episodes": 10, "latency": args.latency}),
+        ("archive", True, {"episodes": args.archive_episodes, "latency": args.latency}),
+        # Var femte storleksuppslag misslyckas; sidan själv svarar alltid
+        (
+            "listing.failures",
+            False,
+            {"episodes": 30, "per_page": 30, "latency": args.latency, "fail_rate": 0.2, "fail_kinds": ["audio"]},
+        ),
+    ]
+    for name, archive, settings in scenarios:
+        with (
+            StubOrigin(fixtures=not args.synthetic, **settings) as origin,
+            workdir(),
+            pointed_at(origin),
+            patched(sommar, "EXACT_DURATION", name.endswith(".exact")),
+        ):
+            with sommar.open_store() as db:
+                state = {}
+                cold = run_fetch(origin, db, state, archive, force=True)
+                # Villkorlig GET med validerarna från den kalla körningen; den
+                # görs bara om det redan finns ett flöde
+                Path(sommar.OUTPUT_FILE).touch()
+                warm = run_fetch(origin, db, state, archive, force=False)
+        params = {"latency_ms": settings["latency"] * 1000, "fail_rate": settings.get("fail_rate", 0.0)}
+        results[f"fetch.{name}.cold"] = {**params, **cold}
+        results[f"fetch.{name}.warm"] = {**params, **warm}
+        print(f"  fetch.{name}: kall {cold['seconds']:.2f} s, varm {warm['seconds']:.2f} s")
+
+
+def bench_render(args, results):
+    for size in args.sizes:
+        episodes = synthetic_episodes(size)
+        timings = {"full": [], "incremental.cold": [], "incremental.warm": []}
+        for _ in range(args.repeat):
+            with workdir() as tmp, contextlib.redirect_stdout(io.StringIO()):
+                feed = str(tmp / "feed.xml")
+                started = time.perf_counter()
+                sommar.generate_rss(
+                    episodes, feed, sommar.FALLBACK_ICON, incremental=False
+                )
+                timings["full"].append(time.perf_counter() - started)
+
+                with store.SqliteStore("episodes.db", sommar.episode_datetime) as db:
+                    db.upsert(episodes)
+                    for phase in ("incremental.cold", "incremental.warm"):
+                        started = time.perf_counter()
+                        sommar.generate_rss(
+                            store.EpisodeView(db), feed, sommar.FALLBACK_ICON, incremental=True, db=db
+                        )
+                        timings[phase].append(time.perf_counter() - started)
+                feed_bytes = os.path.getsize(feed)
+        for phase, values in timings.items():
+            results[f"render.{phase}.{size}"] = {
+                "episodes": size,
+                "seconds": min(values),
+                "feed_bytes": feed_bytes,
+            }
+        print(
+            f"  render {size}: full {min(timings['full']):.3f} s, "
+            f"inkrementell kall {min(timings['incremental.cold']):.3f} s / "
+            f"varm {min(timings['incremental.warm']):.3f} s"
+        )
+
+
+def bench_serve(args, results):
+    with tempfile.TemporaryDirectory() as tmp:
+        bench_server.make_certificate(tmp)
+        feed = sommar.render_feed(synthetic_episodes(args.serve_items), sommar.FALLBACK_ICON)
+        (Path(tmp) / bench_server.FEED_NAME).write_bytes(feed)
+        port = bench_server.free_port()
+        proc = bench_server.start_server("threaded", port, tmp)
+        try:
+            load = bench_server.run_load(port, args.clients, args.duration, True, 5.0)
+        finally:
+            proc.terminate()
+            proc.wait()
+    results["serve.keepalive"] = {
+        "episodes": args.serve_items,
+        "clients": args.clients,
+        "feed_bytes": len(feed),
+        "seconds": args.duration,
+        **load,
+    }
+    print(f"  serve: {load['rps']:.0f} req/s, p99 {load['p99_ms']:.1f} ms")
+
+
+def compare(current, baseline_path):
+    baseline = json.loads(Path(baseline_path).read_text(encoding="utf-8"))
+    print(f"\nJämfört med {baseline.get('commit') or baseline_path}:")
+    print(f"{'scenario':<32} {'före':>10} {'nu':>10} {'ändring':>9}")
+    for name, now in current["results"].items():
+        before = baseline["results"].get(name)
+        if not before:
+            continue
+        # För serve är req/s måttet, annars tid
+        key, unit, higher_is_better = ("rps", "req/s", True) if "rps" in now else ("seconds", "s", False)
+        change = now[key] / before[key] - 1 if before[key] else 0.0
+        worse = change < -0.1 if higher_is_better else change > 0.1
+        print(
+            f"{name:<32} {before[key]:>8.3f}{unit[0]} {now[key]:>8.3f}{unit[0]} "
+            f"{change:>+8.0%}{' ⚠️' if worse else ''}"
+        )
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--only", default="fetch,render,serve", help="kommaseparerad lista av delar")
+    parser.add_argument("--quick", action="store_true", help="mindre storlekar och kortare körningar")
+    parser.add_argument("--sizes", help="antal avsnitt för render, t.ex. 10,100,1000")
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--latency", type=float, default=20.0, help="stubbens fördröjning i ms")
+    parser.add_argument("--archive-episodes", type=int, default=200)
+    parser.add_argument("--synthetic", action="store_true", help="ignorera bench/fixtures")
+    parser.add_argument("--serve-items", type=int, default=100)
+    parser.add_argument("--clients", type=int, default=8)
+    parser.add_argument("--duration", type=float, default=5.0)
+    parser.add_argument("--output", help="skriv JSON hit (annars bara tabell)")
+    parser.add_argument("--compare", metavar="JSON", help="jämför med en tidigare körning")
+    args = parser.parse_args()
+
+    args.latency /= 1000
+    if args.sizes:
+        args.sizes = [int(n) for n in args.sizes.split(",")]
+    else:
+        args.sizes = QUICK_SIZES if args.quick else SIZES
+    if args.quick:
+        args.repeat = 1
+        args.duration = min(args.duration, 2.0)
+        args.archive_episodes = min(args.archive_episodes, 50)
+
+    status = git("status", "--porcelain", "--untracked-files=no")
+    report = {
+        "commit": git("rev-parse", "HEAD"),
+        "dirty": bool(status) if status is not None else None,
+        "timestamp": datetime.datetime.now(datetime.timezone.utc).isoformat(timespec="seconds"),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "settings": {
+            "quick": args.quick,
+            "repeat": args.repeat,
+            "latency_ms": args.latency * 1000,
+            "sizes": list(args.sizes),
+        },
+        "results": {},
+    }
+    parts = {"fetch": bench_fetch, "render": bench_render, "serve": bench_serve}
+    for part in args.only.split(","):
+        print(f"▶️ {part}")
+        parts[part](args, report["results"])
+
+    if args.output:
+        path = Path(args.output)
+        path.parent.mkdir(parents=True, exist_ok=True)
+        path.write_text(json.dumps(report, indent=2, ensure_ascii=False) + "\n", encoding="utf-8")
+        print(f"💾 Resultat sparat i {path}")
+    if args.compare:
+        compare(report, args.compare)
+    if not args.output and not args.compare:
+        json.dump(report, sys.stdout, indent=2, ensure_ascii=False)
+        print()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,318 @@
+"""Gemensamt HTTP-lager för alla hämtningar från SR i sommar.py.
+
+    client = httpclient.Client(session, timeout=(5, 20), retries=3, rate=10)
+    resp = client.get(url)                  # som session.get, med skydd
+    client.summary()                        # rader med statistik per värd
+
+Varje anrop går genom:
+
+- en gemensam budget (token bucket) på högst `rate` anrop per sekund för
+  hela processen, med skurar på upp till `burst`. Anrop med
+  budget="media" (ljudfilerna) har en egen budget, `media_rate`, så att
+  de parallella storleksuppslagen inte köar bakom sidorna; 0 = obegränsat
+- en kretsbrytare per värd: efter `threshold` misslyckade försök i rad
+  avvisas alla anrop till värden direkt med CircuitOpenError i `cooldown`
+  sekunder. Sedan släpps ett provanrop igenom; lyckas det stängs brytaren,
+  annars öppnas den igen. En körning som möter en öppen brytare avbryts
+  alltså snabbt, och det senast skrivna flödet ligger kvar
+- anslutnings- och lästimeout (`timeout`), om anroparen inte anger egen
+- nya försök vid nätverksfel, timeout, 429 och 5xx, med exponentiell
+  väntan och jitter (eller serverns Retry-After)
+
+Svarstider, fel och nya försök samlas per värd; `on_request` anropas
+dessutom med (värd, sekunder, utfall) efter varje försök, t.ex. för
+mätvärden i servera.py.
+"""
+import random
+import re
+import statistics
+import threading
+import time
+from collections import deque
+from urllib.parse import urlsplit
+
+import requests
+
+RETRY_STATUSES = {429, 500, 502, 503, 504}
+MAX_RETRY_AFTER = 60
+# Så många av de senaste svarstiderna per värd används för percentilerna
+LATENCY_WINDOW = 1000
+
+
+class CircuitOpenError(requests.ConnectionError):
+    """Värden har slutat svara och kretsbrytaren är öppen."""
+
+
+class TokenBucket:
+    """Högst `rate` anrop per sekund över alla trådar, med skurar på upp till `burst`."""
+
+    def __init__(self, rate, burst=None):
+        self.rate = rate
+        self.burst = burst or max(1.0, rate)
+        self._tokens = self.burst
+        self._updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def acquire(self):
+        """Väntar tills det finns utrymme i budgeten. Returnerar väntetiden."""
+        with self._lock:
+            now = time.monotonic()
+            self._tokens = min(self.burst, self._tokens + (now - self._updated) * self.rate)
+            self._updated = now
+            self._tokens -= 1
+            # Negativt saldo är en kö: varje tråd väntar på sin egen token
+            delay = -self._tokens / self.rate if self._tokens < 0 else 0.0
+        if delay > 0:
+            time.sleep(delay)
+        return delay
+
+
+class CircuitBreaker:
+    """Kretsbrytare för en värd: "closed", "open" eller "half-open"."""
+
+    def __init__(self, threshold, cooldown):
+        self.threshold = threshold
+        self.cooldown = cooldown
+        self.state = "closed"
+        self.failures = 0
+        self.opened_at = 0.0
+        self._trial = False
+        self._lock = threading.Lock()
+
+    def allow(self):
+        with self._lock:
+            if self.state == "closed":
+                return True
+            if self.state == "open" and time.monotonic() - self.opened_at >= self.cooldown:
+                self.state = "half-open"
+                self._trial = False
+            if self.state == "half-open" and not self._trial:
+                self._trial = True
+                return True
+            return False
+
+    def success(self):
+        with self._lock:
+            self.state = "closed"
+            self.failures = 0
+
+    def failure(self):
+        """Registrerar ett misslyckat försök. True om brytaren öppnades nu."""
+        with self._lock:
+            self.failures += 1
+            if self.state == "half-open" or (self.state == "closed" and self.failures >= self.threshold):
+                self.state = "open"
+                self.opened_at = time.monotonic()
+                return True
+            return False
+
+
+class HostStats:
+    __slots__ = ("requests", "errors", "retries", "rejected", "waited", "latencies")
+
+    def __init__(self):
+        self.requests = 0
+        self.errors = 0
+        self.retries = 0
+        self.rejected = 0
+        self.waited = 0.0
+        self.latencies = deque(maxlen=LATENCY_WINDOW)
+
+
+def retry_after(value, limit=MAX_RETRY_AFTER):
+    """Sekunder ur en Retry-After med sekunder (högst `limit`), annars None."""
+    if value and value.strip().isdigit():
+        return min(int(value.strip()), limit)
+    return None
+
+
+def parse_content_range(value):
+    """(start, totalstorlek) ur t.ex. "bytes 100-199/5000".
+
+    "bytes */5000" ger (None, 5000), och allt annat (None, None).
+    """
+    match = re.fullmatch(r"bytes (?:(\d+)-\d+|\*)/(\d+)", (value or "").strip())
+    if not match:
+        return None, None
+    start = int(match.group(1)) if match.group(1) is not None else None
+    return start, int(match.group(2))
+
+
+class Client:
+    """En requests.Session med timeout, nya försök, budget och kretsbrytare per värd."""
+
+    def __init__(
+        self,
+        session,
+        timeout=(5, 20),
+        retries=3,
+        backoff=0.5,
+        max_backoff=30.0,
+        rate=10.0,
+        burst=None,
+        media_rate=0.0,
+        threshold=5,
+        cooldown=300.0,
+        log=print,
+        on_request=None,
+    ):
+        self.session = session
+        self.timeout = timeout
+        self.retries = retries
+        self.backoff = backoff
+        self.max_backoff = max_backoff
+        self.budgets = {
+            "default": TokenBucket(rate, burst) if rate else None,
+            "media": TokenBucket(media_rate) if media_rate else None,
+        }
+        self.threshold = threshold
+        self.cooldown = cooldown
+        self.log = log
+        self.on_request = on_request
+        self._breakers = {}
+        self._stats = {}
+        self._lock = threading.Lock()
+
+    def breaker(self, host):
+        with self._lock:
+            breaker = self._breakers.get(host)
+            if breaker is None:
+                breaker = self._breakers[host] = CircuitBreaker(self.threshold, self.cooldown)
+            return breaker
+
+    def _host_stats(self, host):
+        stats = self._stats.get(host)
+        if stats is None:
+            stats = self._stats.setdefault(host, HostStats())
+        return stats
+
+    def _delay(self, attempt, response=None):
+        if response is not None:
+            wait = retry_after(response.headers.get("Retry-After"))
+            if wait is not None:
+                return wait
+        return min(self.max_backoff, self.backoff * 2**attempt) * random.uniform(0.5, 1.0)
+
+    def _observe(self, host, seconds, outcome):
+        stats = self._host_stats(host)
+        with self._lock:
+            stats.requests += 1
+            stats.latencies.append(seconds)
+            if outcome == "error":
+                stats.errors += 1
+        if self.on_request:
+            self.on_request(host, seconds, outcome)
+
+    def request(self, method, url, budget="default", **kwargs):
+        """Som session.request. Ger CircuitOpenError om värdens brytare är öppen.
+
+        `budget` är "default" eller "media" (se modulens beskrivning).
+
+        Svar med status i RETRY_STATUSES returneras efter sista försöket,
+        så att anroparen själv kan titta på dem; nätverksfel kastas vidare.
+        """
+        kwargs.setdefault("timeout", self.timeout)
+        host = urlsplit(url).hostname or ""
+        breaker = self.breaker(host)
+        stats = self._host_stats(host)
+        bucket = self.budgets[budget]
+        for attempt in range(self.retries + 1):
+            if not breaker.allow():
+                with self._lock:
+                    stats.rejected += 1
+                raise CircuitOpenError(f"{host} svarar inte, kretsbrytaren är öppen i {self.cooldown:g} s")
+            if bucket:
+                waited = bucket.acquire()
+                with self._lock:
+                    stats.waited += waited
+            started = time.perf_counter()
+            try:
+                resp = self.session.request(method, url, **kwargs)
+            except requests.RequestException as e:
+                self._observe(host, time.perf_counter() - started, "error")
+                self._failed(breaker, host, repr(e))
+                if attempt == self.retries:
+                    raise
+                delay = self._delay(attempt)
+            else:
+                seconds = time.perf_counter() - started
+                if resp.status_code not in RETRY_STATUSES:
+                    # Även 4xx betyder att värden svarar
+                    breaker.success()
+                    self._observe(host, seconds, "ok")
+                    return resp
+                self._observe(host, seconds, "error")
+                self._failed(breaker, host, f"{resp.status_code} {resp.reason}")
+                if attempt == self.retries:
+                    return resp
+                delay = self._delay(attempt, resp)
+                resp.close()
+            with self._lock:
+                stats.retries += 1
+            time.sleep(delay)
+
+    def _failed(self, breaker, host, problem):
+        if breaker.failure():
+            self.log(f"⚡ {host}: {problem} – kretsbrytaren öppen, inga anrop på {self.cooldown:g} s")
+
+    def get(self, url, **kwargs):
+        return self.request("GET", url, **kwargs)
+
+    def head(self, url, **kwargs):
+        return self.request("HEAD", url, **kwargs)
+
+    def circuits(self):
+        """Brytarens läge per värd."""
+        with self._lock:
+            breakers = list(self._breakers.items())
+        return {host: breaker.state for host, breaker in breakers}
+
+    def reset_stats(self):
+        with self._lock:
+            self._stats.clear()
+
+    def stats(self):
+        """Statistik per värd: anrop, fel, nya försök, avvisade, väntan på budgeten,
+        svarstider (p50/p95/max i sekunder) och brytarens läge."""
+        with self._lock:
+            snapshot = {
+                host: (s.requests, s.errors, s.retries, s.rejected, s.waited, list(s.latencies))
+                for host, s in self._stats.items()
+            }
+        result = {}
+        for host, (count, errors, retries, rejected, waited, latencies) in snapshot.items():
+            if len(latencies) >= 2:
+                cuts = statistics.quantiles(latencies, n=20, method="inclusive")
+                p50, p95 = cuts[9], cuts[18]
+            else:
+                p50 = p95 = latencies[0] if latencies else 0.0
+            result[host] = {
+                "requests": count,
+                "errors": errors,
+                "retries": retries,
+                "rejected": rejected,
+                "budget_wait": round(waited, 3),
+                "p50": p50,
+                "p95": p95,
+                "max": max(latencies, default=0.0),
+                "circuit": self.breaker(host).state,
+            }
+        return result
+
+    def summary(self):
+        """En rad per värd, för loggen."""
+        lines = []
+        for host, s in self.stats().items():
+            line = (
+                f"🌐 {host}: {s['requests']} anrop, p50 {s['p50'] * 1000:.0f} ms, "
+                f"p95 {s['p95'] * 1000:.0f} ms, max {s['max'] * 1000:.0f} ms, "
+                f"{s['retries']} nya försök, {s['errors']} fel"
+            )
+            if s["rejected"]:
+                line += f", {s['rejected']} avvisade"
+            if s["budget_wait"] >= 0.1:
+                line += f", {s['budget_wait']:.1f} s i kö för budgeten"
+            if s["circuit"] != "closed":
+                line += f", kretsbrytaren {s['circuit']}"
+            lines.append(line)
+        return lines
@@ -0,0 +1,251 @@
+"""Lokal spegel av avsnittens ljudfiler för servera.py.
+
+    m = mirror.Mirror("media", quota=10 * 2**30, workers=2, session=session, log=print)
+    m.update(all_urls, prefetch_urls)   # efter varje generering
+    m.open(mirror.file_name(url))        # -> (fil, os.stat_result) eller None
+
+Filerna laddas ner i bakgrunden av `workers` trådar, nyaste avsnitten
+först. En avbruten nedladdning ligger kvar som <namn>.part och fortsätter
+med en Range-förfrågan nästa gång; dess byte räknas mot kvoten, och den
+tas bort när avsnittet inte längre är känt. Färdiga filer byter namn
+atomärt, så en fil som kan öppnas är alltid komplett. En fil som är större
+än hela kvoten köas inte igen.
+
+Spegeln håller sig under `quota` byte genom att ta bort den fil som
+serverats längst tillbaka (LRU). Senaste användning hålls i minnet och
+skrivs som filens mtime (högst en gång per TOUCH_INTERVAL), så att
+ordningen överlever en omstart.
+"""
+import hashlib
+import os
+import queue
+import re
+import threading
+import time
+from collections import OrderedDict
+from urllib.parse import urlsplit
+
+import httpclient
+
+SAFE_NAME_RE = re.compile(r"[A-Za-z0-9][A-Za-z0-9._-]{0,100}\.mp3")
+CHUNK_SIZE = 1024 * 1024
+TOUCH_INTERVAL = 3600
+
+
+def file_name(url):
+    """Filnamnet i spegeln för en ljud-url: filnamnet i url:en om det är säkert, annars en hash."""
+    name = urlsplit(url).path.rsplit("/", 1)[-1]
+    if SAFE_NAME_RE.fullmatch(name):
+        return name
+    return hashlib.sha1(url.encode("utf-8")).hexdigest()[:24] + ".mp3"
+
+
+class Mirror:
+    """Ljudfilerna i `directory`, högst `quota` byte.
+
+    `on_download` anropas med "ok", "error" eller "skipped" efter varje
+    nedladdning och `on_evict` med filnamnet för varje borttagen fil.
+    """
+
+    def __init__(self, directory, quota, workers, session, log=print, on_download=None, on_evict=None):
+        self.directory = directory
+        self.quota = quota
+        self.session = session
+        self.log = log
+        self.on_download = on_download
+        self.on_evict = on_evict
+        self.urls = {}  # filnamn -> ljud-url för alla kända avsnitt
+        self._lock = threading.Lock()
+        self._files = OrderedDict()  # filnamn -> storlek, minst nyligen använd först
+        self._parts = {}  # filnamn -> storlek på .part-filen, för nedladdningar som inte pågår
+        self._too_large = set()  # filer som inte ryms i kvoten
+        self._touched = {}
+        self._reserved = 0
+        self._pending = set()
+        self._queue = queue.Queue()
+        os.makedirs(directory, exist_ok=True)
+        self._scan()
+        for _ in range(workers):
+            threading.Thread(target=self._worker, daemon=True).start()
+
+    def path(self, name):
+        return os.path.join(self.directory, name)
+
+    def _scan(self):
+        found = []
+        for entry in os.scandir(self.directory):
+            if not entry.is_file():
+                continue
+            if entry.name.endswith(".mp3"):
+                st = entry.stat()
+                found.append((st.st_mtime, entry.name, st.st_size))
+            elif entry.name.endswith(".mp3.part"):
+                self._parts[entry.name[: -len(".part")]] = entry.stat().st_size
+        for mtime, name, size in sorted(found):
+            self._files[name] = size
+            self._touched[name] = mtime
+
+    def _used(self):
+        # Anropas med self._lock
+        return sum(self._files.values()) + sum(self._parts.values()) + self._reserved
+
+    def _remove_part(self, name):
+        # Anropas med self._lock
+        self._parts.pop(name, None)
+        try:
+            os.remove(self.path(name) + ".part")
+        except FileNotFoundError:
+            pass
+
+    def usage(self):
+        """(antal filer, använda byte) inklusive .part-filer och pågående nedladdningar."""
+        with self._lock:
+            return len(self._files), self._used()
+
+    def update(self, urls, prefetch=()):
+        """Byter listan av kända avsnitt och köar nedladdning av `prefetch`, viktigast först.
+
+        .part-filer för avsnitt som inte längre är kända tas bort.
+        """
+        self.urls = {file_name(url): url for url in urls}
+        with self._lock:
+            for name in [name for name in self._parts if name not in self.urls]:
+                self._remove_part(name)
+                self.log(f"🧹 Tog bort {name}.part ur spegeln (avsnittet finns inte längre)")
+            self._too_large &= self.urls.keys()
+        for url in prefetch:
+            self.request(file_name(url))
+
+    def request(self, name):
+        """Köar en nedladdning av `name` om filen är känd och inte redan finns eller köats."""
+        url = self.urls.get(name)
+        if url is None:
+            return False
+        with self._lock:
+            if name in self._files or name in self._pending or name in self._too_large:
+                return False
+            self._pending.add(name)
+        self._queue.put(name)
+        return True
+
+    def open(self, name):
+        """Öppnar en färdig fil och markerar den som använd: (fil, os.stat_result) eller None.
+
+        mtime ändras när filen används, så den duger inte som validerare;
+        inod och storlek gör det, eftersom en färdig fil aldrig skrivs om.
+        """
+        with self._lock:
+            if name not in self._files:
+                return None
+            self._files.move_to_end(name)
+            now = time.time()
+            touch = now - self._touched.get(name, 0) > TOUCH_INTERVAL
+            if touch:
+                self._touched[name] = now
+        try:
+            f = open(self.path(name), "rb")
+        except FileNotFoundError:
+            with self._lock:
+                self._files.pop(name, None)
+            return None
+        st = os.fstat(f.fileno())
+        if touch:
+            try:
+                os.utime(f.fileno(), (now, now))
+            except OSError:
+                pass
+        return f, st
+
+    def _make_room(self, name, size):
+        """Reserverar `size` byte för hela filen `name` och tar bort de minst
+        nyligen använda filerna vid behov, och sist andras .part-filer.
+
+        Filens egen .part ingår i `size` och räknas därför inte två gånger.
+        """
+        with self._lock:
+            if size > self.quota:
+                self._too_large.add(name)
+                self._remove_part(name)
+                return False
+            part = self._parts.pop(name, 0)
+            while self._files and self._used() + size > self.quota:
+                evicted, _ = self._files.popitem(last=False)
+                self._touched.pop(evicted, None)
+                # Öppna filer (pågående uppspelningar) kan läsas klart även när namnet är borta
+                try:
+                    os.remove(self.path(evicted))
+                except FileNotFoundError:
+                    pass
+                self.log(f"🧹 Tog bort {evicted} ur spegeln (LRU)")
+                if self.on_evict:
+                    self.on_evict(evicted)
+            for other in list(self._parts):
+                if self._used() + size <= self.quota:
+                    break
+                self._remove_part(other)
+                self.log(f"🧹 Tog bort {other}.part ur spegeln (plats behövs)")
+            if self._used() + size > self.quota:
+                if part:
+                    self._parts[name] = part
+                return False
+            self._reserved += size
+            return True
+
+    def _worker(self):
+        while True:
+            name = self._queue.get()
+            try:
+                result = self._download(name)
+            except Exception as e:
+                result = "error"
+                self.log(f"⚠️ Kunde inte spegla {name}: {e!r}")
+            with self._lock:
+                self._pending.discard(name)
+            if self.on_download:
+                self.on_download(result)
+
+    def _download(self, name):
+        url = self.urls.get(name)
+        if url is None:
+            return "skipped"
+        final, part = self.path(name), self.path(name) + ".part"
+        offset = os.path.getsize(part) if os.path.exists(part) else 0
+        headers = {"Range": f"bytes={offset}-"} if offset else {}
+        started = time.perf_counter()
+        with self.session.get(url, headers=headers, stream=True, timeout=30) as r:
+            start, total = httpclient.parse_content_range(r.headers.get("Content-Range"))
+            if r.status_code == 206 and start == offset:
+                mode = "ab"
+            elif r.status_code == 200:
+                offset, mode = 0, "wb"
+                total = int(r.headers.get("Content-Length") or 0)
+            else:
+                r.raise_for_status()
+                raise OSError(f"oväntat svar {r.status_code} ({r.headers.get('Content-Range')})")
+            if not total:
+                raise OSError("okänd filstorlek")
+            if not self._make_room(name, total):
+                self.log(f"⚠️ {name} ({total} bytes) ryms inte i spegelns kvot")
+                return "skipped"
+            try:
+                with open(part, mode) as f:
+                    for chunk in r.iter_content(CHUNK_SIZE):
+                        f.write(chunk)
+                size = os.path.getsize(part)
+                if size != total:
+                    # .part ligger kvar, och nästa försök fortsätter där det slutade
+                    raise OSError(f"fick {size} av {total} bytes")
+                os.replace(part, final)
+            except BaseException:
+                with self._lock:
+                    self._reserved -= total
+                    if os.path.exists(part):
+                        self._parts[name] = os.path.getsize(part)
+                raise
+        with self._lock:
+            self._reserved -= total
+            self._files[name] = size
+            self._touched[name] = time.time()
+        resumed = f", fortsatte från {offset} bytes" if offset else ""
+        self.log(f"📥 Speglade {name} ({size} bytes på {time.perf_counter() - started:.1f} s{resumed})")
+        return "ok"
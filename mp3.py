@@ -0,0 +1,139 @@
+"""Speltid för MP3-filer ur de första kilobyten, utan beroenden.
+
+    start = mp3.id3v2_length(head)           # ljudet börjar efter ID3v2-taggen
+    mp3.duration(head[start:], size - start)  # -> sekunder eller None
+
+Speltiden tas i första hand ur VBR-huvudet i den första ramen (Xing/Info
+från LAME m.fl., eller Fraunhofers VBRI), som anger antalet ramar. Saknas
+det räknas filen som CBR och tiden blir ljuddatans storlek delad med
+bithastigheten i den första ramen.
+"""
+import struct
+
+# Bithastigheter i kbit/s per (MPEG-version, lager), index 1–14 i ramhuvudet
+BITRATES = {
+    (1, 1): (0, 32, 64, 96, 128, 160, 192, 224, 256, 288, 320, 352, 384, 416, 448),
+    (1, 2): (0, 32, 48, 56, 64, 80, 96, 112, 128, 160, 192, 224, 256, 320, 384),
+    (1, 3): (0, 32, 40, 48, 56, 64, 80, 96, 112, 128, 160, 192, 224, 256, 320),
+    (2, 1): (0, 32, 48, 56, 64, 80, 96, 112, 128, 144, 160, 176, 192, 224, 256),
+    (2, 2): (0, 8, 16, 24, 32, 40, 48, 56, 64, 80, 96, 112, 128, 144, 160),
+    (2, 3): (0, 8, 16, 24, 32, 40, 48, 56, 64, 80, 96, 112, 128, 144, 160),
+}
+SAMPLE_RATES = {1: (44100, 48000, 32000), 2: (22050, 24000, 16000), 2.5: (11025, 12000, 8000)}
+# Versionsbitarna i ramhuvudet: 0 = MPEG 2.5, 1 = reserverad, 2 = MPEG 2, 3 = MPEG 1
+VERSIONS = {0: 2.5, 2: 2, 3: 1}
+XING_FRAMES_FLAG = 0x1
+
+
+class Frame:
+    """Ett tolkat MPEG-ramhuvud (4 byte)."""
+
+    __slots__ = ("version", "layer", "bitrate", "sample_rate", "mono", "length", "samples")
+
+    def __init__(self, version, layer, bitrate, sample_rate, padding, mono):
+        self.version = version
+        self.layer = layer
+        self.bitrate = bitrate  # bit/s
+        self.sample_rate = sample_rate
+        self.mono = mono
+        if layer == 1:
+            self.samples = 384
+            self.length = (12 * bitrate // sample_rate + padding) * 4
+        else:
+            self.samples = 576 if layer == 3 and version != 1 else 1152
+            self.length = self.samples // 8 * bitrate // sample_rate + padding
+
+    def same_stream(self, other):
+        return (self.version, self.layer, self.sample_rate) == (other.version, other.layer, other.sample_rate)
+
+
+def parse_frame(data, offset):
+    """Ramhuvudet vid `offset`, eller None om där inte börjar en giltig ram."""
+    if offset + 4 > len(data) or data[offset] != 0xFF or data[offset + 1] & 0xE0 != 0xE0:
+        return None
+    b1, b2, b3 = data[offset + 1], data[offset + 2], data[offset + 3]
+    version = VERSIONS.get((b1 >> 3) & 3)
+    layer = 4 - ((b1 >> 1) & 3)
+    bitrate_index = b2 >> 4
+    rate_index = (b2 >> 2) & 3
+    # Lager 4 är den reserverade 0:an; "free format" (0) och 15 går inte att räkna på
+    if version is None or layer == 4 or bitrate_index in (0, 15) or rate_index == 3:
+        return None
+    table = BITRATES[1 if version == 1 else 2, layer]
+    return Frame(
+        version,
+        layer,
+        table[bitrate_index] * 1000,
+        SAMPLE_RATES[version][rate_index],
+        (b2 >> 1) & 1,
+        (b3 >> 6) == 3,
+    )
+
+
+def id3v2_length(data):
+    """Längden på en ID3v2-tagg i början av filen (0 om den saknas)."""
+    if len(data) < 10 or data[:3] != b"ID3":
+        return 0
+    # Storleken är "synchsafe": fyra byte med sju bitar var
+    size = (data[6] & 0x7F) << 21 | (data[7] & 0x7F) << 14 | (data[8] & 0x7F) << 7 | (data[9] & 0x7F)
+    footer = 10 if data[5] & 0x10 else 0
+    return 10 + size + footer
+
+
+def first_frame(data):
+    """(position, ram) för den första ramen i `data`, eller (None, None).
+
+    En synkad ram räknas bara om nästa ram, när den ryms i `data`, också är
+    giltig och hör till samma ström; annars kan skräp före ljudet som råkar
+    börja med 0xFFE tas för en ram.
+    """
+    offset = data.find(b"\xff")
+    while 0 <= offset:
+        frame = parse_frame(data, offset)
+        if frame is not None:
+            following = offset + frame.length
+            if following + 4 > len(data):
+                return offset, frame
+            nxt = parse_frame(data, following)
+            if nxt is not None and frame.same_stream(nxt):
+                return offset, frame
+        offset = data.find(b"\xff", offset + 1)
+    return None, None
+
+
+def vbr_frames(data, offset, frame):
+    """Antalet ramar ur ett Xing/Info- eller VBRI-huvud i ramen vid `offset`."""
+    if frame.layer != 3:
+        return None
+    # Xing-huvudet ligger efter sidoinformationen, vars storlek beror på version och kanaler
+    if frame.version == 1:
+        side_info = 17 if frame.mono else 32
+    else:
+        side_info = 9 if frame.mono else 17
+    xing = offset + 4 + side_info
+    if data[xing : xing + 4] in (b"Xing", b"Info") and len(data) >= xing + 12:
+        flags = struct.unpack(">I", data[xing + 4 : xing + 8])[0]
+        if flags & XING_FRAMES_FLAG:
+            return struct.unpack(">I", data[xing + 8 : xing + 12])[0] or None
+        return None
+    vbri = offset + 36
+    if data[vbri : vbri + 4] == b"VBRI" and len(data) >= vbri + 18:
+        return struct.unpack(">I", data[vbri + 14 : vbri + 18])[0] or None
+    return None
+
+
+def duration(data, audio_bytes):
+    """Speltiden i sekunder, eller None om `data` inte innehåller någon MP3-ram.
+
+    `data` är filens byte från slutet av ID3v2-taggen och `audio_bytes`
+    antalet byte därifrån till filens slut; det behövs bara för CBR-filer.
+    """
+    offset, frame = first_frame(data)
+    if frame is None:
+        return None
+    frames = vbr_frames(data, offset, frame)
+    if frames is not None:
+        return frames * frame.samples / frame.sample_rate
+    if audio_bytes <= offset:
+        return None
+    return (audio_bytes - offset) * 8 / frame.bitrate
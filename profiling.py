@@ -0,0 +1,241 @@
+"""Steg-profilering av körningar i sommar.py, utan beroenden.
+
+    with profiling.profile("profile.jsonl", cprofile="run.prof") as prof:
+        with profiling.stage("fetch"):
+            ...
+        prof.info["changed"] = True
+
+Varje steg får tid, antal anrop och högsta minne (tracemalloc) utöver
+det som var allokerat när steget började. Steg kan ligga i varandra och
+namnges efter sin väg, t.ex. "sommar/render/postprocess". När ingen
+profilering pågår är stage() en delad nullcontext, så anropen kostar
+nästan ingenting.
+
+tracemalloc mäter hela processen, så minnet mäts bara i den tråd som
+öppnade det yttersta steget. Steg i andra trådar (t.ex. sidor som hämtas
+parallellt i arkivläge) får tid och antal anrop men inget minne, och
+räknas direkt under det yttersta steget; deras tider summeras, så de kan
+bli längre än körningen. cProfile följer också bara den första tråden.
+
+När profileringen slutar skrivs en sammanfattning, och en JSON-rad per
+körning läggs till i filen, så att utvecklingen över tid syns med:
+
+    python profiling.py profile.jsonl
+"""
+import argparse
+import contextlib
+import cProfile
+import datetime
+import json
+import os
+import threading
+import time
+import tracemalloc
+
+NULL_STAGE = contextlib.nullcontext()
+
+# Profileringen som pågår, eller None
+ACTIVE = None
+
+
+class Profiler:
+    """Samlar tid och minne per steg för en körning."""
+
+    def __init__(self, cprofile=None):
+        self.totals = {}  # väg -> [anrop, sekunder, högsta minne i byte eller None]
+        self.info = {}
+        self.cprofile = cProfile.Profile() if cprofile else None
+        self.owner = None
+        # Högsta minnet sedan start: stegen nollställer tracemalloc:s topp
+        self.peak = 0
+        self._stack = []  # [väg, början, minne vid början, högsta minne] för ägartråden
+        self._local = threading.local()
+        self._lock = threading.Lock()
+
+    def _enter(self, path):
+        # Stegen visas i den ordning de först började, så att ett steg står före sina delsteg
+        with self._lock:
+            self.totals.setdefault(path, [0, 0.0, None])
+
+    def _record(self, path, seconds, peak):
+        with self._lock:
+            entry = self.totals[path]
+            entry[0] += 1
+            entry[1] += seconds
+            if peak is not None:
+                entry[2] = peak if entry[2] is None else max(entry[2], peak)
+
+    @contextlib.contextmanager
+    def stage(self, name):
+        thread = threading.get_ident()
+        if self.owner is None and not getattr(self._local, "stack", None):
+            # Första steget i en tråd när ingen annan mäter: den här tråden får minnet
+            with self._lock:
+                if self.owner is None:
+                    self.owner = thread
+                    if self.cprofile:
+                        self.cprofile.enable()
+        if thread == self.owner:
+            try:
+                with self._measured(name):
+                    yield
+            finally:
+                if not self._stack:
+                    if self.cprofile:
+                        self.cprofile.disable()
+                    self.owner = None
+            return
+
+        stack = self._local.__dict__.setdefault("stack", [])
+        owner_stack = self._stack
+        parent = stack[-1] if stack else (owner_stack[0][0] if owner_stack else "")
+        path = f"{parent}/{name}" if parent else name
+        self._enter(path)
+        stack.append(path)
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            stack.pop()
+            self._record(path, time.perf_counter() - started, None)
+
+    @contextlib.contextmanager
+    def _measured(self, name):
+        current, peak = tracemalloc.get_traced_memory()
+        self.peak = max(self.peak, peak)
+        if self._stack:
+            parent = self._stack[-1]
+            parent[3] = max(parent[3], peak)
+            path = f"{parent[0]}/{name}"
+        else:
+            path = name
+        self._enter(path)
+        tracemalloc.reset_peak()
+        frame = [path, time.perf_counter(), current, current]
+        self._stack.append(frame)
+        try:
+            yield
+        finally:
+            seconds = time.perf_counter() - frame[1]
+            _, peak = tracemalloc.get_traced_memory()
+            self.peak = max(self.peak, peak)
+            frame[3] = max(frame[3], peak)
+            self._stack.pop()
+            tracemalloc.reset_peak()
+            if self._stack:
+                parent = self._stack[-1]
+                parent[3] = max(parent[3], frame[3])
+            self._record(path, seconds, frame[3] - frame[2])
+
+    def stages(self):
+        """Stegen i den ordning de först kördes, som dictar för JSON-raden."""
+        with self._lock:
+            items = list(self.totals.items())
+        return [
+            {"stage": path, "calls": calls, "seconds": round(seconds, 4), "peak_bytes": peak}
+            for path, (calls, seconds, peak) in items
+        ]
+
+    def summary(self, total):
+        """Tabell över stegen, med andel av `total` sekunder."""
+        lines = [f"{'steg':<34} {'anrop':>6} {'tid (s)':>9} {'andel':>6} {'minne (MB)':>11}"]
+        for row in self.stages():
+            depth = row["stage"].count("/")
+            name = "  " * depth + row["stage"].rsplit("/", 1)[-1]
+            share = row["seconds"] / total if total else 0
+            memory = f"{row['peak_bytes'] / 2**20:.1f}" if row["peak_bytes"] is not None else "–"
+            lines.append(f"{name:<34} {row['calls']:>6} {row['seconds']:>9.3f} {share:>6.0%} {memory:>11}")
+        return "\n".join(lines)
+
+
+def stage(name):
+    """Kontext för ett steg i den pågående profileringen (ingenting annars)."""
+    profiler = ACTIVE
+    return NULL_STAGE if profiler is None else profiler.stage(name)
+
+
+def active():
+    return ACTIVE is not None
+
+
+@contextlib.contextmanager
+def profile(path, cprofile=None, log=print):
+    """Profilerar allt i with-blocket.
+
+    Skriver sammanfattningen med `log` och lägger en JSON-rad i `path`;
+    fält i `prof.info` kommer med i raden. Med `cprofile` sparas även
+    cProfile-statistik dit (läses med `python -m pstats`).
+    """
+    global ACTIVE
+    if ACTIVE is not None:
+        raise RuntimeError("profilering pågår redan")
+    profiler = Profiler(cprofile)
+    started_at = datetime.datetime.now(datetime.timezone.utc)
+    started_tracing = not tracemalloc.is_tracing()
+    if started_tracing:
+        tracemalloc.start()
+    ACTIVE = profiler
+    started = time.perf_counter()
+    error = None
+    try:
+        yield profiler
+    except BaseException as e:
+        error = repr(e)
+        raise
+    finally:
+        duration = time.perf_counter() - started
+        ACTIVE = None
+        _, peak = tracemalloc.get_traced_memory()
+        peak = max(peak, profiler.peak)
+        if started_tracing:
+            tracemalloc.stop()
+        record = {
+            "started": started_at.isoformat(timespec="seconds"),
+            "duration": round(duration, 4),
+            "pid": os.getpid(),
+            **profiler.info,
+            "stages": profiler.stages(),
+        }
+        if error:
+            record["error"] = error
+        if cprofile:
+            profiler.cprofile.dump_stats(cprofile)
+            record["cprofile"] = cprofile
+        with open(path, "a", encoding="utf-8") as f:
+            f.write(json.dumps(record, ensure_ascii=False) + "\n")
+        log(f"🔬 Profil ({duration:.2f} s, högst {peak / 2**20:.1f} MB sedan start):\n{profiler.summary(duration)}")
+        log(f"🔬 Profilen sparad i {path}" + (f", cProfile i {cprofile}" if cprofile else ""))
+
+
+def trend(records, depth=1, last=20):
+    """Tabell med sekunder per steg (upp till `depth` nivåer) för de senaste körningarna."""
+    records = records[-last:]
+    columns = []
+    for record in records:
+        for row in record["stages"]:
+            if row["stage"].count("/") < depth and row["stage"] not in columns:
+                columns.append(row["stage"])
+    widths = [max(6, len(c)) for c in columns]
+    lines = [f"{'start':<20} {'total':>8} " + " ".join(f"{c:>{w}}" for c, w in zip(columns, widths))]
+    for record in records:
+        seconds = {row["stage"]: row["seconds"] for row in record["stages"]}
+        cells = " ".join(
+            f"{seconds[c]:>{w}.2f}" if c in seconds else f"{'–':>{w}}" for c, w in zip(columns, widths)
+        )
+        lines.append(f"{record['started'][:19]:<20} {record['duration']:>8.2f} {cells}")
+    return "\n".join(lines)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Visar sparade profiler från sommar.py --profile över tid.")
+    parser.add_argument("file", nargs="?", default="profile.jsonl")
+    parser.add_argument("--depth", type=int, default=2, help="antal nivåer av steg att visa")
+    parser.add_argument("--last", type=int, default=20, help="antal körningar att visa")
+    args = parser.parse_args(argv)
+    with open(args.file, encoding="utf-8") as f:
+        records = [json.loads(line) for line in f if line.strip()]
+    print(trend(records, args.depth, args.last))
+
+
+if __name__ == "__main__":
+    main()
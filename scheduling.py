@@ -0,0 +1,144 @@
+"""Schemaläggning av genereringar för servera.py.
+
+Två scheman med samma gränssnitt, next_run(now, found_new):
+
+- FixedSchedule: fasta klockslag varje dag (SCHEDULE_TIMES).
+- AdaptiveSchedule: lär sig när avsnitten brukar publiceras, som veckodag
+  och timme, ur publiceringstiderna i avsnittsdatabasen. Runt de tiderna
+  kollar den ofta. Annars växer intervallet exponentiellt för varje körning
+  utan nya avsnitt, upp till ett tak, med lite slump så att körningarna inte
+  hamnar i takt med något annat. Har inget publicerats på ett tag (säsongen
+  är slut) används bara det växande intervallet.
+
+Tider är lokal tid som naiva datetime, som datetime.now().
+"""
+import datetime
+import random
+from collections import Counter
+
+# Så många av de senaste avsnitten per program används för att lära sig mönstret
+HISTORY = 100
+# En veckodag och timme räknas som publiceringstid om minst så många avsnitt kommit då
+MIN_SLOT_COUNT = 2
+
+
+def parse_times(text):
+    """"07:05,13:00,19:00" -> [(7, 5), (13, 0), (19, 0)]"""
+    times = []
+    for part in text.split(","):
+        hour, minute = part.strip().split(":")
+        times.append((int(hour), int(minute)))
+    return sorted(times)
+
+
+class FixedSchedule:
+    """Kör vid samma klockslag varje dag."""
+
+    def __init__(self, times):
+        self.times = times
+
+    def learn(self, timestamps):
+        pass
+
+    def next_run(self, now, found_new=False):
+        candidates = []
+        for hour, minute in self.times:
+            t = now.replace(hour=hour, minute=minute, second=0, microsecond=0)
+            # Om redan passerat, addera en dag
+            candidates.append(t if t > now else t + datetime.timedelta(days=1))
+        return min(candidates), "fast schema"
+
+
+class AdaptiveSchedule:
+    """Kollar ofta när avsnitt brukar komma och allt glesare annars.
+
+    Efter en körning med nya avsnitt börjar intervallet om på `interval`
+    sekunder och multipliceras sedan med `backoff` för varje körning utan
+    nya avsnitt, upp till `max_interval`. Inom `hot_window` minuter från en
+    inlärd publiceringstid körs var `hot_interval`:e sekund, och det växande
+    intervallet får aldrig hoppa över början av ett sådant fönster. Allt
+    utom väntan fram till ett fönster varieras med ±`jitter` (andel).
+    """
+
+    def __init__(
+        self,
+        interval=1800,
+        max_interval=43200,
+        backoff=2.0,
+        hot_interval=300,
+        hot_window=60,
+        jitter=0.1,
+        season_days=14,
+        rng=None,
+    ):
+        self.interval = interval
+        self.max_interval = max_interval
+        self.backoff = backoff
+        self.hot_interval = hot_interval
+        self.hot_window = datetime.timedelta(minutes=hot_window)
+        self.jitter = jitter
+        self.season = datetime.timedelta(days=season_days)
+        self.rng = rng or random.Random()
+        self.slots = set()
+        self.last_published = None
+        self._current = interval
+        self._done_until = None
+        self._started = False
+
+    def learn(self, timestamps):
+        """Lär sig publiceringstiderna ur unix-tider, nyast först."""
+        counts = Counter()
+        self.last_published = None
+        for ts in timestamps:
+            published = datetime.datetime.fromtimestamp(ts)
+            if self.last_published is None:
+                self.last_published = published
+            counts[published.weekday(), published.hour] += 1
+        self.slots = {slot for slot, count in counts.items() if count >= MIN_SLOT_COUNT}
+
+    def in_season(self, now):
+        return self.last_published is not None and now - self.last_published <= self.season
+
+    def windows(self, now):
+        """Publiceringsfönster (start, slut) som inte redan passerat, en vecka framåt."""
+        today = now.replace(hour=0, minute=0, second=0, microsecond=0)
+        windows = []
+        for days in range(-1, 8):
+            day = today + datetime.timedelta(days=days)
+            for weekday, hour in self.slots:
+                if day.weekday() != weekday:
+                    continue
+                start = day.replace(hour=hour) - self.hot_window
+                end = day.replace(hour=hour) + datetime.timedelta(hours=1) + self.hot_window
+                if end > now:
+                    windows.append((start, end))
+        return sorted(windows)
+
+    def _jittered(self, seconds):
+        return seconds * (1 + self.rng.uniform(-self.jitter, self.jitter))
+
+    def next_run(self, now, found_new=False):
+        """Nästa körning efter en körning som slutade `now`, och varför.
+
+        Första anropet, före första körningen, väntar `interval` utan backoff.
+        """
+        windows = self.windows(now) if self.in_season(now) else []
+        current = next(((s, e) for s, e in windows if s <= now < e), None)
+        if found_new:
+            self._current = self.interval
+            # Dagens avsnitt har kommit, resten av fönstret behöver inte bevakas
+            if current is not None:
+                self._done_until = current[1]
+        elif self._started:
+            self._current = min(self.max_interval, self._current * self.backoff)
+        self._started = True
+        windows = [w for w in windows if self._done_until is None or w[1] > self._done_until]
+
+        for start, end in windows:
+            if start <= now < end:
+                return now + datetime.timedelta(seconds=self._jittered(self.hot_interval)), "publiceringsfönster"
+            wait = datetime.timedelta(seconds=self._jittered(self._current))
+            if start <= now + wait:
+                return start, "publiceringsfönster börjar"
+            break
+        return now + datetime.timedelta(seconds=self._jittered(self._current)), "backoff"
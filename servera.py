@@ -1,28 +1,258 @@
+import atexit
+import gzip
+import hashlib
+import hmac
+import logging
+import logging.handlers
 import os
+import queue
+import random
+import re
 import signal
 import ssl
-import subprocess
 import sys
 import threading
 import time
-from datetime import datetime, timedelta
-from http.server import BaseHTTPRequestHandler, HTTPServer
+from datetime import datetime
+from itertools import islice
+from email.utils import formatdate, parsedate_to_datetime
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
 from pathlib import Path
+from urllib.parse import parse_qs, urlsplit
 
 from dotenv import load_dotenv
 
-LOG_FILE = Path("server.log")
+import metrics
+import mirror
+import scheduling
+import sommar
+import websub
+
+try:
+    import brotli
+except ImportError:  # valfritt: utan brotli serveras bara gzip
+    brotli = None
+
+load_dotenv()
+
+# Ställ in port
+port_env = os.environ.get("PORT")
+PORT = int(port_env) if port_env else 443
+
+# Läs in sökvägar till certifikat från .env
+cert_env = os.environ.get("SSL_CHAIN")
+key_env = os.environ.get("SSL_KEY")
+CERT_FILE = Path(cert_env) if cert_env else Path("ssl/fullchain.pem")
+KEY_FILE = Path(key_env) if key_env else Path("ssl/privkey.pem")
+
+# Flödena som serveras: RSS_FILE, eller ett per program i PROGRAMS_FILE
+PROGRAMS = sommar.configured_programs()
+
+# Ställ in loggfil och rotation: "size" roterar vid LOG_MAX_BYTES, "daily" vid midnatt
+log_file_env = os.environ.get("LOG_FILE")
+LOG_FILE = Path(log_file_env) if log_file_env else Path("server.log")
+log_rotate_env = os.environ.get("LOG_ROTATE")
+LOG_ROTATE = log_rotate_env.strip().lower() if log_rotate_env else "size"
+log_max_bytes_env = os.environ.get("LOG_MAX_BYTES")
+LOG_MAX_BYTES = int(log_max_bytes_env) if log_max_bytes_env else 5_000_000
+log_backups_env = os.environ.get("LOG_BACKUPS")
+LOG_BACKUPS = int(log_backups_env) if log_backups_env else 5
+
+# Slå av/på accessloggen; ACCESS_LOG_SAMPLE < 1 loggar bara en andel av lyckade requests
+access_log_env = os.environ.get("ACCESS_LOG", "true").strip().lower()
+ACCESS_LOG = access_log_env in ("1", "true", "yes", "on")
+sample_env = os.environ.get("ACCESS_LOG_SAMPLE")
+ACCESS_LOG_SAMPLE = min(1.0, max(0.0, float(sample_env))) if sample_env else 1.0
+
+# Så många rader kan vänta på att skrivas; blir kön full kastas nya rader
+LOG_QUEUE_SIZE = 10_000
+
+# Så ofta (s) kollas om en annan process bytt ut flödesfilerna; 0 stänger av
+watch_env = os.environ.get("FEED_WATCH_INTERVAL")
+FEED_WATCH_INTERVAL = max(0.0, float(watch_env)) if watch_env else 5.0
+
+# Ställ in hur länge klienter och proxyer får cacha flödet
+max_age_env = os.environ.get("CACHE_MAX_AGE")
+CACHE_MAX_AGE = int(max_age_env) if max_age_env else 900
+
+# Ställ in max antal samtidiga anslutningar; fler får vänta i kön
+max_conn_env = os.environ.get("MAX_CONNECTIONS")
+MAX_CONNECTIONS = max(1, int(max_conn_env)) if max_conn_env else 64
+
+# Ställ in timeout (sekunder) för TLS-handskakning och vilande keep-alive
+timeout_env = os.environ.get("CONNECTION_TIMEOUT")
+CONNECTION_TIMEOUT = float(timeout_env) if timeout_env else 15.0
+
+# Token för /admin/refresh; utan token är admin-endpointen avstängd
+admin_env = os.environ.get("ADMIN_TOKEN")
+ADMIN_TOKEN = admin_env.strip() if admin_env else None
+
+# Slå av/på /metrics
+metrics_env = os.environ.get("METRICS", "true").strip().lower()
+METRICS_ENABLED = metrics_env in ("1", "true", "yes", "on")
+METRICS_PATH = "/metrics"
+ADMIN_PATH = "/admin/refresh"
+
+# Ställ in schemat: "adaptive" lär sig när avsnitten publiceras, "fixed" kör vid SCHEDULE_TIMES
+schedule_env = os.environ.get("SCHEDULE", "adaptive").strip().lower()
+SCHEDULE = schedule_env if schedule_env in ("adaptive", "fixed") else "adaptive"
+times_env = os.environ.get("SCHEDULE_TIMES")
+SCHEDULE_TIMES = scheduling.parse_times(times_env if times_env else "07:05,13:00,19:00")
+poll_env = os.environ.get("POLL_INTERVAL")
+POLL_INTERVAL = max(60, int(poll_env)) if poll_env else 1800
+poll_max_env = os.environ.get("POLL_MAX_INTERVAL")
+POLL_MAX_INTERVAL = max(POLL_INTERVAL, int(poll_max_env)) if poll_max_env else max(POLL_INTERVAL, 43200)
+backoff_env = os.environ.get("POLL_BACKOFF")
+POLL_BACKOFF = max(1.0, float(backoff_env)) if backoff_env else 2.0
+hot_env = os.environ.get("POLL_HOT_INTERVAL")
+POLL_HOT_INTERVAL = max(60, int(hot_env)) if hot_env else 300
+window_env = os.environ.get("POLL_HOT_WINDOW")
+POLL_HOT_WINDOW = max(0, int(window_env)) if window_env else 60
+jitter_env = os.environ.get("POLL_JITTER")
+POLL_JITTER = min(0.5, max(0.0, float(jitter_env))) if jitter_env else 0.1
+season_env = os.environ.get("POLL_SEASON_DAYS")
+POLL_SEASON_DAYS = int(season_env) if season_env else 14
+
+# Ställ in lokal spegel av ljudfilerna; slås på med MIRROR_URL (se sommar.py),
+# vars sökväg (t.ex. /media) är där filerna serveras
+MIRROR_PATH = urlsplit(sommar.MIRROR_URL).path.rstrip("/") if sommar.MIRROR_URL else None
+mirror_dir_env = os.environ.get("MIRROR_DIR")
+MIRROR_DIR = Path(mirror_dir_env) if mirror_dir_env else Path("media")
+mirror_quota_env = os.environ.get("MIRROR_QUOTA_MB")
+MIRROR_QUOTA = max(1, int(mirror_quota_env)) * 2**20 if mirror_quota_env else 10 * 2**30
+mirror_workers_env = os.environ.get("MIRROR_WORKERS")
+MIRROR_WORKERS = max(1, int(mirror_workers_env)) if mirror_workers_env else 2
+# Så många av de nyaste avsnitten per program laddas ner i förväg; äldre när någon frågar efter dem
+prefetch_env = os.environ.get("MIRROR_PREFETCH")
+MIRROR_PREFETCH = max(0, int(prefetch_env)) if prefetch_env else 10
+# Valfri port för okrypterad HTTP, där ljudfilerna skickas med sendfile direkt från kerneln
+mirror_port_env = os.environ.get("MIRROR_PORT")
+MIRROR_PORT = int(mirror_port_env) if mirror_port_env else None
+MIRROR_MAX_AGE = 86400
+
+# Ställ in WebSub-pingar till hubbarna i WEBSUB_HUB (se sommar.py) efter varje ändrat flöde
+websub_workers_env = os.environ.get("WEBSUB_WORKERS")
+WEBSUB_WORKERS = max(1, int(websub_workers_env)) if websub_workers_env else 4
+websub_retries_env = os.environ.get("WEBSUB_RETRIES")
+WEBSUB_RETRIES = max(0, int(websub_retries_env)) if websub_retries_env else 4
+
+# Hindrar att två genereringar körs samtidigt
+GENERATION_LOCK = threading.Lock()
+
+METRICS = metrics.Registry()
+HTTP_REQUESTS = METRICS.counter(
+    "sommar_http_requests_total", "HTTP-requests per sökväg, metod och status", ["path", "method", "status"]
+)
+HTTP_DURATION = METRICS.histogram(
+    "sommar_http_request_duration_seconds", "Tid från request-rad till skickat svar", ["path"]
+)
+HTTP_BYTES = METRICS.counter("sommar_http_response_bytes_total", "Skickade bytes (body) per sökväg", ["path"])
+HTTP_CONNECTIONS = METRICS.gauge("sommar_http_connections", "Öppna anslutningar")
+UPSTREAM_REQUESTS = METRICS.counter(
+    "sommar_upstream_requests_total", "Försök mot SR per värd och utfall (ok, error)", ["host", "outcome"]
+)
+UPSTREAM_LATENCY = METRICS.histogram("sommar_upstream_request_duration_seconds", "Svarstid från SR per värd", ["host"])
+UPSTREAM_CIRCUIT = METRICS.gauge("sommar_upstream_circuit_open", "1 när kretsbrytaren för värden inte är stängd", ["host"])
+WEBSUB_NOTIFICATIONS = METRICS.counter(
+    "sommar_websub_notifications_total", "WebSub-pingar till hubbarna per resultat", ["result"]
+)
+MIRROR_DOWNLOADS = METRICS.counter(
+    "sommar_mirror_downloads_total", "Nedladdningar till spegeln per resultat", ["result"]
+)
+MIRROR_EVICTIONS = METRICS.counter("sommar_mirror_evictions_total", "Filer som tagits bort ur spegeln (LRU)")
+MIRROR_FILES = METRICS.gauge("sommar_mirror_files", "Färdiga filer i spegeln")
+MIRROR_BYTES = METRICS.gauge("sommar_mirror_bytes", "Använt utrymme i spegeln, inklusive pågående nedladdningar")
+FEED_RELOADS = METRICS.counter("sommar_feed_reloads_total", "Gånger flödet lästs in från disk")
+GENERATION_RUNS = METRICS.counter(
+    "sommar_generation_runs_total", "Genereringar per utfall (changed, unchanged, error)", ["result"]
+)
+GENERATION_RUNNING = METRICS.gauge("sommar_generation_in_progress", "1 medan en generering pågår")
+GENERATION_DURATION = METRICS.gauge("sommar_generation_duration_seconds", "Körtid för senaste genereringen")
+GENERATION_EPISODES = METRICS.gauge("sommar_generation_episodes", "Avsnitt i senast skrivna flödet")
+GENERATION_NEW = METRICS.gauge("sommar_generation_new_episodes", "Nya avsnitt i senaste genereringen")
+GENERATION_RENDERED = METRICS.gauge("sommar_generation_rendered_items", "Omrenderade <item> i senaste genereringen")
+EPISODE_CACHE = METRICS.counter(
+    "sommar_episode_cache_lookups_total", "Listade avsnitt som fanns sparade (hit) eller hämtades (miss)", ["result"]
+)
+LAST_SUCCESS = METRICS.gauge(
+    "sommar_generation_last_success_timestamp_seconds",
+    "Unix-tid då programmets senaste lyckade generering blev klar",
+    ["program"],
+)
+NEXT_RUN = METRICS.gauge("sommar_generation_next_run_timestamp_seconds", "Unix-tid för nästa schemalagda körning")
+DETECTION_LAG = METRICS.histogram(
+    "sommar_episode_detection_lag_seconds",
+    "Tid från ett avsnitts publicering till att det fanns i flödet",
+    buckets=(60, 300, 900, 1800, 3600, 7200, 14400, 21600, 43200, 86400),
+)
+LOG_DROPPED = METRICS.counter("sommar_log_dropped_total", "Loggrader som kastats för att loggkön var full")
+
+LOGGER = logging.getLogger("servera")
+ACCESS_LOGGER = logging.getLogger("servera.access")
+LOG_QUEUE = queue.Queue(LOG_QUEUE_SIZE)
+_log_listener = None
+_log_setup_lock = threading.Lock()
+
+
+class DroppingQueueHandler(logging.handlers.QueueHandler):
+    """Lägger raden i loggkön utan att någonsin vänta; är kön full kastas den."""
+
+    def enqueue(self, record):
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            LOG_DROPPED.inc()
+
+
+def make_log_file_handler():
+    if LOG_ROTATE == "daily":
+        return logging.handlers.TimedRotatingFileHandler(
+            LOG_FILE, when="midnight", backupCount=LOG_BACKUPS, encoding="utf-8"
+        )
+    return logging.handlers.RotatingFileHandler(
+        LOG_FILE, maxBytes=LOG_MAX_BYTES, backupCount=LOG_BACKUPS, encoding="utf-8"
+    )
+
+
+def setup_logging():
+    """Startar loggtråden som skriver till LOG_FILE och stdout.
+
+    Request-trådarna lägger bara rader i en kö; skrivning och rotation görs
+    helt i loggtråden.
+    """
+    global _log_listener
+    with _log_setup_lock:
+        if _log_listener is not None:
+            return
+        formatter = logging.Formatter("[%(asctime)s] %(message)s", "%Y-%m-%d %H:%M:%S")
+        handlers = [logging.StreamHandler(sys.stdout)]
+        try:
+            handlers.append(make_log_file_handler())
+        except OSError as e:
+            print(f"⚠️ Kan inte öppna loggfilen {LOG_FILE}: {e}", flush=True)
+        for handler in handlers:
+            handler.setFormatter(formatter)
+        _log_listener = logging.handlers.QueueListener(LOG_QUEUE, *handlers)
+        _log_listener.start()
+        LOGGER.addHandler(DroppingQueueHandler(LOG_QUEUE))
+        LOGGER.setLevel(logging.INFO)
+        LOGGER.propagate = False
+        atexit.register(stop_logging)
+
+
+def stop_logging():
+    """Skriver ut det som ligger kvar i kön och stoppar loggtråden."""
+    global _log_listener
+    with _log_setup_lock:
+        if _log_listener is not None:
+            _log_listener.stop()
+            _log_listener = None
 
 
 def log(msg):
-    timestamp = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
-    full_msg = f"[{timestamp}] {msg}"
-    print(full_msg, flush=True)
-    try:
-        with open(LOG_FILE, "a", encoding="utf-8") as f:
-            f.write(full_msg + "\n")
-    except Exception:
-        pass
+    if _log_listener is None:
+        setup_logging()
+    LOGGER.info(msg)
 
 def handle_sigterm(signum, frame):
     log("🛑 Avbryter servering (SIGTERM) – stänger ner servern ...")
@@ -47,97 +277,789 @@ def check_ssl_files(cert_file, key_file):
         log("✅ Alla SSL-filer finns.")
         return True
 
-def run_sommar_script():
-    log("Kör sommar.py för att generera podcast.xml …")
+def run_generation(reason, force=False):
+    """Genererar flödet i den här processen. Anroparen måste hålla GENERATION_LOCK.
+
+    Returnerar statistiken från sommar.run_all, eller None om körningen misslyckades.
+    """
+    log(f"🔄 Genererar {', '.join(p.output_file for p in PROGRAMS)} ({reason}) …")
+    GENERATION_RUNNING.set(1)
+    started = time.perf_counter()
     try:
-        res = subprocess.run(
-            ["python3", "sommar.py"],
-            check=True,
-            capture_output=True,
-            text=True,
-        )
-        if res.stdout:
-            log(res.stdout)
-        if res.stderr:
-            log("STDERR: " + res.stderr)
+        if sommar.PROFILE:
+            stats = sommar.profiled_run_all(PROGRAMS, cprofile=sommar.PROFILE_CPROFILE, log=log, force=force)
+        else:
+            stats = sommar.run_all(PROGRAMS, log=log, force=force)
     except Exception as e:
-        log(f"Fel vid körning av sommar.py: {e}")
+        GENERATION_RUNS.inc("error")
+        GENERATION_DURATION.set(time.perf_counter() - started)
+        log(f"❌ Fel vid generering av flödet: {e!r}")
+        return None
+    finally:
+        GENERATION_RUNNING.set(0)
+        GENERATION_LOCK.release()
+    record_generation(stats)
+    refresh_mirror()
+    if not stats["changed"]:
+        log(f"💤 Inga förändringar – flödet är oförändrat ({stats['duration']:.2f} s).")
+        return stats
+    log(
+        f"✅ Nytt flöde på {stats['duration']:.2f} s: {stats['episodes']} avsnitt, "
+        f"{stats['new_episodes']} nya, {stats['rendered']} renderade"
+    )
+    for record in stats["fresh"]:
+        log(f"🆕 {record['title']} upptäckt {record['lag_seconds'] / 60:.0f} min efter publicering")
+    if PUBLISHER is not None:
+        # Bara program vars flöde faktiskt skrevs; None är ett program som misslyckades
+        programs = stats["programs"]
+        changed = [program for program in PROGRAMS if (programs.get(program.slug) or {}).get("changed")]
+        PUBLISHER.publish(
+            [program.feed_url for program in changed]
+            + [sommar.format_url(program, fmt) for program in changed for fmt in sommar.FEED_FORMATS[1:]]
+        )
+    return stats
+
+
+def record_upstream(host, seconds, outcome):
+    UPSTREAM_REQUESTS.inc(host, outcome)
+    UPSTREAM_LATENCY.observe(seconds, host)
+
+
+def record_generation(stats):
+    GENERATION_RUNS.inc("changed" if stats["changed"] else "unchanged")
+    GENERATION_DURATION.set(stats["duration"])
+    GENERATION_NEW.set(stats["new_episodes"])
+    EPISODE_CACHE.inc("hit", amount=stats["cache_hits"])
+    EPISODE_CACHE.inc("miss", amount=stats["cache_misses"])
+    for record in stats["fresh"]:
+        DETECTION_LAG.observe(record["lag_seconds"])
+    if stats["changed"]:
+        GENERATION_EPISODES.set(stats["episodes"])
+        GENERATION_RENDERED.set(stats["rendered"])
+    # Per program, så att ett program som misslyckas syns även när de andra lyckas
+    now = time.time()
+    for slug, program_stats in stats["programs"].items():
+        if program_stats is not None:
+            LAST_SUCCESS.set(now, slug)
+
+
+def start_generation(reason, force=False):
+    """Startar en generering i en bakgrundstråd om ingen redan pågår."""
+    if not GENERATION_LOCK.acquire(blocking=False):
+        return False
+    threading.Thread(target=run_generation, args=(reason, force), daemon=True).start()
+    return True
+
+
+def make_schedule():
+    if SCHEDULE == "fixed":
+        return scheduling.FixedSchedule(SCHEDULE_TIMES)
+    return scheduling.AdaptiveSchedule(
+        interval=POLL_INTERVAL,
+        max_interval=POLL_MAX_INTERVAL,
+        backoff=POLL_BACKOFF,
+        hot_interval=POLL_HOT_INTERVAL,
+        hot_window=POLL_HOT_WINDOW,
+        jitter=POLL_JITTER,
+        season_days=POLL_SEASON_DAYS,
+    )
+
+
+def publication_times():
+    """Publiceringstiderna (unix-tid) för de senaste avsnitten i alla program, nyast först."""
+    times = []
+    for program in PROGRAMS:
+        try:
+            with sommar.open_store(program=program) as db:
+                times.extend(ts for _, ts in islice(db.index(), scheduling.HISTORY))
+        except Exception as e:
+            log(f"⚠️ Kunde inte läsa publiceringstider för {program.slug}: {e!r}")
+    return sorted(times, reverse=True)
+
+
+PUBLISHER = None
+MIRROR = None
+
+
+def start_mirror():
+    global MIRROR
+    MIRROR = mirror.Mirror(
+        MIRROR_DIR,
+        MIRROR_QUOTA,
+        MIRROR_WORKERS,
+        sommar.make_session(pool_size=MIRROR_WORKERS),
+        log=log,
+        on_download=lambda result: MIRROR_DOWNLOADS.inc(result),
+        on_evict=lambda name: MIRROR_EVICTIONS.inc(),
+    )
+    refresh_mirror()
+
+
+def refresh_mirror():
+    """Berättar för spegeln vilka ljudfiler som finns och köar de nyaste."""
+    if MIRROR is None:
+        return
+    urls, prefetch = [], []
+    for program in PROGRAMS:
+        try:
+            with sommar.open_store(program=program) as db:
+                index = [url for url, _ in db.index()]
+        except Exception as e:
+            log(f"⚠️ Kunde inte läsa avsnitten för {program.slug}: {e!r}")
+            continue
+        urls.extend(index)
+        prefetch.extend(index[:MIRROR_PREFETCH])
+    MIRROR.update(urls, prefetch)
 
 
 def scheduler():
     """Schemalägg körning."""
+    schedule = make_schedule()
+    found_new = False
     while True:
+        schedule.learn(publication_times())
         now = datetime.now()
-        next_times = [
-            now.replace(hour=7, minute=5, second=0, microsecond=0),
-            now.replace(hour=13, minute=0, second=0, microsecond=0),
-            now.replace(hour=19, minute=0, second=0, microsecond=0),
-        ]
-        # Om redan passerat, addera en dag
-        next_times = [t if t > now else t + timedelta(days=1) for t in next_times]
-        next_run = min(next_times)
-        wait_seconds = (next_run - now).total_seconds()
-        log(f"⏰ Nästa körning: {next_run} ({wait_seconds/3600:.2f} timmar kvar)")
+        next_run, why = schedule.next_run(now, found_new)
+        wait_seconds = max(0.0, (next_run - now).total_seconds())
+        NEXT_RUN.set(next_run.timestamp())
+        log(f"⏰ Nästa körning: {next_run:%Y-%m-%d %H:%M:%S} ({wait_seconds / 60:.0f} min kvar, {why})")
         time.sleep(wait_seconds)
-        run_sommar_script()
+        if GENERATION_LOCK.acquire(blocking=False):
+            stats = run_generation("schemalagd körning")
+            found_new = bool(stats and stats["new_episodes"])
+        else:
+            log("⏳ En generering pågår redan – hoppar över schemalagd körning.")
+            found_new = False
+
+
+class FeedVersion:
+    """En inläst version av flödet med förkomprimerade varianter."""
+
+    def __init__(self, body, mtime):
+        digest = hashlib.sha256(body).hexdigest()[:32]
+        self.last_modified = formatdate(mtime, usegmt=True)
+        self.mtime = int(mtime)
+        # Starka ETags måste skilja sig mellan kodningar av samma innehåll
+        self.variants = {None: (body, f'"{digest}"')}
+        self.variants["gzip"] = (gzip.compress(body, 9, mtime=0), f'"{digest}-gz"')
+        if brotli is not None:
+            self.variants["br"] = (brotli.compress(body, quality=11), f'"{digest}-br"')
+
+
+class FeedCache:
+    """Håller flödet i minnet och läser om det bara när det publicerats på nytt.
+
+    sommar.py byter ut filen atomärt (os.replace), så den som öppnar den ser
+    antingen den gamla eller den nya versionen, aldrig en halvskriven. Filen
+    läses in vid första get() och sedan bara via refresh(), som anropas när
+    generatorn i samma process meddelar en ny version (feed_published) eller
+    när watch_feeds ser att filen bytts ut. En request kostar alltså ingen stat.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.key = os.path.abspath(path)
+        self.loaded = False
+        self._lock = threading.Lock()
+        self._stamp = None
+        self._version = None
+
+    def get(self):
+        if not self.loaded:
+            self.refresh()
+        return self._version
+
+    def refresh(self):
+        """Läser in filen om den bytts ut sedan sist; True om versionen ändrades."""
+        with self._lock:
+            try:
+                # stat och läsning på samma fil, även om den byts ut emellan
+                with open(self.path, "rb") as f:
+                    st = os.fstat(f.fileno())
+                    stamp = (st.st_ino, st.st_mtime_ns, st.st_size)
+                    body = f.read() if stamp != self._stamp else None
+            except FileNotFoundError:
+                changed = self._version is not None
+                self._stamp = self._version = None
+                self.loaded = True
+                return changed
+            if body is not None:
+                self._version = FeedVersion(body, st.st_mtime)
+                self._stamp = stamp
+            self.loaded = True
+        if body is None:
+            return False
+        FEED_RELOADS.inc()
+        log(f"📄 Läste in {self.path} ({st.st_size} bytes)")
+        return True
+
+
+ARCHIVE_PAGE_RE = re.compile(r"[1-9][0-9]{0,5}")
+
+# Content-Type per flödesformat, och medietyperna i Accept som väljer formatet
+FORMAT_TYPES = {
+    "rss": "application/xml; charset=utf-8",
+    "atom": "application/atom+xml; charset=utf-8",
+    "json": "application/feed+json; charset=utf-8",
+}
+FORMAT_MEDIA_TYPES = {
+    "rss": ("application/rss+xml", "application/xml", "text/xml"),
+    "atom": ("application/atom+xml",),
+    "json": ("application/feed+json", "application/json"),
+}
+
+
+class PagedFeed:
+    """Ett programs flöde: aktuellt dokument, arkivsidor (RFC 5005) och hela flödet.
+
+    Sidorna skrivs av sommar.py (FEED_PAGE_SIZE) och läses in i varsin
+    FeedCache första gången de efterfrågas. Vilka arkivsidor som finns läses
+    ur katalogen av refresh_pages(), så ett okänt sidnummer besvaras utan
+    att röra filsystemet. Finns inga sidor serveras hela flödet som
+    aktuellt dokument.
+    """
+
+    def __init__(self, program):
+        self.full = FeedCache(Path(program.output_file))
+        self.pages_dir = Path(sommar.pages_dir(program))
+        self.current = FeedCache(self.pages_dir / "current.xml")
+        # Formaten utöver RSS (FEED_FORMATS), som bara finns som helt flöde
+        self.formats = {
+            fmt: FeedCache(Path(sommar.format_file(program, fmt))) for fmt in sommar.FEED_FORMATS if fmt != "rss"
+        }
+        self._archives = {}
+        self._pages = frozenset()
+        self._lock = threading.Lock()
+        self.refresh_pages()
+
+    def refresh_pages(self):
+        """Läser in vilka arkivsidor som finns i sidkatalogen."""
+        try:
+            names = os.listdir(self.pages_dir)
+        except FileNotFoundError:
+            names = []
+        self._pages = frozenset(name[:-4] for name in names if name.endswith(".xml") and name != "current.xml")
+
+    def get(self, page=None, fmt="rss"):
+        """`page` är None (aktuellt dokument), "full" eller ett sidnummer som sträng."""
+        if fmt != "rss":
+            cache = self.formats.get(fmt)
+            return cache.get() if cache is not None and page is None else None
+        if page is None:
+            return self.current.get() or self.full.get()
+        if page == "full":
+            return self.full.get()
+        # Bara sidor som finns får en cache, så okända sidnummer kostar inget minne
+        if page not in self._pages:
+            return None
+        cache = self._archives.get(page)
+        if cache is None:
+            # Sidor som redan har en cache hålls aktuella av refresh()
+            with self._lock:
+                cache = self._archives.setdefault(page, FeedCache(self.pages_dir / f"{page}.xml"))
+        return cache.get()
+
+    def caches(self):
+        with self._lock:
+            archives = list(self._archives.values())
+        return [self.full, self.current, *self.formats.values(), *archives]
+
+
+def requested_page(query):
+    """Sidan i frågesträngen: None, "full", ett sidnummer, eller False om den är ogiltig."""
+    params = parse_qs(query)
+    if "full" in params:
+        return "full"
+    if "page" in params:
+        page = params["page"][0]
+        return page if ARCHIVE_PAGE_RE.fullmatch(page) else False
+    return None
+
+
+def requested_format(query):
+    """Formatet i frågesträngen (?format=atom): None, ett format, eller False om det är okänt."""
+    values = parse_qs(query).get("format")
+    if not values:
+        return None
+    return values[0] if values[0] in FORMAT_TYPES else False
+
+
+def choose_format(accept, available):
+    """Väljer format utifrån Accept (med q-värden) bland `available`.
+
+    Lika bra alternativ, och ingen Accept alls, ger RSS.
+    """
+    prefs = parse_qvalues(accept)
+    if not prefs:
+        return "rss"
+    best, best_q = "rss", 0.0
+    for fmt in ("rss", *available):
+        q = 0.0
+        for media_type in FORMAT_MEDIA_TYPES[fmt]:
+            major = media_type.split("/")[0]
+            q = max(q, prefs.get(media_type, prefs.get(f"{major}/*", prefs.get("*/*", 0.0))))
+        if q > best_q:
+            best, best_q = fmt, q
+    return best
+
+
+FEEDS = {program.feed_path: PagedFeed(program) for program in PROGRAMS}
+
+
+def feed_published(path):
+    """Anropas av sommar.publish när en flödesfil skrivits eller tagits bort."""
+    key = os.path.abspath(path)
+    for feed in FEEDS.values():
+        if os.path.dirname(key) == os.path.abspath(feed.pages_dir):
+            feed.refresh_pages()
+        for cache in feed.caches():
+            if cache.key == key and cache.loaded:
+                cache.refresh()
+
+
+sommar.PUBLISH_LISTENERS.append(feed_published)
+
+
+def watch_feeds():
+    """Plockar upp flöden som skrivits av en annan process, t.ex. sommar.py från cron."""
+    while True:
+        time.sleep(FEED_WATCH_INTERVAL)
+        for feed in FEEDS.values():
+            try:
+                feed.refresh_pages()
+            except OSError as e:
+                log(f"⚠️ Kunde inte läsa {feed.pages_dir}: {e}")
+            for cache in feed.caches():
+                if cache.loaded:
+                    try:
+                        cache.refresh()
+                    except OSError as e:
+                        log(f"⚠️ Kunde inte läsa {cache.path}: {e}")
+
+
+def parse_qvalues(header):
+    """{värde: q} ur en Accept- eller Accept-Encoding-header."""
+    prefs = {}
+    for part in (header or "").split(","):
+        token, _, params = part.strip().partition(";")
+        if not token.strip():
+            continue
+        match = re.search(r"q\s*=\s*([0-9.]+)", params)
+        try:
+            prefs[token.strip().lower()] = float(match.group(1)) if match else 1.0
+        except ValueError:
+            prefs[token.strip().lower()] = 0.0
+    return prefs
+
+
+def choose_encoding(accept_encoding, available):
+    """Väljer br eller gzip utifrån Accept-Encoding (med q-värden), annars None."""
+    prefs = parse_qvalues(accept_encoding)
+    best, best_q = None, 0.0
+    for encoding in ("br", "gzip"):
+        if encoding in available:
+            q = prefs.get(encoding, prefs.get("*", 0.0))
+            if q > best_q:
+                best, best_q = encoding, q
+    return best
+
+
+def parse_range(value, size):
+    """(första, sista byte) för en Range-header med ett intervall.
+
+    None betyder att headern ska ignoreras och hela filen skickas (t.ex.
+    flera intervall, vilket RFC 9110 tillåter), False att intervallet inte
+    går att uppfylla (416).
+    """
+    match = re.fullmatch(r"\s*bytes\s*=\s*(\d*)\s*-\s*(\d*)\s*", value)
+    if not match or not any(match.groups()):
+        return None
+    first, last = match.groups()
+    if not first:
+        # "bytes=-N": de sista N byten
+        suffix = int(last)
+        return (max(0, size - suffix), size - 1) if suffix and size else False
+    start = int(first)
+    if last and int(last) < start:
+        return None
+    if start >= size:
+        return False
+    return start, min(int(last), size - 1) if last else size - 1
+
+
+def etag_matches(if_none_match, etag):
+    if if_none_match.strip() == "*":
+        return True
+    # Jämförelsen för If-None-Match är svag: W/-prefix spelar ingen roll
+    tags = [t.strip().removeprefix("W/") for t in if_none_match.split(",")]
+    return etag in tags
 
 
 class SimpleXMLHandler(BaseHTTPRequestHandler):
+    # HTTP/1.1 ger keep-alive; alla svar måste därför ha Content-Length
+    protocol_version = "HTTP/1.1"
+    # Stänger anslutningar som är tysta längre än så, även mitt i en request
+    timeout = CONNECTION_TIMEOUT
+    # Headers och body skrivs var för sig; med Nagle väntar andra svaret på
+    # en fördröjd ACK (~40 ms) på keep-alive-anslutningar
+    disable_nagle_algorithm = True
+
+    def parse_request(self):
+        # Anropas när request-raden är läst, så väntan på keep-alive räknas inte
+        self._started = time.perf_counter()
+        self._status = None
+        self._sent = 0
+        return super().parse_request()
+
+    def handle_one_request(self):
+        self._status = None
+        super().handle_one_request()
+        if self._status is None:
+            return  # Ingen request, t.ex. stängd eller tyst anslutning
+        path = self.metrics_path()
+        HTTP_REQUESTS.inc(path, self.command or "-", str(self._status))
+        HTTP_DURATION.observe(time.perf_counter() - self._started, path)
+        HTTP_BYTES.inc(path, amount=self._sent)
+
+    def metrics_path(self):
+        # Okända sökvägar slås ihop så att antalet serier hålls litet
+        path = (getattr(self, "path", "") or "").split("?", 1)[0]
+        if path in FEEDS or path in (METRICS_PATH, ADMIN_PATH):
+            return path
+        if MIRROR is not None and path.startswith(MIRROR_PATH + "/"):
+            return MIRROR_PATH + "/*"
+        return "other"
+
+    def send_response(self, code, message=None):
+        self._status = code
+        super().send_response(code, message)
+
+    def write_body(self, body):
+        self.wfile.write(body)
+        self._sent += len(body)
+
     def do_GET(self):
-        # Se till att RSS_FILE är en Path
-        requested_file = "/" + RSS_FILE.name
-        if self.path == requested_file:
-            if RSS_FILE.exists():
-                self.send_response(200)
-                self.send_header("Content-type", "application/xml; charset=utf-8")
+        self.serve(head=False)
+
+    def do_HEAD(self):
+        self.serve(head=True)
+
+    def do_POST(self):
+        # Läs bort eventuell body så att keep-alive-anslutningen hålls i synk
+        length = int(self.headers.get("Content-Length") or 0)
+        if length:
+            self.rfile.read(min(length, 65536))
+        if length > 65536:
+            self.close_connection = True
+        if ADMIN_TOKEN is None or self.path.split("?", 1)[0] != ADMIN_PATH:
+            self.send_plain(404, b"Invalid path.")
+            return
+        if not self.authorized():
+            self.send_response(401)
+            self.send_header("WWW-Authenticate", 'Bearer realm="admin"')
+            self.send_header("Content-Length", "0")
+            self.end_headers()
+            return
+        force = "force=1" in self.path.partition("?")[2].split("&")
+        if not start_generation(f"admin från {self.client_address[0]}", force=force):
+            self.send_plain(409, b"Generation already running.")
+            return
+        self.send_plain(202, b"Generation started.")
+
+    def authorized(self):
+        scheme, _, token = (self.headers.get("Authorization") or "").partition(" ")
+        if scheme.lower() != "bearer":
+            return False
+        return hmac.compare_digest(token.strip().encode(), ADMIN_TOKEN.encode())
+
+    def serve(self, head):
+        path, _, query = self.path.partition("?")
+        if METRICS_ENABLED and path == METRICS_PATH:
+            self.send_metrics(head)
+            return
+        if MIRROR is not None and path.startswith(MIRROR_PATH + "/"):
+            self.serve_media(path[len(MIRROR_PATH) + 1 :], head)
+            return
+        paged_feed = FEEDS.get(path)
+        page = requested_page(query)
+        fmt = requested_format(query)
+        if paged_feed is None or page is False or fmt is False:
+            self.send_plain(404, b"Invalid path.", head)
+            return
+        # Utan ?format= väljs formatet med Accept, men bara för det aktuella
+        # dokumentet; sidorna finns bara som RSS
+        negotiated = fmt is None and page is None and bool(paged_feed.formats)
+        if negotiated:
+            fmt = choose_format(self.headers.get("Accept"), paged_feed.formats)
+        feed = paged_feed.get(page, fmt or "rss")
+        if feed is None and negotiated and fmt != "rss":
+            # Formatet är inte skrivet än; RSS finns alltid
+            fmt = "rss"
+            feed = paged_feed.get(page)
+        if feed is None:
+            self.send_plain(404, b"File not found.", head)
+            return
+
+        encoding = choose_encoding(self.headers.get("Accept-Encoding"), feed.variants)
+        body, etag = feed.variants[encoding]
+        if self.not_modified(feed, etag):
+            self.send_response(304)
+            self.send_feed_headers(feed, etag, encoding, negotiated)
+            self.end_headers()
+            return
+
+        self.send_response(200)
+        self.send_header("Content-type", FORMAT_TYPES[fmt or "rss"])
+        self.send_header("Content-Length", str(len(body)))
+        self.send_feed_headers(feed, etag, encoding, negotiated)
+        self.end_headers()
+        if not head:
+            self.write_body(body)
+
+    def serve_media(self, name, head):
+        """Serverar en ljudfil ur spegeln, med Range för att spola.
+
+        Finns filen inte (än) skickas klienten vidare till SR med 302, och
+        filen köas för nedladdning.
+        """
+        if not mirror.SAFE_NAME_RE.fullmatch(name):
+            self.send_plain(404, b"Invalid path.", head)
+            return
+        opened = MIRROR.open(name)
+        if opened is None:
+            url = MIRROR.urls.get(name)
+            if url is None:
+                self.send_plain(404, b"File not found.", head)
+                return
+            MIRROR.request(name)
+            self.send_response(302)
+            self.send_header("Location", url)
+            self.send_header("Cache-Control", "no-store")
+            self.send_header("Content-Length", "0")
+            self.end_headers()
+            return
+
+        f, st = opened
+        with f:
+            size = st.st_size
+            etag = f'"{st.st_ino:x}-{size:x}"'
+            if_none_match = self.headers.get("If-None-Match")
+            if if_none_match is not None and etag_matches(if_none_match, etag):
+                self.send_response(304)
+                self.send_header("ETag", etag)
                 self.end_headers()
-                self.wfile.write(RSS_FILE.read_bytes())
-            else:
-                self.send_response(404)
+                return
+            byte_range = None
+            if_range = self.headers.get("If-Range")
+            if self.headers.get("Range") and (if_range is None or if_range.strip() == etag):
+                byte_range = parse_range(self.headers["Range"], size)
+            if byte_range is False:
+                self.send_response(416)
+                self.send_header("Content-Range", f"bytes */{size}")
+                self.send_header("Content-Length", "0")
                 self.end_headers()
-                self.wfile.write(b"File not found.")
-        else:
-            self.send_response(404)
+                return
+            start, end = byte_range or (0, size - 1)
+            self.send_response(206 if byte_range else 200)
+            self.send_header("Content-Type", "audio/mpeg")
+            self.send_header("Content-Length", str(end - start + 1))
+            if byte_range:
+                self.send_header("Content-Range", f"bytes {start}-{end}/{size}")
+            self.send_header("Accept-Ranges", "bytes")
+            self.send_header("ETag", etag)
+            self.send_header("Cache-Control", f"public, max-age={MIRROR_MAX_AGE}")
             self.end_headers()
-            self.wfile.write(b"Invalid path.")
+            if not head and end >= start:
+                self.send_file(f, start, end - start + 1)
+
+    def send_file(self, f, offset, count):
+        """Skickar en del av en fil. Över okrypterad HTTP används os.sendfile
+        (ingen kopiering via Python); över TLS krypterar Python bit för bit."""
+        self.wfile.flush()
+        try:
+            self._sent += self.connection.sendfile(f, offset, count)
+        except (BrokenPipeError, ConnectionResetError):
+            # Klienten slutade lyssna eller spolade; vanligt för ljudspelare
+            self.close_connection = True
+
+    def send_metrics(self, head):
+        for host, state in sommar.CLIENT.circuits().items():
+            UPSTREAM_CIRCUIT.set(0 if state == "closed" else 1, host)
+        if MIRROR is not None:
+            files, used = MIRROR.usage()
+            MIRROR_FILES.set(files)
+            MIRROR_BYTES.set(used)
+        body = METRICS.render()
+        self.send_response(200)
+        self.send_header("Content-Type", metrics.CONTENT_TYPE)
+        self.send_header("Content-Length", str(len(body)))
+        self.send_header("Cache-Control", "no-store")
+        self.end_headers()
+        if not head:
+            self.write_body(body)
+
+    def not_modified(self, feed, etag):
+        if_none_match = self.headers.get("If-None-Match")
+        if if_none_match is not None:
+            return etag_matches(if_none_match, etag)
+        if_modified_since = self.headers.get("If-Modified-Since")
+        if if_modified_since:
+            try:
+                since = parsedate_to_datetime(if_modified_since).timestamp()
+            except (TypeError, ValueError):
+                return False
+            return feed.mtime <= since
+        return False
+
+    def send_feed_headers(self, feed, etag, encoding, negotiated=False):
+        self.send_header("ETag", etag)
+        self.send_header("Last-Modified", feed.last_modified)
+        self.send_header("Cache-Control", f"public, max-age={CACHE_MAX_AGE}")
+        self.send_header("Vary", "Accept-Encoding, Accept" if negotiated else "Accept-Encoding")
+        if encoding:
+            self.send_header("Content-Encoding", encoding)
+
+    def send_plain(self, status, body, head=False):
+        self.send_response(status)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        if not head:
+            self.write_body(body)
+
+    def log_request(self, code="-", size="-"):
+        if not ACCESS_LOG:
+            return
+        code = getattr(code, "value", code)
+        # Fel loggas alltid, lyckade requests bara med sannolikheten ACCESS_LOG_SAMPLE
+        if ACCESS_LOG_SAMPLE < 1.0 and str(code) < "400" and random.random() >= ACCESS_LOG_SAMPLE:
+            return
+        if _log_listener is None:
+            setup_logging()
+        ACCESS_LOGGER.info('%s - "%s" %s %s', self.client_address[0], self.requestline, code, size)
+
     def log_message(self, format, *args):
         # Skriv till din egen log istället för stderr
         log(f"{self.client_address[0]} - {format % args}")
 
 
-if __name__ == "__main__":
-    load_dotenv()
+class MediaHandler(SimpleXMLHandler):
+    """Handlern för den okrypterade porten MIRROR_PORT: bara GET/HEAD på
+    ljudfilerna under MIRROR_PATH. Flöden, /metrics och admin (med sin
+    Bearer-token) finns bara över TLS."""
 
-    # Ställ in port
-    port_env = os.environ.get("PORT")
-    PORT = int(port_env) if port_env else 443
+    def do_POST(self):
+        length = int(self.headers.get("Content-Length") or 0)
+        if length:
+            self.rfile.read(min(length, 65536))
+        if length > 65536:
+            self.close_connection = True
+        self.send_plain(404, b"Invalid path.")
 
-    # Läs in sökvägar till certifikat från .env
-    cert_env = os.environ.get("SSL_CHAIN")
-    key_env = os.environ.get("SSL_KEY")
-    CERT_FILE = Path(cert_env) if cert_env else Path("ssl/fullchain.pem")
-    KEY_FILE = Path(key_env) if key_env else Path("ssl/privkey.pem")
+    def serve(self, head):
+        path = self.path.partition("?")[0]
+        if not path.startswith(MIRROR_PATH + "/"):
+            self.send_plain(404, b"Invalid path.", head)
+            return
+        self.serve_media(path[len(MIRROR_PATH) + 1 :], head)
 
-    # Ställ in sökväg till RSS-filen
-    rss_env = os.environ.get("RSS_FILE")
-    RSS_FILE = Path(rss_env) if rss_env else Path("sommar_i_p1.xml")
+
+def make_ssl_context(cert_file, key_file):
+    context = ssl.SSLContext(ssl.PROTOCOL_TLS_SERVER)
+    context.load_cert_chain(certfile=str(cert_file), keyfile=str(key_file))
+    context.minimum_version = ssl.TLSVersion.TLSv1_2
+    # Session tickets gör att återkommande klienter slipper full handskakning
+    context.options &= ~ssl.OP_NO_TICKET
+    context.num_tickets = 2
+    return context
+
+
+class FeedHTTPServer(ThreadingHTTPServer):
+    """Trådad HTTPS-server med tak för antal samtidiga anslutningar.
+
+    TLS-handskakningen görs i anslutningens egen tråd och inte vid accept(),
+    så att en långsam eller trasig klient inte blockerar alla andra.
+    """
+
+    daemon_threads = True
+
+    def __init__(self, address, handler, ssl_context=None, max_connections=MAX_CONNECTIONS):
+        super().__init__(address, handler)
+        self.ssl_context = ssl_context
+        self._slots = threading.BoundedSemaphore(max_connections)
+
+    def process_request(self, request, client_address):
+        # Vid fullt tak väntar vi här; nya anslutningar ligger kvar i kernelns kö
+        self._slots.acquire()
+        try:
+            super().process_request(request, client_address)
+        except Exception:
+            self._slots.release()
+            raise
+
+    def process_request_thread(self, request, client_address):
+        HTTP_CONNECTIONS.inc()
+        try:
+            super().process_request_thread(request, client_address)
+        finally:
+            HTTP_CONNECTIONS.dec()
+            self._slots.release()
+
+    def finish_request(self, request, client_address):
+        if self.ssl_context is None:
+            super().finish_request(request, client_address)
+            return
+        request.settimeout(CONNECTION_TIMEOUT)
+        try:
+            tls = self.ssl_context.wrap_socket(request, server_side=True)
+        except (ssl.SSLError, OSError):
+            return  # Misslyckad handskakning, t.ex. portskanner eller timeout
+        try:
+            super().finish_request(tls, client_address)
+        finally:
+            tls.close()
+
+
+if __name__ == "__main__":
+    setup_logging()
 
     # Kolla vi har SSL -filerna
     if not check_ssl_files(CERT_FILE, KEY_FILE):
         exit(1)
 
+    sommar.CLIENT.log = log
+    sommar.CLIENT.on_request = record_upstream
+    if sommar.MIRROR_URL:
+        start_mirror()
+    if sommar.WEBSUB_HUBS:
+        PUBLISHER = websub.Publisher(
+            sommar.WEBSUB_HUBS,
+            sommar.make_session(pool_size=WEBSUB_WORKERS),
+            workers=WEBSUB_WORKERS,
+            retries=WEBSUB_RETRIES,
+            log=log,
+            on_result=lambda result: WEBSUB_NOTIFICATIONS.inc(result),
+        )
+        log(f"📣 WebSub: pingar {', '.join(sommar.WEBSUB_HUBS)} när flödet ändras")
+
     # Starta bakgrundstråd för schemaläggning
     t = threading.Thread(target=scheduler, daemon=True)
     t.start()
+    if FEED_WATCH_INTERVAL:
+        threading.Thread(target=watch_feeds, daemon=True).start()
 
     # Starta servern (main thread)
-    context = ssl.SSLContext(ssl.PROTOCOL_TLS_SERVER)
-    context.load_cert_chain(certfile=str(CERT_FILE), keyfile=str(KEY_FILE))
+    context = make_ssl_context(CERT_FILE, KEY_FILE)
+    httpd = FeedHTTPServer(("0.0.0.0", PORT), SimpleXMLHandler, context)
 
-    httpd = HTTPServer(("0.0.0.0", PORT), SimpleXMLHandler)
-    httpd.socket = context.wrap_socket(httpd.socket, server_side=True)
-
-    log(f"🌐 Serving https://0.0.0.0:{PORT}/{RSS_FILE} with SSL")
+    for feed_path in FEEDS:
+        log(f"🌐 Serving https://0.0.0.0:{PORT}{feed_path} with SSL")
+    log(f"🔌 Max {MAX_CONNECTIONS} anslutningar, timeout {CONNECTION_TIMEOUT:g} s")
+    if MIRROR is not None:
+        log(f"🎧 Speglar ljudfiler i {MIRROR_DIR} (max {MIRROR_QUOTA / 2**30:.1f} GB) på {MIRROR_PATH}/")
+        if MIRROR_PORT:
+            plain = FeedHTTPServer(("0.0.0.0", MIRROR_PORT), MediaHandler)
+            threading.Thread(target=plain.serve_forever, daemon=True).start()
+            log(f"🌐 Serving http://0.0.0.0:{MIRROR_PORT}{MIRROR_PATH}/ utan TLS (sendfile)")
 
     # Registrera signalhanteraren
     signal.signal(signal.SIGTERM, handle_sigterm)
@@ -148,4 +1070,3 @@ if __name__ == "__main__":
         log("🛑 Avbryter servering (Ctrl-C) – stänger ner servern ...")
         httpd.server_close()
         log("👋 Servern är nu avstängd.")
-
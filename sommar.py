@@ -1,18 +1,35 @@
 #!/usr/bin/env python3
+import argparse
+import contextlib
 import datetime
+import hashlib
 import json
 import os
-import random
 import re
+import shutil
+import sys
+import threading
 import time
 import uuid
+from bisect import bisect_left
+from concurrent.futures import ThreadPoolExecutor, as_completed
 from email.utils import format_datetime
+from itertools import islice
+from statistics import median
+from xml.sax.saxutils import escape, quoteattr
 
 import requests
-from bs4 import BeautifulSoup
+from bs4 import BeautifulSoup, SoupStrainer
 from dotenv import load_dotenv
 from feedgen.feed import FeedGenerator
 from lxml import etree
+from requests.adapters import HTTPAdapter
+
+import httpclient
+import mirror
+import mp3
+import profiling
+import store
 
 BASE_URL = "https://www.sverigesradio.se"
 PROGRAM_URL = BASE_URL + "/avsnitt?programid=2071"
@@ -22,6 +39,11 @@ FEED_TITLE = "Sommar & Vinter i P1 – inofficiellt RSS-flöde"
 FALLBACK_ICON = (
     "https://static-cdn.sr.se/images/2071/138fda3c-4e35-48e0-8fdb-e2ea8ef44758.jpg"
 )
+FEED_DESCRIPTION = "Inofficiellt RSS-flöde automatiskt genererat från Sveriges Radio. Alla Sommarprat finns att lyssna på i Sveriges Radio Play."
+
+# Exit-status för schemaläggaren: nytt flöde skrivet, eller inget att göra
+EXIT_NEW_FEED = 0
+EXIT_UNCHANGED = 3
 
 
 load_dotenv()
@@ -38,102 +60,813 @@ OUTPUT_FILE = rss_env if rss_env else "sommar_i_p1.xml"
 cache_env = os.environ.get("CACHE_FILE", "cache.json").strip()
 CACHE_FILE = cache_env if cache_env else "cache.json"
 
+# Ställ in lagring av avsnitt: "sqlite" (STORE_FILE) eller "json" (CACHE_FILE)
+store_env = os.environ.get("EPISODE_STORE", "sqlite").strip().lower()
+EPISODE_STORE = store_env if store_env in store.BACKENDS else "sqlite"
+store_file_env = os.environ.get("STORE_FILE", "episodes.db").strip()
+STORE_FILE = store_file_env if store_file_env else "episodes.db"
+
+# Ställ in HTML-tolk för avsnittslistan: "lxml" (XPath), "bs4-lxml" eller "bs4"
+parser_env = os.environ.get("HTML_PARSER", "lxml").strip().lower()
+HTML_PARSER = parser_env if parser_env in ("lxml", "bs4-lxml", "bs4") else "lxml"
+
 # Ställ in feed url
 feed_env = os.environ.get("FEED_URL", "localhost/sommar_i_p1.xml").strip()
 FEED_URL = feed_env if feed_env else "localhost/sommar_i_p1.xml"
 
+# Ställ in antal parallella storleksuppslag
+workers_env = os.environ.get("SIZE_WORKERS", "8").strip()
+SIZE_WORKERS = max(1, int(workers_env)) if workers_env else 8
+
+# Ställ in exakt speltid: läs MP3-huvudet i början av varje ljudfil i stället
+# för att tolka den avrundade texten på SR:s sida
+exact_env = os.environ.get("EXACT_DURATION", "false").strip().lower()
+EXACT_DURATION = exact_env in ("1", "true", "yes", "on")
+
+# Ställ in berikning: hämta varje avsnitts egen sida hos SR för hela
+# beskrivningen i stället för den förkortade texten i listan. Sidan hämtas
+# igen först när den är äldre än ENRICH_TTL_DAYS
+enrich_env = os.environ.get("ENRICH", "false").strip().lower()
+ENRICH = enrich_env in ("1", "true", "yes", "on")
+enrich_workers_env = os.environ.get("ENRICH_WORKERS", "4").strip()
+ENRICH_WORKERS = max(1, int(enrich_workers_env)) if enrich_workers_env else 4
+enrich_ttl_env = os.environ.get("ENRICH_TTL_DAYS", "7").strip()
+ENRICH_TTL_DAYS = max(0.0, float(enrich_ttl_env)) if enrich_ttl_env else 7.0
+
+# Ställ in lokal spegel av ljudfilerna: bas-url som flödets enclosures pekar på,
+# t.ex. https://example.org/media (servas av servera.py); tom = SR:s egna url:er
+mirror_env = os.environ.get("MIRROR_URL", "").strip()
+MIRROR_URL = mirror_env.rstrip("/") if mirror_env else None
+
+# Ställ in WebSub: hubbar (kommaseparerade url:er) som flödet annonserar med
+# <atom:link rel="hub">, och som servera.py pingar när flödet ändrats
+hubs_env = os.environ.get("WEBSUB_HUB", "").strip()
+WEBSUB_HUBS = [hub.strip() for hub in hubs_env.split(",") if hub.strip()] if hubs_env else []
+
+# Ställ in flödesformat utöver RSS (kommaseparerade): "atom" och "json"
+# (JSON Feed 1.1). Alla renderas ur samma avsnitt i samma körning, till
+# RSS_FILE med filändelsen .atom respektive .json
+FORMAT_EXTENSIONS = {"atom": ".atom", "json": ".json"}
+formats_env = os.environ.get("FEED_FORMATS", "rss").strip().lower()
+FEED_FORMATS = ["rss"] + [fmt for fmt in FORMAT_EXTENSIONS if fmt in formats_env.replace(" ", "").split(",")]
+
+# Ställ in state-fil (arkivstatus m.m.)
+state_env = os.environ.get("STATE_FILE", "state.json").strip()
+STATE_FILE = state_env if state_env else "state.json"
+
+# Ställ in arkivläge: gå igenom alla sidor i avsnittslistan
+archive_env = os.environ.get("ARCHIVE", "false").strip().lower()
+ARCHIVE = archive_env in ("1", "true", "yes", "on")
+pages_env = os.environ.get("ARCHIVE_MAX_PAGES", "50").strip()
+ARCHIVE_MAX_PAGES = max(1, int(pages_env)) if pages_env else 50
+archive_workers_env = os.environ.get("ARCHIVE_WORKERS", "4").strip()
+ARCHIVE_WORKERS = max(1, int(archive_workers_env)) if archive_workers_env else 4
+delay_env = os.environ.get("ARCHIVE_DELAY", "1.0").strip()
+ARCHIVE_DELAY = max(0.0, float(delay_env)) if delay_env else 1.0
+
+# Ställ in vilka avsnitt som får ligga kvar i cachen:
+# "listing" (bara det som listas hos SR), "all", "newest:N" eller "days:N"
+retention_env = os.environ.get("CACHE_RETENTION", "listing").strip().lower()
+CACHE_RETENTION = retention_env if retention_env else "listing"
+
+# Ställ in inkrementell generering: återanvänd renderade <item> från cachen
+incremental_env = os.environ.get("INCREMENTAL", "true").strip().lower()
+INCREMENTAL = incremental_env in ("1", "true", "yes", "on")
+
+# Ställ in antal avsnitt per sida i det paginerade flödet (RFC 5005), 0 = av
+page_size_env = os.environ.get("FEED_PAGE_SIZE", "50").strip()
+FEED_PAGE_SIZE = max(0, int(page_size_env)) if page_size_env else 50
+
+# Ställ in fil där det loggas hur snabbt nya avsnitt upptäcktes (JSON per rad)
+freshness_env = os.environ.get("FRESHNESS_FILE", "freshness.jsonl").strip()
+FRESHNESS_FILE = freshness_env if freshness_env else "freshness.jsonl"
+
+# Ställ in profilering av körningarna (samma som --profile): tid och minne per
+# steg, en JSON-rad per körning i PROFILE_FILE och valfritt en cProfile-fil
+profile_env = os.environ.get("PROFILE", "false").strip().lower()
+PROFILE = profile_env in ("1", "true", "yes", "on")
+profile_file_env = os.environ.get("PROFILE_FILE", "profile.jsonl").strip()
+PROFILE_FILE = profile_file_env if profile_file_env else "profile.jsonl"
+cprofile_env = os.environ.get("PROFILE_CPROFILE", "").strip()
+PROFILE_CPROFILE = cprofile_env if cprofile_env else None
+
+# Ställ in HTTP-lagret för alla anrop till SR: timeout, nya försök, en gemensam
+# budget (anrop per sekund, 0 = obegränsat) och kretsbrytare per värd
+connect_timeout_env = os.environ.get("HTTP_CONNECT_TIMEOUT", "5").strip()
+HTTP_CONNECT_TIMEOUT = max(0.1, float(connect_timeout_env)) if connect_timeout_env else 5.0
+read_timeout_env = os.environ.get("HTTP_READ_TIMEOUT", "20").strip()
+HTTP_READ_TIMEOUT = max(0.1, float(read_timeout_env)) if read_timeout_env else 20.0
+retries_env = os.environ.get("HTTP_RETRIES", "3").strip()
+HTTP_RETRIES = max(0, int(retries_env)) if retries_env else 3
+rate_env = os.environ.get("HTTP_RATE", "10").strip()
+HTTP_RATE = max(0.0, float(rate_env)) if rate_env else 10.0
+# Ljudfilerna (storlek och speltid) har en egen budget; antalet samtidiga
+# uppslag begränsas redan av SIZE_WORKERS, så som standard obegränsad
+media_rate_env = os.environ.get("HTTP_MEDIA_RATE", "0").strip()
+HTTP_MEDIA_RATE = max(0.0, float(media_rate_env)) if media_rate_env else 0.0
+threshold_env = os.environ.get("BREAKER_THRESHOLD", "5").strip()
+BREAKER_THRESHOLD = max(1, int(threshold_env)) if threshold_env else 5
+cooldown_env = os.environ.get("BREAKER_COOLDOWN", "300").strip()
+BREAKER_COOLDOWN = max(0.0, float(cooldown_env)) if cooldown_env else 300.0
+
+# Ställ in flera program: en JSON-fil med en lista av program (se README)
+programs_env = os.environ.get("PROGRAMS_FILE", "").strip()
+PROGRAMS_FILE = programs_env if programs_env else None
+program_workers_env = os.environ.get("PROGRAM_WORKERS", "4").strip()
+PROGRAM_WORKERS = max(1, int(program_workers_env)) if program_workers_env else 4
+
+SLUG_RE = re.compile(r"^[a-z0-9][a-z0-9_-]*$")
+
+
+class Program:
+    """Ett program hos SR som det byggs ett flöde för.
+
+    Varje program har egna filer för flöde, avsnitt, state och
+    upptäcktslogg, så att flera program kan köras i samma process.
+    `image_url` är kanalbilden i flödet; är den None används programbilden
+    från avsnittslistan.
+    """
+
+    def __init__(
+        self,
+        slug,
+        program_id,
+        title,
+        listing_url,
+        channel_url,
+        image_url,
+        fallback_image,
+        description,
+        feed_url,
+        output_file,
+        store_file,
+        cache_file,
+        state_file,
+        freshness_file,
+    ):
+        self.slug = slug
+        self.program_id = program_id
+        self.title = title
+        self.listing_url = listing_url
+        self.channel_url = channel_url
+        self.image_url = image_url
+        self.fallback_image = fallback_image
+        self.description = description
+        self.feed_url = feed_url
+        self.output_file = output_file
+        self.store_file = store_file
+        self.cache_file = cache_file
+        self.state_file = state_file
+        self.freshness_file = freshness_file
+
+    @property
+    def feed_path(self):
+        """Sökvägen som servera.py serverar flödet på."""
+        return "/" + os.path.basename(self.output_file)
+
+
+def default_program():
+    """Sommar & Vinter i P1, med filerna från .env.
+
+    Byggs vid varje anrop, så att ändrade modulvariabler (t.ex. PROGRAM_URL
+    i benchmarks) slår igenom.
+    """
+    return Program(
+        slug="sommar",
+        program_id=2071,
+        title=FEED_TITLE,
+        listing_url=PROGRAM_URL,
+        channel_url=CHANNEL_URL,
+        image_url=API_IMAGE_URL,
+        fallback_image=FALLBACK_ICON,
+        description=FEED_DESCRIPTION,
+        feed_url=FEED_URL,
+        output_file=OUTPUT_FILE,
+        store_file=STORE_FILE,
+        cache_file=CACHE_FILE,
+        state_file=STATE_FILE,
+        freshness_file=FRESHNESS_FILE,
+    )
+
+
+def namespaced(path, slug):
+    """Egen fil per program: ("episodes.db", "ekot") -> "episodes-ekot.db"."""
+    stem, ext = os.path.splitext(path)
+    return f"{stem}-{slug}{ext}"
+
+
+def program_from_config(entry):
+    """Gör ett Program av en post i PROGRAMS_FILE. Bara "slug" och "id" krävs."""
+    slug = str(entry.get("slug", "")).strip()
+    if not SLUG_RE.match(slug):
+        raise ValueError(f"Ogiltig slug {slug!r}: använd a-z, 0-9, - och _")
+    program_id = int(entry["id"])
+    listing_url = f"{BASE_URL}/avsnitt?programid={program_id}"
+    output_file = entry.get("output") or f"{slug}.xml"
+    image_url = entry.get("image")
+    feed_base = FEED_URL.rsplit("/", 1)[0] if "/" in FEED_URL else FEED_URL
+    return Program(
+        slug=slug,
+        program_id=program_id,
+        title=entry.get("title") or f"{slug} – inofficiellt RSS-flöde",
+        listing_url=listing_url,
+        channel_url=entry.get("channel_url") or listing_url,
+        image_url=image_url,
+        fallback_image=entry.get("fallback_image") or (image_url.split("?", 1)[0] if image_url else FALLBACK_ICON),
+        description=entry.get("description") or "Inofficiellt RSS-flöde automatiskt genererat från Sveriges Radio.",
+        feed_url=entry.get("feed_url") or f"{feed_base}/{os.path.basename(output_file)}",
+        output_file=output_file,
+        store_file=entry.get("store") or namespaced(STORE_FILE, slug),
+        cache_file=entry.get("cache") or namespaced(CACHE_FILE, slug),
+        state_file=entry.get("state") or namespaced(STATE_FILE, slug),
+        freshness_file=entry.get("freshness") or namespaced(FRESHNESS_FILE, slug),
+    )
+
 
-def load_cache():
-    if os.path.exists(CACHE_FILE):
-        with open(CACHE_FILE, "r", encoding="utf-8") as f:
+def configured_programs(path=PROGRAMS_FILE):
+    """Programmen i PROGRAMS_FILE, eller bara default_program() om ingen fil är satt."""
+    if not path:
+        return [default_program()]
+    with open(path, "r", encoding="utf-8") as f:
+        entries = json.load(f)
+    programs = [program_from_config(entry) for entry in entries]
+    for attr in ("slug", "output_file", "store_file", "cache_file", "state_file", "feed_path"):
+        values = [getattr(program, attr) for program in programs]
+        if len(set(values)) != len(values):
+            raise ValueError(f"Två program i {path} har samma {attr}")
+    return programs
+
+
+# Alla meddelanden från en körning går genom log(); run_all(log=…) styr om
+# dem, t.ex. till servera.py:s loggfil
+LOG = print
+
+
+def log(msg):
+    LOG(msg)
+
+
+@contextlib.contextmanager
+def log_to(target):
+    """Skickar meddelandena från log() till `target` i with-blocket (None = som förut)."""
+    global LOG
+    previous = LOG
+    if target is not None:
+        LOG = target
+    try:
+        yield
+    finally:
+        LOG = previous
+
+
+def make_session(pool_size=(max(SIZE_WORKERS, ENRICH_WORKERS) + ARCHIVE_WORKERS) * PROGRAM_WORKERS):
+    """Skapar en session med keep-alive och en pool stor nog för alla workers."""
+    session = requests.Session()
+    adapter = HTTPAdapter(pool_connections=4, pool_maxsize=pool_size)
+    session.mount("https://", adapter)
+    session.mount("http://", adapter)
+    return session
+
+
+SESSION = make_session()
+CLIENT = httpclient.Client(
+    SESSION,
+    timeout=(HTTP_CONNECT_TIMEOUT, HTTP_READ_TIMEOUT),
+    retries=HTTP_RETRIES,
+    rate=HTTP_RATE,
+    media_rate=HTTP_MEDIA_RATE,
+    threshold=BREAKER_THRESHOLD,
+    cooldown=BREAKER_COOLDOWN,
+)
+
+
+def open_store(backend=EPISODE_STORE, program=None):
+    """Öppnar programmets avsnittslagring. En tom SQLite-databas fylls från cache-filen.
+
+    Efter importen döps cache-filen om till .imported, så att den inte
+    importeras igen om databasen senare blir tom (t.ex. efter --retention).
+    """
+    program = program or default_program()
+    if backend == "json":
+        return store.JsonStore(program.cache_file, episode_datetime)
+    db = store.SqliteStore(program.store_file, episode_datetime)
+    if not len(db) and os.path.exists(program.cache_file):
+        count = db.import_json(program.cache_file)
+        os.replace(program.cache_file, program.cache_file + ".imported")
+        log(f"📦 Importerade {count} avsnitt från {program.cache_file} till {program.store_file}")
+    return db
+
+
+def load_state(program=None):
+    program = program or default_program()
+    if os.path.exists(program.state_file):
+        with open(program.state_file, "r", encoding="utf-8") as f:
             return json.load(f)
     return {}
 
 
-def save_cache(cache):
-    with open(CACHE_FILE, "w", encoding="utf-8") as f:
-        json.dump(cache, f, ensure_ascii=False, indent=2)
+def save_state(state, program=None):
+    program = program or default_program()
+    write_atomic(program.state_file, json.dumps(state, ensure_ascii=False, indent=2).encode("utf-8"))
+
+
+# Anropas med sökvägen varje gång publish() har bytt in en ny fil, t.ex. av
+# servera.py för att läsa in ett nytt flöde direkt
+PUBLISH_LISTENERS = []
+
 
+def write_atomic(path, data):
+    """Skriver `data` till en temporär fil bredvid `path` och byter sedan in den.
 
-def fetch_program_image():
+    Den som läser filen ser antingen den gamla eller den nya versionen,
+    aldrig en halvskriven.
+    """
+    tmp = f"{path}.{uuid.uuid4().hex[:8]}.tmp"
     try:
-        resp = requests.get(PROGRAM_URL)
-        soup = BeautifulSoup(resp.content, "html.parser")
-        # Leta efter kvadratisk programikon
-        img_el = soup.select_one(".program-menu__image-wrapper .image--square img")
-        if img_el and img_el.get("src"):
-            base_img = clean_image_url(img_el["src"])
-            return base_img
-    except Exception as e:
-        print(f"⚠️ Kunde inte hämta kanalbild: {e}")
-    return FALLBACK_ICON
+        with open(tmp, "wb") as f:
+            f.write(data)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp, path)
+    except BaseException:
+        if os.path.exists(tmp):
+            os.remove(tmp)
+        raise
+
+
+def notify_listeners(path):
+    for listener in PUBLISH_LISTENERS:
+        try:
+            listener(path)
+        except Exception as e:
+            log(f"⚠️ Kunde inte meddela om ny version av {path}: {e!r}")
+
+
+def publish(path, data):
+    """Skriver en flödesfil atomärt och meddelar PUBLISH_LISTENERS."""
+    with profiling.stage("write"):
+        write_atomic(path, data)
+    notify_listeners(path)
+
+
+def unpublish(path):
+    """Tar bort en flödesfil och meddelar PUBLISH_LISTENERS."""
+    os.remove(path)
+    notify_listeners(path)
+
+
+class RateLimiter:
+    """Släpper igenom högst ett anrop per `interval` sekunder, över alla trådar."""
+
+    def __init__(self, interval):
+        self.interval = interval
+        self._lock = threading.Lock()
+        self._next = 0.0
+
+    def wait(self):
+        with self._lock:
+            now = time.monotonic()
+            delay = self._next - now
+            self._next = max(now, self._next) + self.interval
+        if delay > 0:
+            time.sleep(delay)
+
+
+# Tolkning av avsnittslistan. Varje backend plockar ut samma råa strängar ur
+# sidan (se parse_listing), och episode_from_item gör sedan avsnitt av dem, så
+# att alla backends ger exakt samma avsnitt.
+
+EPISODE_SELECTOR = "div.episode-list-item"
+PROGRAM_IMAGE_SELECTOR = ".program-menu__image-wrapper .image--square img"
+PAGE_LINK_SELECTOR = "a[href*='page=']"
+ITEM_SELECTORS = {
+    "title": ".audio-heading__title a",
+    "date": ".audio-heading__meta time",
+    "description": ".episode-list-item__description p",
+    "audio": "a[href*='topsy/ljudfil']",
+    "image": "img",
+    "duration": ".audio-heading__meta abbr",
+}
 
 
-def get_mp3_size(url):
+def listing_item(title_el, date_el, desc_el, mp3_el, img_el, abbr_el, text, attr):
+    """Råa fält för ett avsnitt. `text`/`attr` läser text och attribut ur ett element."""
+    if title_el is None or date_el is None or mp3_el is None:
+        return None
+    image = None
+    if img_el is not None:
+        image = attr(img_el, "data-src") or attr(img_el, "src")
+    return {
+        "title": text(title_el),
+        "href": attr(title_el, "href"),
+        "date": attr(date_el, "datetime"),
+        "description": text(desc_el) if desc_el is not None else "",
+        "audio": attr(mp3_el, "href"),
+        "image": image,
+        "duration": text(abbr_el) if abbr_el is not None else None,
+    }
+
+
+def page_numbers(hrefs):
+    pages = [int(m.group(1)) for href in hrefs if (m := re.search(r"[?&]page=(\d+)", href or ""))]
+    return max(pages) if pages else None
+
+
+def parse_listing_soup(soup):
+    def text(el):
+        return el.text.strip()
+
+    def attr(el, name):
+        return el.get(name)
+
+    items = []
+    for item in soup.select(EPISODE_SELECTOR):
+        found = [item.select_one(ITEM_SELECTORS[key]) for key in ITEM_SELECTORS]
+        if (entry := listing_item(*found, text, attr)) is not None:
+            items.append(entry)
+    img_el = soup.select_one(PROGRAM_IMAGE_SELECTOR)
+    return {
+        "items": items,
+        "program_image": img_el.get("src") if img_el else None,
+        "last_page": page_numbers(a.get("href") for a in soup.select(PAGE_LINK_SELECTOR)),
+    }
+
+
+def parse_listing_bs4(content):
+    return parse_listing_soup(BeautifulSoup(content, "html.parser"))
+
+
+def listing_tag_wanted(name, attrs):
+    classes = (attrs.get("class") or "").split()
+    if "episode-list-item" in classes or "program-menu__image-wrapper" in classes:
+        return True
+    return name == "a" and "page=" in (attrs.get("href") or "")
+
+
+class ListingStrainer(SoupStrainer):
+    """Bygger bara avsnitten, programbilden och sidlänkarna som bs4-objekt.
+
+    allow_tag_creation() finns från bs4 4.13; äldre versioner bygger hela
+    trädet, vilket ger samma resultat men ingen vinst.
+    """
+
+    def allow_tag_creation(self, nsprefix, name, attrs):
+        return listing_tag_wanted(name, attrs or {})
+
+
+def parse_listing_bs4_lxml(content):
+    return parse_listing_soup(BeautifulSoup(content, "lxml", parse_only=ListingStrainer()))
+
+
+def has_class(name):
+    # Den billiga contains() sållar bort nästan alla element innan den exakta
+    # jämförelsen mot klasslistan, som bygger nya strängar
+    return f"contains(@class, '{name}') and contains(concat(' ', normalize-space(@class), ' '), ' {name} ')"
+
+
+LISTING_XPATH = {
+    "items": etree.XPath(f"//div[{has_class('episode-list-item')}]"),
+    "program_image": etree.XPath(
+        f"(//*[{has_class('program-menu__image-wrapper')}]//*[{has_class('image--square')}]//img)[1]"
+    ),
+    "page_links": etree.XPath("//a[contains(@href, 'page=')]/@href"),
+}
+ITEM_XPATH = [
+    etree.XPath(f"(.//*[{has_class('audio-heading__title')}]//a)[1]"),
+    etree.XPath(f"(.//*[{has_class('audio-heading__meta')}]//time)[1]"),
+    etree.XPath(f"(.//*[{has_class('episode-list-item__description')}]//p)[1]"),
+    etree.XPath("(.//a[contains(@href, 'topsy/ljudfil')])[1]"),
+    etree.XPath("(.//img)[1]"),
+    etree.XPath(f"(.//*[{has_class('audio-heading__meta')}]//abbr)[1]"),
+]
+# SR skickar UTF-8; utan explicit kodning gissar libxml2 latin-1 om meta saknas
+HTML_PARSER_LXML = etree.HTMLParser(encoding="utf-8", no_network=True)
+
+
+def parse_listing_lxml(content):
+    root = etree.fromstring(content, HTML_PARSER_LXML)
+
+    def text(el):
+        return el.xpath("string()").strip()
+
+    def attr(el, name):
+        return el.get(name)
+
+    def first(xpath, el):
+        found = xpath(el)
+        return found[0] if found else None
+
+    items = []
+    for item in LISTING_XPATH["items"](root):
+        found = [first(xpath, item) for xpath in ITEM_XPATH]
+        if (entry := listing_item(*found, text, attr)) is not None:
+            items.append(entry)
+    img_el = first(LISTING_XPATH["program_image"], root)
+    return {
+        "items": items,
+        "program_image": img_el.get("src") if img_el is not None else None,
+        "last_page": page_numbers(LISTING_XPATH["page_links"](root)),
+    }
+
+
+LISTING_PARSERS = {
+    "bs4": parse_listing_bs4,
+    "bs4-lxml": parse_listing_bs4_lxml,
+    "lxml": parse_listing_lxml,
+}
+
+
+def parse_listing(content, backend=HTML_PARSER):
+    """Tolkar en sida av avsnittslistan (bytes).
+
+    Returnerar {"items": [...], "program_image": src eller None,
+    "last_page": högsta sidnummer i pagineringen eller None}, där varje item
+    är de råa strängarna för ett avsnitt.
+    """
+    with profiling.stage("parse"):
+        return LISTING_PARSERS[backend](content)
+
+
+def extract_program_image(listing, program=None):
+    # Kvadratisk programikon
+    if listing["program_image"]:
+        return clean_image_url(listing["program_image"])
+    return (program or default_program()).fallback_image
+
+
+def fetch_program_image(program=None):
+    program = program or default_program()
     try:
-        for attempt in range(2):  # Testa max två gånger
-            r = requests.get(url, stream=True, timeout=10)
-            length = int(r.headers.get("Content-Length", 0))
-            if length > 0:
-                break
-            pause = random.uniform(0.75, 2.5)
-            time.sleep(pause)
-        return length
+        resp = CLIENT.get(program.listing_url)
+        resp.raise_for_status()
+        return extract_program_image(parse_listing(resp.content), program)
     except Exception as e:
-        print(f"⚠️ Fel vid hämtning av filstorlek: {e}")
-        return 0
+        log(f"⚠️ Kunde inte hämta kanalbild: {e}")
+    return program.fallback_image
 
 
-def fix_xml_declaration(xml_path):
-    with open(xml_path, "r", encoding="utf-8") as f:
-        xml = f.read()
-    # Ta bort ev. gammal declaration
-    xml = re.sub(r"^<\?xml.*?\?>\s*", "", xml)
-    # Lägg in korrekt rad
-    xml = '<?xml version="1.0" encoding="UTF-8"?>\n' + xml
-    with open(xml_path, "w", encoding="utf-8") as f:
-        f.write(xml)
+def get_mp3_size(url, client=None):
+    """Hämtar filstorlek utan att ladda ner ljudfilen.
 
+    Provar först HEAD och sedan en GET med "Range: bytes=0-0". Svarar servern
+    200 på Range-anropet är det en vanlig GET, och Content-Length gäller.
+    Svaret stängs alltid så att anslutningen inte läcker. Nya försök sköts
+    av CLIENT; är kretsbrytaren öppen kastas CircuitOpenError vidare, så att
+    körningen avbryts i stället för att spara avsnitt utan storlek.
+    """
+    client = client or CLIENT
+    try:
+        with client.head(url, budget="media", allow_redirects=True) as r:
+            length = int(r.headers.get("Content-Length", 0)) if r.ok else 0
+        if length > 0:
+            return length
+        with client.get(url, budget="media", headers={"Range": "bytes=0-0"}, stream=True) as r:
+            if r.status_code == 206:
+                length = httpclient.parse_content_range(r.headers.get("Content-Range"))[1] or 0
+            elif r.ok:
+                length = int(r.headers.get("Content-Length", 0))
+        if length > 0:
+            return length
+    except httpclient.CircuitOpenError:
+        raise
+    except Exception as e:
+        log(f"⚠️ Fel vid hämtning av filstorlek: {e}")
+    return 0
+
+
+def read_range(url, start, length, client=None):
+    """(byte, filstorlek): `length` byte från position `start` med en Range-förfrågan.
+
+    Svarar servern 200 i stället för 206 läses bara så mycket av svaret som
+    behövs, och storleken tas ur Content-Length.
+    """
+    client = client or CLIENT
+    headers = {"Range": f"bytes={start}-{start + length - 1}"}
+    with client.get(url, budget="media", headers=headers, stream=True) as r:
+        r.raise_for_status()
+        if r.status_code == 206:
+            size, skip = httpclient.parse_content_range(r.headers.get("Content-Range"))[1] or 0, 0
+        else:
+            size, skip = int(r.headers.get("Content-Length", 0)), start
+        data = bytearray()
+        for chunk in r.iter_content(16384):
+            data += chunk
+            if len(data) >= skip + length:
+                break
+    return bytes(data[skip : skip + length]), size
 
-def generate_podcast_guid(feed_url):
-    # Strip protocol and trailing slash
-    url = feed_url.replace("https://", "").replace("http://", "").rstrip("/")
-    namespace = uuid.UUID("ead4c236-bf58-58c6-a2c6-a6b28d128cb6")
-    return str(uuid.uuid5(namespace, url))
 
+# Så många byte läses från början av ljudfilen för att hitta MP3-huvudet
+MP3_PROBE_BYTES = 16 * 1024
+# Högst så många sparade avsnitt får sin speltid uppslagen per körning
+DURATION_BACKFILL = 200
+# En ljudfil som inte gick att läsa provas igen efter 1, 2, 4 … dagar, som mest
+# med så här många dagars mellanrum
+DURATION_RETRY_MAX_DAYS = 30
 
-def ensure_podcast_namespace(xml_path):
-    with open(xml_path, "r", encoding="utf-8") as f:
-        xml = f.read()
 
-    if "xmlns:podcast=" not in xml:
-        # Sätt in namespace-attributet i <rss ...>
-        xml = re.sub(
-            r"(<rss\b[^>]*?)>",
-            r'\1 xmlns:podcast="https://podcastindex.org/namespace/1.0">',
-            xml,
-            count=1,
-        )
+def probe_audio(url, client=None):
+    """(filstorlek, speltid i sekunder eller None) ur de första kilobyten av en ljudfil.
+
+    Storleken tas ur Content-Range i samma svar. Är ID3-taggen i början
+    större än det som lästes (t.ex. med en omslagsbild) görs en förfrågan
+    till från taggens slut. Returnerar (0, None) om filen inte gick att hämta;
+    CircuitOpenError kastas vidare som i get_mp3_size.
+    """
+    try:
+        head, size = read_range(url, 0, MP3_PROBE_BYTES, client)
+        start = mp3.id3v2_length(head)
+        data = head[start:]
+        if len(data) < MP3_PROBE_BYTES // 2 and start < size:
+            data, _ = read_range(url, start, MP3_PROBE_BYTES, client)
+        if size > 0:
+            return size, mp3.duration(data, size - start)
+    except httpclient.CircuitOpenError:
+        raise
+    except Exception as e:
+        log(f"⚠️ Fel vid läsning av ljudfilens början: {e}")
+    return 0, None
+
+
+def probe_sizes(episodes, workers=SIZE_WORKERS, exact=None):
+    """Slår upp filstorlek för avsnitten parallellt och sätter ep.size.
+
+    Med `exact` (som standard EXACT_DURATION) läses i stället början av
+    ljudfilen (probe_audio), och ep.duration sätts till den exakta speltiden.
+    """
+    if not episodes:
+        return
+    if exact is None:
+        exact = EXACT_DURATION
+
+    def probe(ep):
+        started = time.perf_counter()
+        if exact:
+            size, seconds = probe_audio(ep.audio)
+            if size:
+                ep.size = size
+                ep.duration_probed = True
+                if seconds is not None:
+                    ep.duration = str(round(seconds))
+        else:
+            ep.size = get_mp3_size(ep.audio)
+        return ep, time.perf_counter() - started
+
+    started = time.perf_counter()
+    latencies = []
+    with profiling.stage("probe"), ThreadPoolExecutor(max_workers=min(workers, len(episodes))) as pool:
+        for ep, elapsed in pool.map(probe, episodes):
+            latencies.append(elapsed)
+            duration = f", {ep.duration} s" if exact else ""
+            log(f"⏱️ {elapsed * 1000:6.0f} ms  {ep.title} ({ep.size} bytes{duration})")
+    total = time.perf_counter() - started
+    log(
+        f"⏱️ Filstorlek för {len(episodes)} avsnitt hämtad på {total:.2f} s "
+        f"(median {median(latencies) * 1000:.0f} ms, max {max(latencies) * 1000:.0f} ms)"
+    )
 
-    with open(xml_path, "w", encoding="utf-8") as f:
-        f.write(xml)
 
+def backfill_durations(db, limit=DURATION_BACKFILL):
+    """Läser in exakt speltid för sparade avsnitt som inte provats än.
+
+    Högst `limit` avsnitt per körning, så att det inte blir tusentals
+    förfrågningar på en gång när EXACT_DURATION slås på för ett stort arkiv.
+    Misslyckade försök sparas (duration_failures, duration_checked), och
+    avsnittet väntar sedan dubbelt så länge för varje misslyckande, högst
+    DURATION_RETRY_MAX_DAYS dagar. Returnerar antalet avsnitt som provades.
+    """
+    now = time.time()
+
+    def due(ep):
+        if ep.duration_probed:
+            return False
+        if not ep.duration_failures or ep.duration_checked is None:
+            return True
+        days = min(2 ** (ep.duration_failures - 1), DURATION_RETRY_MAX_DAYS)
+        return ep.duration_checked < now - days * 86400
+
+    with profiling.stage("store"):
+        pending = list(islice((ep for ep in db.episodes() if due(ep)), limit))
+    probe_sizes(pending, exact=True)
+    for ep in pending:
+        if ep.duration_probed:
+            ep.duration_failures, ep.duration_checked = 0, None
+        else:
+            ep.duration_failures += 1
+            ep.duration_checked = now
+    with profiling.stage("store"):
+        db.upsert(pending)
+    return len(pending)
+
+
+# Högst så många avsnittssidor hämtas per körning, så att ENRICH på ett stort
+# arkiv fördelas över flera körningar
+ENRICH_BATCH = 200
+DETAIL_XPATH = [
+    etree.XPath(f"//*[{has_class('publication-preamble')}]//p"),
+    etree.XPath(f"//*[{has_class('publication-text')}]//p"),
+]
+DETAIL_META_XPATH = etree.XPath("//meta[@property='og:description' or @name='description']/@content")
+
+
+def parse_details(content):
+    """Hela beskrivningen ur ett avsnitts egen sida (bytes), eller None.
+
+    Ingressen och brödtexten, med en tom rad mellan styckena; finns ingen av
+    dem används sidans meta-beskrivning.
+    """
+    root = etree.fromstring(content, HTML_PARSER_LXML)
+    if root is None:
+        return None
+    paragraphs = []
+    for xpath in DETAIL_XPATH:
+        for el in xpath(root):
+            text = " ".join(el.xpath("string()").split())
+            if text and text not in paragraphs:
+                paragraphs.append(text)
+    if not paragraphs:
+        paragraphs = [" ".join(value.split()) for value in DETAIL_META_XPATH(root)[:1]]
+    return "\n\n".join(p for p in paragraphs if p) or None
+
+
+def fetch_details(ep, client=None):
+    """Beskrivningen från avsnittets sida, eller None om sidan saknas (404)."""
+    resp = (client or CLIENT).get(ep.link)
+    if resp.status_code == 404:
+        return None
+    resp.raise_for_status()
+    with profiling.stage("parse"):
+        return parse_details(resp.content)
+
+
+def apply_details(ep, description):
+    """Byter till hela beskrivningen; listans korta text blir itunes:subtitle."""
+    teaser = ep.subtitle
+    ep.description = description
+    ep.itunes_summary = None
+    ep.itunes_subtitle = teaser if teaser != description else None
+
+
+def enrich_details(db, listed, workers=ENRICH_WORKERS, ttl_days=ENRICH_TTL_DAYS, limit=ENRICH_BATCH):
+    """Hämtar avsnittens egna sidor parallellt och sparar hela beskrivningen i `db`.
+
+    Avsnitt vars sida aldrig hämtats, eller hämtades för mer än `ttl_days`
+    dagar sedan, hämtas: högst `limit` per körning, de listade avsnitten
+    (`listed`) först och nyast först, sedan övriga i `db`. De listade
+    avsnitten ändras på plats, eftersom de kan vara samma objekt som hamnar
+    i flödet. Ett avsnitt vars sida inte gick att hämta prövas igen nästa
+    körning. Returnerar antalet avsnitt som fick ny beskrivning.
+    """
+    now = time.time()
+    expiry = now - ttl_days * 86400
+
+    def due(ep):
+        return ep.details_checked is None or ep.details_checked < expiry
+
+    listed = list(listed)
+    pending = sorted((ep for ep in listed if due(ep)), key=episode_datetime, reverse=True)[:limit]
+    if len(pending) < limit:
+        skip = {ep.audio for ep in listed}
+        with profiling.stage("store"):
+            pending += islice((ep for ep in db.episodes() if ep.audio not in skip and due(ep)), limit - len(pending))
+    if not pending:
+        return 0
 
-def add_podcast_guid_to_rss(xml_path, guid):
-    with open(xml_path, "r", encoding="utf-8") as f:
-        xml = f.read()
-    # Kontrollera om redan finns
-    if "<podcast:guid>" in xml:
-        return  # Redan inlagd
-    # Lägg in efter <channel> eller direkt efter <title>
-    xml = re.sub(
-        r"(<channel>\s*)",
-        r"\1<podcast:guid>{}</podcast:guid>\n".format(guid),
-        xml,
-        count=1,
+    def enrich(ep):
+        try:
+            return ep, True, fetch_details(ep)
+        except httpclient.CircuitOpenError:
+            return ep, False, None
+        except Exception as e:
+            log(f"⚠️ Kunde inte hämta avsnittssidan {ep.link}: {e}")
+            return ep, False, None
+
+    started = time.perf_counter()
+    checked, changed = [], 0
+    with ThreadPoolExecutor(max_workers=min(workers, len(pending))) as pool:
+        for ep, ok, description in pool.map(enrich, pending):
+            if not ok:
+                continue
+            ep.details_checked = now
+            if description and description != ep.description:
+                apply_details(ep, description)
+                changed += 1
+            checked.append(ep)
+    with profiling.stage("store"):
+        db.upsert(checked)
+    failed = len(pending) - len(checked)
+    log(
+        f"📝 {len(checked)} avsnittssidor hämtade på {time.perf_counter() - started:.2f} s, "
+        f"{changed} nya beskrivningar" + (f", {failed} misslyckade" if failed else "")
     )
-    with open(xml_path, "w", encoding="utf-8") as f:
-        f.write(xml)
+    return changed
+
+
+def generate_podcast_guid(feed_url):
+    # Strip protocol and trailing slash
+    url = feed_url.replace("https://", "").replace("http://", "").rstrip("/")
+    namespace = uuid.UUID("ead4c236-bf58-58c6-a2c6-a6b28d128cb6")
+    return str(uuid.uuid5(namespace, url))
 
 
 def clean_image_url(url):
@@ -161,253 +894,1197 @@ def parse_duration(abbr_text):
     return str(total_sec)
 
 
-def fetch_episodes():
-    cache = load_cache()
-    resp = requests.get(PROGRAM_URL)
-    soup = BeautifulSoup(resp.content, "html.parser")
-    episodes = []
-    current_audio_urls = set()
-    for item in soup.select("div.episode-list-item"):
-        try:
-            title_el = item.select_one(".audio-heading__title a")
-            date_el = item.select_one(".audio-heading__meta time")
-            desc_el = item.select_one(".episode-list-item__description p")
-            mp3_el = item.select_one("a[href*='topsy/ljudfil']")
-            img_el = item.select_one("img")
-            abbr_el = item.select_one(".audio-heading__meta abbr")
-
-            if not (title_el and date_el and mp3_el):
-                continue
-
-            title = title_el.text.strip()
-            page_link = BASE_URL + title_el["href"]
-            pub_date_raw = date_el["datetime"]
-            pub_date_dt = datetime.datetime.strptime(pub_date_raw, "%Y-%m-%d %H:%M:%SZ")
-            pub_date_rfc = format_datetime(pub_date_dt)
-            pub_date = pub_date_rfc
-
-            description = desc_el.text.strip() if desc_el else ""
+def page_url(page, program=None):
+    listing_url = (program or default_program()).listing_url
+    return listing_url if page <= 1 else f"{listing_url}&page={page}"
+
+
+def fetch_listing(page=1, limiter=None, program=None):
+    """Hämtar en sida av avsnittslistan. Returnerar None om sidan saknas."""
+    if limiter:
+        limiter.wait()
+    with profiling.stage("fetch"):
+        resp = CLIENT.get(page_url(page, program))
+    if page > 1 and resp.status_code == 404:
+        return None
+    resp.raise_for_status()
+    return parse_listing(resp.content)
+
+
+def fetch_first_page(state, conditional=True, program=None):
+    """Hämtar första sidan med villkorlig GET.
+
+    Skickar If-None-Match/If-Modified-Since från förra lyckade körningen och
+    returnerar None om SR svarar 304. Nya validerare läggs i `state`.
+    """
+    headers = {}
+    if conditional:
+        if state.get("listing_etag"):
+            headers["If-None-Match"] = state["listing_etag"]
+        if state.get("listing_last_modified"):
+            headers["If-Modified-Since"] = state["listing_last_modified"]
+    with profiling.stage("fetch"):
+        resp = CLIENT.get(page_url(1, program), headers=headers)
+    if resp.status_code == 304:
+        return None
+    # En felsida får aldrig tolkas som en tom avsnittslista; då ligger förra flödet kvar
+    resp.raise_for_status()
+    for key, header in (("listing_etag", "ETag"), ("listing_last_modified", "Last-Modified")):
+        if resp.headers.get(header):
+            state[key] = resp.headers[header]
+        else:
+            state.pop(key, None)
+    return parse_listing(resp.content)
+
+
+def episodes_digest(episodes, program_image, program=None):
+    """Hash över allt som hamnar i flödet, för att känna igen oförändrade körningar."""
+    program = program or default_program()
+    payload = {
+        "feed": [
+            program.title,
+            program.feed_url,
+            program.channel_url,
+            program.image_url,
+            program.description,
+            program_image,
+        ],
+        "episodes": [ep.content() for ep in episodes],
+    }
+    if MIRROR_URL:
+        payload["mirror"] = MIRROR_URL
+    if WEBSUB_HUBS:
+        payload["hubs"] = WEBSUB_HUBS
+    if len(FEED_FORMATS) > 1:
+        payload["formats"] = FEED_FORMATS
+    data = json.dumps(payload, sort_keys=True, ensure_ascii=False)
+    return hashlib.sha256(data.encode("utf-8")).hexdigest()
+
+
+def episode_datetime(ep):
+    """Sorteringsnyckel för butikerna: publiceringstiden i UTC."""
+    return ep.published
+
+
+def absolute_url(url):
+    if url.startswith("//"):
+        return "https:" + url
+    if url.startswith("/"):
+        return BASE_URL + url
+    return url
+
+
+def episode_from_item(item):
+    """Gör ett avsnitt av de råa fälten från parse_listing."""
+    pub_date_dt = datetime.datetime.strptime(item["date"], "%Y-%m-%d %H:%M:%SZ")
+    pub_date = format_datetime(pub_date_dt)
+
+    # Bild-url
+    image_url = item["image"]
+    if image_url:
+        image_url = absolute_url(image_url)
+    image_url = clean_image_url(image_url)
+
+    # Duration
+    duration = None
+    if item["duration"] is not None:
+        duration = parse_duration(item["duration"])
+
+    # Filstorleken (size) hämtas parallellt för alla nya avsnitt i merge_page.
+    # itunes_summary/itunes_subtitle är samma som description och itunes_author
+    # är alltid "Sveriges Radio", så de får Episodes standardvärden
+    return store.Episode(
+        title=item["title"],
+        link=BASE_URL + item["href"],
+        audio=absolute_url(item["audio"]),
+        date=pub_date,
+        description=item["description"],
+        image=image_url,
+        duration=duration,
+    )
 
-            audio_url = mp3_el["href"]
-            if audio_url.startswith("//"):
-                audio_url = "https:" + audio_url
-            elif audio_url.startswith("/"):
-                audio_url = BASE_URL + audio_url
 
-            current_audio_urls.add(audio_url)
+def merge_page(listing, db, seen):
+    """Lägger in avsnitten från en tolkad sida i `db` och `seen`.
 
-            if audio_url in cache:
+    Nya avsnitt får sin filstorlek uppslagen innan de sparas, i en enda
+    transaktion, så att en avbruten körning aldrig lämnar avsnitt med
+    storlek 0 efter sig.
+    Returnerar listan av avsnitt på sidan, i sidans ordning.
+    """
+    episodes = []
+    new_episodes = []
+    for item in listing["items"]:
+        try:
+            parsed = episode_from_item(item)
+            audio_url = parsed.audio
+            episode = db.get(audio_url)
+            if episode is not None:
                 if DEBUG:
-                    print(f"[CACHE] {title} ({audio_url})")
-                episode = cache[audio_url]
+                    log(f"[CACHE] {parsed.title} ({audio_url})")
             else:
                 if DEBUG:
-                    print(f"[FETCH] {title} ({audio_url})")
-                # Bild-url
-                image_url = None
-                if img_el:
-                    image_url = img_el.get("data-src") or img_el.get("src")
-                    if image_url:
-                        if image_url.startswith("//"):
-                            image_url = "https:" + image_url
-                        elif image_url.startswith("/"):
-                            image_url = BASE_URL + image_url
-                    image_url = clean_image_url(image_url)
-
-                # Duration
-                duration = None
-                if abbr_el:
-                    duration = parse_duration(abbr_el.text.strip())
-
-                # Size
-                size = get_mp3_size(audio_url)
-
-                # Itunes subtitle och summary: samma som description, eller om du vill generera bättre (t.ex. extrahera första meningen)
-                itunes_subtitle = description
-                itunes_summary = description
-
-                # Itunes author
-                itunes_author = "Sveriges Radio"  # statiskt, kan ibland vara annorlunda i originalet
-
-                episode = {
-                    "title": title,
-                    "link": page_link,
-                    "audio": audio_url,
-                    "date": pub_date,
-                    "description": description,
-                    "image": image_url,
-                    "duration": duration,
-                    "size": size,
-                    "itunes_author": itunes_author,
-                    "itunes_summary": itunes_summary,
-                    "itunes_subtitle": itunes_subtitle,
-                    # "guid": ...  # Om du vill särskilja från länk
-                }
-                cache[audio_url] = episode
+                    log(f"[FETCH] {parsed.title} ({audio_url})")
+                episode = parsed
+                new_episodes.append(episode)
+            seen[audio_url] = episode
             episodes.append(episode)
         except Exception as e:
-            print(f"⚠️ Fel vid parsning: {e}")
+            log(f"⚠️ Fel vid parsning: {e}")
 
-    for cached_url in list(cache):
-        if cached_url not in current_audio_urls:
-            if DEBUG:
-                print(f"[REMOVE] Tar bort cache för {cached_url}")
-            del cache[cached_url]
-
-    save_cache(cache)
+    probe_sizes(new_episodes)
+    with profiling.stage("store"):
+        db.upsert(new_episodes)
     return episodes
 
 
-def fix_channel_link(xml_path, program_url=CHANNEL_URL):
-    with open(xml_path, "r", encoding="utf-8") as f:
-        xml = f.read()
-    xml = re.sub(
-        r"<channel>\s*(<podcast:guid>.*?</podcast:guid>\s*)?<title>.*?</title>\s*<link>.*?</link>",
-        lambda m: m.group(0).replace(
-            re.search(r"<link>.*?</link>", m.group(0)).group(0),
-            f"<link>{program_url}</link>",
-        ),
-        xml,
-        flags=re.DOTALL,
-    )
-    with open(xml_path, "w", encoding="utf-8") as f:
-        f.write(xml)
+def crawl_archive(first, db, state, seen, max_pages=ARCHIVE_MAX_PAGES, program=None):
+    """Går igenom avsnittslistans sidor parallellt och fyller på `db`.
 
+    Med en kall cache hämtas alla sidor (upp till `max_pages`) på en gång.
+    Har arkivet redan hämtats en gång går vi bara bakåt, en omgång
+    (ARCHIVE_WORKERS sidor) i taget, tills vi når ett avsnitt som är äldre än
+    eller lika gammalt som det nyaste vi redan känner till.
 
-def fix_channel_images(
-    xml_path, channel_url, image_url, preset="api-itunes-presentation-image"
-):
-    with open(xml_path, "r", encoding="utf-8") as f:
-        xml = f.read()
-
-    # 1. Ersätt <image><link>...</link> med <image><link>{channel_url}</link>
-    xml = re.sub(
-        r"(<image>.*?<title>.*?</title>\s*<link>)(.*?)(</link>)",
-        r"\1" + channel_url + r"\3",
-        xml,
-        flags=re.DOTALL,
-    )
-    # 2. Ersätt <image><url>...</url> med exakt image_url (med preset)
-    xml = re.sub(
-        r"(<image>\s*<url>)(.*?)(</url>)",
-        r"\1" + image_url + r"\3",
-        xml,
-        flags=re.DOTALL,
-    )
+    Sista sidan tas från pagineringen på varje hämtad sida, inte bara den
+    första, eftersom en sida bara kan länka några sidor framåt. Listan är
+    slut först vid en tom sida (eller 404), eller en sida vars paginering
+    inte länkar längre fram än till sig själv.
 
-    # 3. Sätt preset på alla https://static-cdn.sr.se/images/...jpg eller png i itunes:image etc (om ej redan preset)
-    def add_preset(m):
-        url = m.group(1)
-        if "preset=" not in url:
-            return f'{url}?preset={preset}"'
-        else:
-            return m.group(0)
+    Returnerar (ok, complete, cutoff): ok är False om någon sida inte gick
+    att hämta, complete är True om listan gicks igenom till slutet eller
+    till redan kända avsnitt, och cutoff är datumet på det äldsta avsnitt
+    vi såg om listan inte gicks igenom ända till slutet (annars None).
+    """
+    newest_known = None
+    if state.get("archive_complete"):
+        newest_known = store.newest_datetime(db)
+    limiter = RateLimiter(ARCHIVE_DELAY)
 
-    xml = re.sub(
-        r'(https://static-cdn\.sr\.se/images/[0-9]+/[a-f0-9\-]+\.(?:jpg|png))"',
-        add_preset,
-        xml,
-    )
+    # Högsta sidnumret i någon paginering hittills
+    highest = first["last_page"]
+    page_eps = merge_page(first, db, seen)
 
-    # TA BORT preset för bilder i <content:encoded>
-    # Ersätt t.ex. src="...jpg?pres...ion-image" med src="...jpg"
-    xml = re.sub(
-        r'(<content:encoded>.*?src="https://static-cdn\.sr\.se/images/[0-9]+/[a-f0-9\-]+\.jpg)\?preset=[^"]*(".*?</content:encoded>)',
-        r"\1\2",
-        xml,
-        flags=re.DOTALL,
-    )
+    def last_page():
+        return min(highest or max_pages, max_pages)
 
-    with open(xml_path, "w", encoding="utf-8") as f:
-        f.write(xml)
+    def reached_known(eps):
+        return newest_known is not None and any(
+            episode_datetime(ep) <= newest_known for ep in eps
+        )
 
+    started = time.perf_counter()
+    fetched, failed = 1, False
+    hit_known, hit_empty, hit_last = reached_known(page_eps), not page_eps, False
+    next_page = 2
+    with ThreadPoolExecutor(max_workers=ARCHIVE_WORKERS) as pool:
+        while not (hit_known or hit_empty or hit_last) and next_page <= last_page():
+            batch_end = last_page()
+            if newest_known is not None:
+                batch_end = min(batch_end, next_page + ARCHIVE_WORKERS - 1)
+            futures = {
+                pool.submit(fetch_listing, page, limiter, program): page
+                for page in range(next_page, batch_end + 1)
+            }
+            next_page = batch_end + 1
+            for fut in as_completed(futures):
+                page = futures[fut]
+                try:
+                    listing = fut.result()
+                except Exception as e:
+                    log(f"⚠️ Kunde inte hämta sida {page}: {e}")
+                    failed = True
+                    continue
+                fetched += 1
+                # Varje sida sparas direkt så att en avbruten körning inte går förlorad
+                page_eps = merge_page(listing, db, seen) if listing else []
+                if listing:
+                    if listing["last_page"] is None or listing["last_page"] <= page:
+                        hit_last = True
+                    else:
+                        highest = max(highest or 0, listing["last_page"])
+                if DEBUG:
+                    log(f"[ARCHIVE] Sida {page}: {len(page_eps)} avsnitt")
+                hit_known = hit_known or reached_known(page_eps)
+                hit_empty = hit_empty or not page_eps
 
-def fix_itunes_explicit(xml_path):
-    with open(xml_path, "r", encoding="utf-8") as f:
-        xml = f.read()
-    # Byt ut alla <itunes:explicit>no</itunes:explicit> till <itunes:explicit>false</itunes:explicit>
-    xml = re.sub(
-        r"<itunes:explicit>\s*no\s*</itunes:explicit>",
-        r"<itunes:explicit>false</itunes:explicit>",
-        xml,
-        flags=re.IGNORECASE,
+    log(
+        f"📚 Arkiv: {fetched} sidor hämtade på {time.perf_counter() - started:.2f} s, "
+        f"{len(db)} avsnitt sparade"
     )
-    # (Om du skulle ha TRUE, byt ut eventuellt "yes" mot "true" också)
-    xml = re.sub(
-        r"<itunes:explicit>\s*yes\s*</itunes:explicit>",
-        r"<itunes:explicit>true</itunes:explicit>",
-        xml,
-        flags=re.IGNORECASE,
-    )
-    with open(xml_path, "w", encoding="utf-8") as f:
-        f.write(xml)
+    reached_end = hit_empty or hit_last
+    cutoff = None
+    if hit_known or not reached_end:
+        cutoff = min((episode_datetime(ep) for ep in seen.values()), default=None)
+    return not failed, reached_end or hit_known, cutoff
+
+
+def apply_retention(db, seen, policy=CACHE_RETENTION, cutoff=None):
+    """Rensar sparade avsnitt enligt vald policy.
+
+    "listing" tar bort avsnitt som inte längre listas hos SR. Har bara en del
+    av listan hämtats anger `cutoff` det äldsta datumet som faktiskt
+    kontrollerades; äldre avsnitt lämnas då orörda.
+    """
+    if policy == "all":
+        return
+    if policy == "listing":
+        oldest = cutoff.timestamp() if cutoff is not None else float("-inf")
+        doomed = [url for url, ts in db.index() if url not in seen and ts >= oldest]
+    elif policy.startswith("newest:"):
+        keep = int(policy.split(":", 1)[1])
+        doomed = [url for url, _ in islice(db.index(), keep, None)]
+    elif policy.startswith("days:"):
+        days = int(policy.split(":", 1)[1])
+        limit = datetime.datetime.now(datetime.timezone.utc) - datetime.timedelta(days=days)
+        doomed = [url for url, ts in db.index() if ts < limit.timestamp()]
+    else:
+        log(f"⚠️ Okänd CACHE_RETENTION '{policy}', behåller hela cachen")
+        return
+    if DEBUG:
+        for url in doomed:
+            log(f"[REMOVE] Tar bort cache för {url}")
+    db.delete(doomed)
+
+
+def fetch_episodes(
+    db,
+    archive=ARCHIVE,
+    retention=CACHE_RETENTION,
+    max_pages=ARCHIVE_MAX_PAGES,
+    state=None,
+    force=False,
+    stats=None,
+    program=None,
+):
+    """Hämtar avsnittslistan och returnerar avsnitten för flödet.
+
+    Returnerar None om inget har ändrats sedan förra körningen (304 från SR,
+    eller samma avsnitt som sist); då rörs inte flödet. Med ENRICH hämtas
+    ändå avsnittssidor vars ENRICH_TTL_DAYS gått ut, och har någon
+    beskrivning ändrats byggs flödet trots 304. I arkivläge och med
+    annan CACHE_RETENTION än "listing" returneras en store.EpisodeView som
+    läser avsnitten ur `db` först när flödet byggs.
+    `state` uppdateras med validerare, kanalbild och hash, och ska sparas av
+    anroparen, även när None returneras; returneras avsnitt först när flödet
+    väl är skrivet. `force` hoppar över båda kontrollerna.
+    Ges en dict som `stats` fylls "new_episodes" i med antal nya avsnitt,
+    samt "cache_hits"/"cache_misses": hur många listade avsnitt som redan
+    fanns sparade och hur många som fick hämtas. "fresh" blir listan av
+    nyutkomna avsnitt, dvs. nyare än det nyaste som fanns sparat (tom vid
+    första körningen, då allt är nytt). `program` är som standard
+    default_program().
+    """
+    program = program or default_program()
+    if state is None:
+        state = load_state(program)
+    check = not force and os.path.exists(program.output_file)
+
+    first = fetch_first_page(state, conditional=check, program=program)
+    if first is None:
+        if DEBUG:
+            log("[HTTP] 304 Not Modified för avsnittslistan")
+        if not ENRICH:
+            return None
+        # Avsnittssidornas ENRICH_TTL_DAYS går ut även när listan är oförändrad
+        with profiling.stage("enrich"):
+            changed = enrich_details(db, [])
+        if not changed:
+            return None
+        first = fetch_first_page(state, conditional=False, program=program)
+    state["program_image"] = extract_program_image(first, program)
+
+    # Före sammanslagningen, så att sidans avsnitt läses ur databasen med den nya tiden
+    if EXACT_DURATION:
+        with profiling.stage("backfill"):
+            backfill_durations(db)
+    known = len(db)
+    newest_known = store.newest_datetime(db) if stats is not None else None
+    seen = {}
+    if archive:
+        with profiling.stage("archive"):
+            ok, complete, cutoff = crawl_archive(first, db, state, seen, max_pages, program)
+        # Först när hela listan setts, annars går nästa körning bara bakåt
+        # till det nyaste kända avsnittet och resten hämtas aldrig
+        if ok and complete:
+            state["archive_complete"] = True
+        # Saknas sidor vet vi inte vad som försvunnit hos SR, så då rensar
+        # "listing" ingenting den här gången.
+        # Nya avsnitt läggs bara till, så skillnaden före rensning är antalet nya
+        new_episodes = len(db) - known
+        if ok or retention != "listing":
+            with profiling.stage("retention"):
+                apply_retention(db, seen, retention, cutoff)
+    else:
+        with profiling.stage("merge"):
+            episodes = merge_page(first, db, seen)
+        new_episodes = len(db) - known
+        with profiling.stage("retention"):
+            apply_retention(db, seen, retention)
+    # Efter rensningen, så att inga sidor hämtas för avsnitt som just tagits bort
+    if ENRICH:
+        with profiling.stage("enrich"):
+            enrich_details(db, seen.values())
+
+    if archive or retention != "listing":
+        episodes = store.EpisodeView(db)
+    if stats is not None:
+        stats["new_episodes"] = new_episodes
+        stats["cache_misses"] = new_episodes
+        stats["cache_hits"] = len(seen) - new_episodes
+        if newest_known is not None:
+            stats["fresh"] = sorted(
+                (ep for ep in seen.values() if episode_datetime(ep) > newest_known),
+                key=episode_datetime,
+            )
+
+    with profiling.stage("digest"):
+        digest = episodes_digest(episodes, state["program_image"], program)
+    if check and digest == state.get("episodes_hash"):
+        return None
+    state["episodes_hash"] = digest
+    return episodes
+
+
+PODCAST_NS = "https://podcastindex.org/namespace/1.0"
+ITUNES_NS = "http://www.itunes.com/dtds/podcast-1.0.dtd"
+ATOM_NS = "http://www.w3.org/2005/Atom"
+HISTORY_NS = "http://purl.org/syndication/history/1.0"
+XML_DECLARATION = b'<?xml version="1.0" encoding="UTF-8"?>\n'
+IMAGE_PRESET = "api-itunes-presentation-image"
+SR_IMAGE_RE = re.compile(r"^https://static-cdn\.sr\.se/images/[0-9]+/[a-f0-9\-]+\.(?:jpg|png)$")
 
 
-def generate_rss(episodes, filename=OUTPUT_FILE):
+def ensure_podcast_namespace(root, opts):
+    # Flyttar podcast-deklarationen till <rss>, så den måste köras efter
+    # steg som lägger till podcast:-element
+    if root.nsmap.get("podcast") != PODCAST_NS:
+        etree.cleanup_namespaces(
+            root, top_nsmap={"podcast": PODCAST_NS}, keep_ns_prefixes=list(root.nsmap)
+        )
+
+
+def add_podcast_guid(root, opts):
+    channel = root.find("channel")
+    if channel.find(f"{{{PODCAST_NS}}}guid") is not None:
+        return  # Redan inlagd
+    guid = etree.SubElement(channel, f"{{{PODCAST_NS}}}guid")
+    guid.text = opts["guid"]
+    channel.insert(0, guid)
+
+
+def fix_itunes_explicit(root, opts):
+    # "no"/"yes" från feedgen blir "false"/"true" som Apple vill ha
+    for el in root.iter(f"{{{ITUNES_NS}}}explicit"):
+        value = (el.text or "").strip().lower()
+        if value == "no":
+            el.text = "false"
+        elif value == "yes":
+            el.text = "true"
+
+
+def fix_channel_link(root, opts):
+    link = root.find("channel/link")
+    if link is not None:
+        link.text = opts["channel_url"]
+
+
+def fix_channel_images(root, opts):
+    image = root.find("channel/image")
+    if image is not None:
+        image.find("url").text = opts["image_url"]
+        image.find("link").text = opts["channel_url"]
+
+
+def add_archive_links(root, opts):
+    # RFC 5005: länkar mellan det aktuella dokumentet och arkivsidorna
+    links = opts.get("links")
+    if not links:
+        return
+    channel = root.find("channel")
+    self_link = channel.find(f"{{{ATOM_NS}}}link[@rel='self']")
+    if links.get("self"):
+        self_link.set("href", links["self"])
+    position = channel.index(self_link) + 1
+    for rel in ("current", "prev-archive", "next-archive"):
+        if links.get(rel):
+            channel.insert(position, etree.Element(f"{{{ATOM_NS}}}link", {"href": links[rel], "rel": rel}))
+            position += 1
+    if links.get("archive"):
+        channel.insert(position, etree.Element(f"{{{HISTORY_NS}}}archive", nsmap={"fh": HISTORY_NS}))
+        etree.cleanup_namespaces(root, top_nsmap={"fh": HISTORY_NS}, keep_ns_prefixes=list(root.nsmap))
+        # En arkivsida ändras aldrig, så den får inget byggdatum
+        build_date = channel.find("lastBuildDate")
+        if build_date is not None:
+            channel.remove(build_date)
+
+
+def add_hub_links(root, opts):
+    # WebSub: hubbarna som pingas när flödet ändras. En arkivsida ändras aldrig
+    # och behöver ingen hubb
+    links = opts.get("links") or {}
+    if not opts["hubs"] or links.get("archive"):
+        return
+    channel = root.find("channel")
+    self_link = channel.find(f"{{{ATOM_NS}}}link[@rel='self']")
+    position = channel.index(self_link) + 1
+    for hub in opts["hubs"]:
+        channel.insert(position, etree.Element(f"{{{ATOM_NS}}}link", {"href": hub, "rel": "hub"}))
+        position += 1
+
+
+def preset_image_url(href, preset=IMAGE_PRESET):
+    """SR-bildens url med preset, andra url:er som de är."""
+    if href and SR_IMAGE_RE.match(href):
+        return f"{href}?preset={preset}"
+    return href
+
+
+def add_image_preset(root, opts):
+    # Preset på alla itunes:image från SR; bilderna i content:encoded lämnas orörda
+    for el in root.iter(f"{{{ITUNES_NS}}}image"):
+        href = el.get("href", "")
+        if SR_IMAGE_RE.match(href):
+            el.set("href", preset_image_url(href, opts["preset"]))
+
+
+# Körs i tur och ordning på samma träd; lägg till nya steg här. Stegen i
+# ITEM_STAGES får bara titta på det element de får, eftersom de även körs på
+# ett <item> i taget vid inkrementell generering.
+CHANNEL_STAGES = [
+    add_podcast_guid,
+    ensure_podcast_namespace,
+    fix_channel_link,
+    fix_channel_images,
+    add_archive_links,
+    add_hub_links,
+]
+ITEM_STAGES = [
+    fix_itunes_explicit,
+    add_image_preset,
+]
+FEED_STAGES = CHANNEL_STAGES + ITEM_STAGES
+
+FEED_PARSER = etree.XMLParser(remove_blank_text=True, strip_cdata=False)
+
+
+def postprocess_feed(root, guid, channel_url=CHANNEL_URL, image_url=API_IMAGE_URL, links=None):
+    """Efterbearbetar feedgens RSS-träd i minnet och returnerar färdiga bytes.
+
+    `root` är <rss>-elementet, antingen direkt från feedgen eller parsat
+    från bytes med FEED_PARSER. `links` är RFC 5005-länkarna för en sida
+    (se write_pages).
+    """
+    opts = stage_options(guid, channel_url, image_url, links)
+    with profiling.stage("postprocess"):
+        for stage in FEED_STAGES:
+            stage(root, opts)
+        return XML_DECLARATION + etree.tostring(root, pretty_print=True, encoding="UTF-8")
+
+
+def stage_options(guid, channel_url=CHANNEL_URL, image_url=API_IMAGE_URL, links=None, hubs=None):
+    return {
+        "guid": guid,
+        "channel_url": channel_url,
+        "image_url": image_url,
+        "preset": IMAGE_PRESET,
+        "links": links,
+        "hubs": WEBSUB_HUBS if hubs is None else hubs,
+    }
+
+
+def build_feed(episodes, program_image, build_date=None, program=None):
+    program = program or default_program()
     fg = FeedGenerator()
     fg.load_extension("podcast")
 
-    fg.title(FEED_TITLE)
-    fg.link(href=CHANNEL_URL, rel="alternate")
-    fg.link(href=FEED_URL, rel="self", type="application/rss+xml")
+    fg.title(program.title)
+    fg.link(href=program.channel_url, rel="alternate")
+    fg.link(href=program.feed_url, rel="self", type="application/rss+xml")
     fg.language("sv")
-    fg.logo(fetch_program_image())
+    fg.logo(program_image)
     fg.generator("python-feedgen")
-    desc_plain = "Inofficiellt RSS-flöde automatiskt genererat från Sveriges Radio. Alla Sommarprat finns att lyssna på i Sveriges Radio Play."
+    desc_plain = program.description
     fg.podcast.itunes_summary(desc_plain)
     fg.description(desc_plain)
     fg.copyright("Copyright Sveriges Radio 2025. All rights reserved.")
+    if build_date is not None:
+        fg.lastBuildDate(build_date)
 
-    fg.id(FEED_URL)
+    fg.id(program.feed_url)
     fg.podcast.itunes_author("Sveriges Radio")
     fg.podcast.itunes_category("Society & Culture")
     fg.podcast.itunes_explicit("no")
-    fg.podcast.itunes_image(fetch_program_image())
+    fg.podcast.itunes_image(program_image)
 
     for ep in episodes:
-        fe = fg.add_entry()
-        fe.title(ep["title"])
-        fe.link(href=ep["link"])
-        fe.podcast.itunes_duration(ep.get("duration", "00:00:00"))
-        fe.podcast.itunes_image(ep["image"])
-        fe.podcast.itunes_summary(ep.get("itunes_summary", ep["description"]))
-        fe.podcast.itunes_author(ep.get("itunes_author", "Sveriges Radio"))
-        fe.podcast.itunes_subtitle(ep.get("itunes_subtitle", ep["description"]))
-        fe.pubDate(ep["date"])
-        fe.guid(ep["link"], permalink=True)
-        fe.description(ep["description"])
-        fe.enclosure(ep["audio"], ep["size"], "audio/mpeg")
-        fe.podcast.itunes_explicit("no")
-        html = (
-            f'<p>{ep["description"]}</p><img src="{ep["image"]}" alt="{ep["title"]}"/>'
-        )
-        fe.content(content=html, type="CDATA")
-
-    fg.rss_file(filename, pretty=True)
-    if DEBUG:
-        print(f"[FEEDGEN] RSS-flöde genererat med {len(episodes)} avsnitt.")
-    guid = generate_podcast_guid(FEED_URL)
-    ensure_podcast_namespace(filename)
-    if DEBUG:
-        print(f"[GUID] Genererad podcast GUID: {guid}")
-    add_podcast_guid_to_rss(filename, guid)
-    fix_itunes_explicit(filename)
-    if DEBUG:
-        print(f"[ITUNES] Fixade explicit tag i {filename}")
-    fix_channel_link(filename, CHANNEL_URL)
+        fill_entry(fg.add_entry(), ep)
+    return fg
+
+
+def enclosure_url(ep):
+    """Ljudfilens url i flödet: den lokala spegeln med MIRROR_URL, annars SR:s."""
+    if MIRROR_URL:
+        return f"{MIRROR_URL}/{mirror.file_name(ep.audio)}"
+    return ep.audio
+
+
+def fill_entry(fe, ep):
+    fe.title(ep.title)
+    fe.link(href=ep.link)
+    fe.podcast.itunes_duration(ep.duration)
+    fe.podcast.itunes_image(ep.image)
+    fe.podcast.itunes_summary(ep.summary)
+    fe.podcast.itunes_author(ep.itunes_author)
+    fe.podcast.itunes_subtitle(ep.subtitle)
+    # Färdig datetime, så att feedgen slipper tolka strängen med dateutil
+    fe.pubDate(ep.published)
+    fe.guid(ep.link, permalink=True)
+    fe.description(ep.description)
+    fe.enclosure(enclosure_url(ep), ep.size, "audio/mpeg")
+    fe.podcast.itunes_explicit("no")
+    fe.content(content=episode_html(ep), type="CDATA")
+    return fe
+
+
+def episode_html(ep):
+    """Avsnittets beskrivning och bild som HTML, för content:encoded m.fl.
+
+    En beskrivning från avsnittets sida (ENRICH) har en tom rad mellan
+    styckena, och varje stycke blir ett eget <p>.
+    """
+    paragraphs = "".join(f"<p>{paragraph}</p>" for paragraph in ep.description.split("\n\n"))
+    return f'{paragraphs}<img src="{ep.image}" alt="{ep.title}"/>'
+
+
+def render_feed(episodes, program_image, build_date=None, program=None):
+    """Bygger hela flödet i minnet: feedgen följt av FEED_STAGES."""
+    program = program or default_program()
+    fg = build_feed(episodes, program_image, build_date, program)
     if DEBUG:
-        print(f"[ITUNES] Fixade channel link i {filename}")
-    fix_channel_images(OUTPUT_FILE, CHANNEL_URL, API_IMAGE_URL)
+        log(f"[FEEDGEN] RSS-flöde genererat med {len(episodes)} avsnitt.")
+    guid = generate_podcast_guid(program.feed_url)
     if DEBUG:
-        print(f"[ITUNES] Fixade image link i {filename}")
+        log(f"[GUID] Genererad podcast GUID: {guid}")
+    # rss_str() är bara _create_rss() plus serialisering; vi tar trädet direkt
+    # i stället för att serialisera och parsa om det
+    root, _ = fg._create_rss()
+    return postprocess_feed(root, guid, program.channel_url, program.image_url or program_image)
+
+
+# Höj när fill_entry eller ITEM_STAGES ändras, så att sparade <item> renderas om
+ITEM_RENDER_VERSION = 1
+
+
+def item_key(ep):
+    """Nyckel för ett renderat <item>: ändras när avsnittet eller mallen ändras."""
+    key = [ITEM_RENDER_VERSION, IMAGE_PRESET, ep.content()]
+    if MIRROR_URL:
+        key.append(MIRROR_URL)
+    data = json.dumps(key, sort_keys=True, ensure_ascii=False)
+    return hashlib.sha1(data.encode("utf-8")).hexdigest()
+
+
+def render_shell(program_image, build_date, program, links=None):
+    """Renderar flödet utan avsnitt. Returnerar (början, slut, nsmap)."""
+    fg = build_feed([], program_image, build_date, program)
+    root, _ = fg._create_rss()
+    guid = generate_podcast_guid(program.feed_url)
+    data = postprocess_feed(root, guid, program.channel_url, program.image_url or program_image, links)
+    split = data.rindex(b"  </channel>")
+    return data[len(XML_DECLARATION) : split], data[split:], root.nsmap
+
+
+def render_item(fg, ep, nsmap):
+    """Renderar ett <item> exakt som det blir i ett helt, indenterat flöde.
+
+    Avsnittet läggs ensamt i ett <rss><channel> med samma namnrymder som det
+    riktiga flödet, så att indrag och prefix blir identiska med en full
+    rendering; sedan klipps <item>-raderna ut.
+    """
+    fe = fill_entry(fg.add_entry(order="append"), ep)
+    item = fe.rss_entry()
+    fg.remove_entry(fe)
+    opts = stage_options(None)
+    for stage in ITEM_STAGES:
+        stage(item, opts)
+    root = etree.Element("rss", nsmap=nsmap)
+    etree.SubElement(root, "channel").append(item)
+    data = etree.tostring(root, pretty_print=True, encoding="UTF-8")
+    start = data.index(b"<channel>\n") + len(b"<channel>\n")
+    return data[start : data.rindex(b"  </channel>")]
+
+
+def render_items(episodes, nsmap, reuse=True):
+    """Renderade <item> (bytes) i flödets ordning, och avsnitten som renderades om.
+
+    Med `reuse` återanvänds sparade <item> (rss_item) vars nyckel
+    (rss_key från item_key()) fortfarande stämmer. Avsnitten läses bara
+    en gång, äldst först via reversed(), så `episodes` kan vara en
+    store.EpisodeView.
+    """
+    fg = FeedGenerator()
+    fg.load_extension("podcast")
+    items = []
+    rendered = []
+    # feedgen lägger varje nytt avsnitt först, så flödet har omvänd ordning
+    for ep in reversed(episodes):
+        key = item_key(ep)
+        if not reuse or ep.rss_key != key or ep.rss_item is None:
+            ep.rss_item = render_item(fg, ep, nsmap).decode("utf-8")
+            ep.rss_key = key
+            rendered.append(ep)
+        items.append(ep.rss_item.encode("utf-8"))
+    return items, rendered
+
+
+def render_feed_incremental(episodes, program_image, build_date=None, program=None, reuse=True):
+    """Som render_feed, men återanvänder sparade <item> för oförändrade avsnitt.
+
+    Returnerar (bytes, omrenderade avsnitt, alla <item> i flödets ordning);
+    se render_items. Med reuse=False renderas alla avsnitt, och resultatet
+    är detsamma som render_feed.
+    """
+    program = program or default_program()
+    if build_date is None:
+        build_date = datetime.datetime.now(datetime.timezone.utc)
+    head, tail, nsmap = render_shell(program_image, build_date, program)
+    items, rendered = render_items(episodes, nsmap, reuse)
     if DEBUG:
-        print(f"[XML] XML-tidy utförd på {filename}")
-    fix_xml_declaration(filename)
+        log(f"[FEEDGEN] {len(rendered)} av {len(episodes)} avsnitt renderades om.")
+    return b"".join([XML_DECLARATION, head, *items, tail]), rendered, items
+
+
+def format_file(program, fmt):
+    """Filen för ett annat format än RSS: sommar_i_p1.xml -> sommar_i_p1.atom"""
+    return os.path.splitext(program.output_file)[0] + FORMAT_EXTENSIONS[fmt]
+
+
+def format_url(program, fmt):
+    return f"{program.feed_url}?format={fmt}"
+
+
+def atom_element(parent, tag, text=None, **attrs):
+    el = etree.SubElement(parent, f"{{{ATOM_NS}}}{tag}", attrs)
+    if text is not None:
+        el.text = text
+    return el
+
+
+def atom_entry(ep):
+    """Ett <entry> som text, indenterat som i render_atom.
+
+    Skrivs med en mall i stället för med lxml: ett element i taget kostar
+    mer än hela resten av Atom-flödet.
+    """
+    published = ep.published.isoformat(timespec="seconds")
+    return f"""  <entry>
+    <id>{escape(ep.link)}</id>
+    <title>{escape(ep.title)}</title>
+    <link href={quoteattr(ep.link)} rel="alternate" type="text/html"/>
+    <link href={quoteattr(enclosure_url(ep))} rel="enclosure" type="audio/mpeg" length="{ep.size}"/>
+    <published>{published}</published>
+    <updated>{published}</updated>
+    <author>
+      <name>{escape(ep.itunes_author)}</name>
+    </author>
+    <summary>{escape(ep.summary)}</summary>
+    <content type="html">{escape(episode_html(ep))}</content>
+  </entry>
+"""
+
+
+def render_atom(episodes, program_image, build_date=None, program=None):
+    """Flödet som Atom (RFC 4287), nyast först, ur samma avsnitt som RSS-flödet.
+
+    Byggs utan feedgen: huvudet med lxml och varje <entry> med atom_entry,
+    så ett format till kostar en genomgång av avsnitten, inte en rendering till.
+    """
+    program = program or default_program()
+    if build_date is None:
+        build_date = datetime.datetime.now(datetime.timezone.utc)
+    root = etree.Element(f"{{{ATOM_NS}}}feed", nsmap={None: ATOM_NS})
+    root.set("{http://www.w3.org/XML/1998/namespace}lang", "sv")
+    atom_element(root, "id", program.feed_url)
+    atom_element(root, "title", program.title)
+    atom_element(root, "subtitle", program.description)
+    atom_element(root, "updated", build_date.isoformat(timespec="seconds"))
+    atom_element(root, "link", href=program.channel_url, rel="alternate", type="text/html")
+    atom_element(root, "link", href=format_url(program, "atom"), rel="self", type="application/atom+xml")
+    for hub in WEBSUB_HUBS:
+        atom_element(root, "link", href=hub, rel="hub")
+    atom_element(atom_element(root, "author"), "name", store.DEFAULT_AUTHOR)
+    atom_element(root, "icon", program_image)
+    atom_element(root, "logo", program.image_url or program_image)
+    atom_element(root, "rights", "Copyright Sveriges Radio 2025. All rights reserved.")
+    atom_element(root, "generator", "sommar.py")
+    data = etree.tostring(root, pretty_print=True, encoding="UTF-8")
+    split = data.rindex(b"</feed>")
+    entries = "".join(atom_entry(ep) for ep in episodes).encode("utf-8")
+    return b"".join([XML_DECLARATION, data[:split], entries, data[split:]])
+
+
+def render_json_feed(episodes, program_image, build_date=None, program=None):
+    """Flödet som JSON Feed 1.1, nyast först, ur samma avsnitt som RSS-flödet.
+
+    JSON Feed har inget byggdatum, så `build_date` används inte; samma
+    avsnitt ger samma bytes.
+    """
+    program = program or default_program()
+    feed = {
+        "version": "https://jsonfeed.org/version/1.1",
+        "title": program.title,
+        "home_page_url": program.channel_url,
+        "feed_url": format_url(program, "json"),
+        "description": program.description,
+        "icon": program_image,
+        "language": "sv",
+        "authors": [{"name": store.DEFAULT_AUTHOR}],
+    }
+    if WEBSUB_HUBS:
+        feed["hubs"] = [{"type": "WebSub", "url": hub} for hub in WEBSUB_HUBS]
+    items = []
+    for ep in episodes:
+        attachment = {"url": enclosure_url(ep), "mime_type": "audio/mpeg", "size_in_bytes": ep.size}
+        if ep.duration:
+            attachment["duration_in_seconds"] = int(ep.duration)
+        item = {
+            "id": ep.link,
+            "url": ep.link,
+            "title": ep.title,
+            "content_html": episode_html(ep),
+            "summary": ep.summary,
+            "date_published": ep.published.isoformat(timespec="seconds"),
+            "authors": [{"name": ep.itunes_author}],
+            "attachments": [attachment],
+        }
+        if ep.image:
+            item["image"] = preset_image_url(ep.image)
+        items.append(item)
+    feed["items"] = items
+    # Utan indent, så att json använder sin C-kodare
+    return json.dumps(feed, ensure_ascii=False, separators=(",", ":")).encode("utf-8")
+
+
+# Renderare för formaten utöver RSS, med samma argument som render_feed
+FORMAT_RENDERERS = {"atom": render_atom, "json": render_json_feed}
+
+
+def write_formats(episodes, program_image, build_date, program, formats=None):
+    """Skriver programmets flöde i formaten utöver RSS och tar bort de som inte
+    längre används. Returnerar de skrivna filerna.
+
+    Varje format går igenom `episodes` för sig, så en store.EpisodeView
+    läses rad för rad och hålls aldrig i minnet i sin helhet.
+    """
+    formats = FEED_FORMATS if formats is None else formats
+    written = []
+    for fmt, render in FORMAT_RENDERERS.items():
+        path = format_file(program, fmt)
+        if fmt in formats:
+            with profiling.stage(fmt):
+                publish(path, render(episodes, program_image, build_date, program))
+            written.append(path)
+        elif os.path.exists(path):
+            unpublish(path)
+    return written
+
+
+def pages_dir(program=None):
+    """Katalogen med flödets sidor: sommar_i_p1.xml -> sommar_i_p1.pages"""
+    return os.path.splitext((program or default_program()).output_file)[0] + ".pages"
+
+
+def archive_url(program, number):
+    return f"{program.feed_url}?page={number}"
+
+
+def page_starts(times, page_size, starts):
+    """Publiceringstiden där varje arkivsida börjar, och sist där current.xml börjar.
+
+    `times` är avsnittens tider i flödets ordning, äldst först, och `starts`
+    gränserna från förra körningen. Gränserna flyttas aldrig, så att en
+    arkivsida behåller sitt nummer och innehåll när äldre avsnitt rensas
+    bort (retention); en ny sida läggs till när current.xml har 2 *
+    `page_size` avsnitt. Bara om det kommit avsnitt som är äldre än sida 1
+    (t.ex. med --archive) numreras sidorna om från början.
+    """
+    if not times:
+        return list(starts)
+    if not starts or times[0] < starts[0]:
+        starts = [times[0]]
+    starts = list(starts)
+    current = bisect_left(times, starts[-1])
+    while len(times) - current >= 2 * page_size:
+        current += page_size
+        starts.append(times[current])
+    return starts
+
+
+def write_pages(items, times, program_image, build_date, program, page_size=FEED_PAGE_SIZE):
+    """Skriver flödet som ett aktuellt dokument plus arkivsidor (RFC 5005).
+
+    `items` är alla renderade <item> i flödets ordning, äldst först, och
+    `times` avsnittens publiceringstider (unix-tid) i samma ordning.
+    Arkivsida 1 får de `page_size` äldsta, sida 2 nästa osv., och var sidorna
+    börjar sparas i index.json (se page_starts). Bara hela sidor arkiveras,
+    så en arkivsida ändras inte när nya avsnitt kommer; current.xml får
+    resten, mellan `page_size` och 2 * `page_size` - 1 avsnitt. Rensas
+    gamla avsnitt bort krymper bara de äldsta sidorna, och en tom sida tas
+    bort utan att de andra numreras om. Sidor som redan finns med samma
+    innehåll skrivs inte om, så deras ETag står still. Returnerar antalet
+    arkivsidor.
+    """
+    directory = pages_dir(program)
+    if not page_size:
+        if os.path.isdir(directory):
+            for name in os.listdir(directory):
+                if name.endswith(".xml"):
+                    unpublish(os.path.join(directory, name))
+            shutil.rmtree(directory, ignore_errors=True)
+        return 0
+    os.makedirs(directory, exist_ok=True)
+    index_path = os.path.join(directory, "index.json")
+    index = {}
+    if os.path.exists(index_path):
+        with open(index_path, encoding="utf-8") as f:
+            index = json.load(f)
+    previous = index.get("starts", []) if index.get("page_size") == page_size else []
+    starts = page_starts(times, page_size, previous)
+    if starts != previous or index.get("page_size") != page_size:
+        write_atomic(index_path, json.dumps({"page_size": page_size, "starts": starts}).encode("utf-8"))
+
+    bounds = [bisect_left(times, start) for start in starts] or [0]
+    pages = {
+        number: items[bounds[number - 1] : bounds[number]]
+        for number in range(1, len(bounds))
+        if bounds[number] > bounds[number - 1]
+    }
+    numbers = list(pages)
+    documents = {}
+    for i, number in enumerate(numbers):
+        links = {
+            "self": archive_url(program, number),
+            "current": program.feed_url,
+            "prev-archive": archive_url(program, numbers[i - 1]) if i > 0 else None,
+            "next-archive": archive_url(program, numbers[i + 1]) if i + 1 < len(numbers) else None,
+            "archive": True,
+        }
+        documents[f"{number}.xml"] = (links, pages[number])
+    archived = len(numbers)
+    links = {"prev-archive": archive_url(program, numbers[-1]) if numbers else None}
+    documents["current.xml"] = (links, items[bounds[-1] :])
+
+    written = 0
+    for name, (links, page_items) in documents.items():
+        head, tail, _ = render_shell(program_image, build_date, program, links)
+        data = b"".join([XML_DECLARATION, head, *page_items, tail])
+        path = os.path.join(directory, name)
+        if os.path.exists(path):
+            with open(path, "rb") as f:
+                if f.read() == data:
+                    continue
+        publish(path, data)
+        written += 1
+    for name in os.listdir(directory):
+        if name not in documents and name.endswith(".xml"):
+            unpublish(os.path.join(directory, name))
     if DEBUG:
-        print(f"[XML] Fixade XML-deklaration i {filename}")
-    print(f"✅ RSS-flöde sparat som {filename}")
+        log(f"[PAGES] {archived} arkivsidor, {written} dokument skrivna i {directory}")
+    return archived
+
+
+def generate_rss(
+    episodes,
+    filename=None,
+    program_image=None,
+    incremental=INCREMENTAL,
+    verify=False,
+    db=None,
+    program=None,
+):
+    """Skriver flödet, som standard till programmets fil.
+
+    Omrenderade <item> sparas i `db` till nästa körning.
+    """
+    program = program or default_program()
+    if filename is None:
+        filename = program.output_file
+    if program_image is None:
+        program_image = fetch_program_image(program)
+    started = time.perf_counter()
+    build_date = datetime.datetime.now(datetime.timezone.utc)
+    items = None
+    own_file = filename == program.output_file
+    if incremental or verify:
+        with profiling.stage("render"):
+            data, fresh, items = render_feed_incremental(episodes, program_image, build_date, program)
+        rendered = len(fresh)
+        if verify:
+            with profiling.stage("verify"):
+                full = render_feed(episodes, program_image, build_date, program)
+            if data == full:
+                log("✅ Verifierat: inkrementellt flöde är identiskt med full rendering")
+            else:
+                log("❌ Inkrementellt flöde skiljer sig från full rendering – skriver full rendering")
+                data, items = full, None
+        if fresh and db is not None:
+            with profiling.stage("store"):
+                db.save_rendered(fresh)
+    elif own_file and FEED_PAGE_SIZE:
+        # Sidorna behöver varje <item> för sig; rendera dem en gång och bygg
+        # hela flödet av samma bytes
+        with profiling.stage("render"):
+            data, _, items = render_feed_incremental(episodes, program_image, build_date, program, reuse=False)
+        rendered = len(episodes)
+    else:
+        with profiling.stage("render"):
+            data = render_feed(episodes, program_image, build_date, program)
+        rendered = len(episodes)
+    # Sidorna och de andra formaten hör till programmets eget flöde, inte till
+    # kopior på andra ställen
+    formats = []
+    if own_file:
+        with profiling.stage("pages"):
+            if FEED_PAGE_SIZE and items is None:
+                _, _, nsmap = render_shell(program_image, build_date, program)
+                items, _ = render_items(episodes, nsmap, reuse=False)
+            # En egen genomgång, så att en store.EpisodeView läses rad för rad
+            # i stället för att alla avsnitt hålls i minnet samtidigt
+            times = [ep.published.timestamp() for ep in reversed(episodes)]
+            write_pages(items or [], times, program_image, build_date, program)
+        formats = write_formats(episodes, program_image, build_date, program)
+    publish(filename, data)
+    log(
+        f"✅ RSS-flöde sparat som {filename} "
+        f"({rendered} av {len(episodes)} avsnitt renderade, {time.perf_counter() - started:.2f} s)"
+    )
+    if formats:
+        log(f"✅ Även sparat som {', '.join(formats)}")
+    return rendered
+
+
+def record_freshness(episodes, detected=None, program=None):
+    """Sparar hur lång tid efter publiceringen varje nytt avsnitt upptäcktes.
+
+    Lägger en rad per avsnitt i programmets upptäcktslogg (FRESHNESS_FILE)
+    och returnerar raderna.
+    """
+    program = program or default_program()
+    if detected is None:
+        detected = datetime.datetime.now(datetime.timezone.utc)
+    records = []
+    for ep in episodes:
+        published = episode_datetime(ep)
+        records.append(
+            {
+                "program": program.slug,
+                "title": ep.title,
+                "audio": ep.audio,
+                "published": published.isoformat(),
+                "detected": detected.isoformat(timespec="seconds"),
+                "lag_seconds": round((detected - published).total_seconds()),
+            }
+        )
+    if records:
+        with open(program.freshness_file, "a", encoding="utf-8") as f:
+            for record in records:
+                f.write(json.dumps(record, ensure_ascii=False) + "\n")
+        for record in records:
+            log(f"🆕 {record['title']} upptäckt {record['lag_seconds'] / 60:.0f} min efter publicering")
+    return records
+
+
+def run(
+    archive=ARCHIVE,
+    retention=CACHE_RETENTION,
+    max_pages=ARCHIVE_MAX_PAGES,
+    force=False,
+    full=False,
+    verify=False,
+    program=None,
+):
+    """Hämtar avsnitten och skriver flödet om något har ändrats.
+
+    Används både från kommandoraden och av servera.py. Returnerar en dict med
+    "changed", "duration" (s), "episodes", "new_episodes", "rendered",
+    "cache_hits", "cache_misses" och "fresh" (en post per nyutkommet avsnitt
+    från record_freshness).
+    """
+    program = program or default_program()
+    started = time.perf_counter()
+    stats = {
+        "changed": False,
+        "episodes": 0,
+        "new_episodes": 0,
+        "rendered": 0,
+        "cache_hits": 0,
+        "cache_misses": 0,
+        "fresh": [],
+    }
+    state = load_state(program)
+    with profiling.stage(program.slug), open_store(program=program) as db:
+        episodes = fetch_episodes(
+            db,
+            archive=archive,
+            retention=retention,
+            max_pages=max_pages,
+            state=state,
+            force=force,
+            stats=stats,
+            program=program,
+        )
+        stats["fresh"] = record_freshness(stats["fresh"], program=program)
+        if episodes is None:
+            log(f"✅ Inga nya avsnitt – {program.output_file} lämnas orörd")
+            # Nya validerare och archive_complete gäller även när avsnitten är desamma
+            save_state(state, program)
+        else:
+            stats["rendered"] = generate_rss(
+                episodes,
+                program_image=state.get("program_image"),
+                incremental=INCREMENTAL and not full,
+                verify=verify,
+                db=db,
+                program=program,
+            )
+            save_state(state, program)
+            stats["changed"] = True
+            stats["episodes"] = len(episodes)
+    stats["duration"] = time.perf_counter() - started
+    log(f"⏱️ Total körtid: {stats['duration']:.2f} s")
+    return stats
+
+
+def run_all(programs=None, log=None, **options):
+    """Kör run() för flera program samtidigt över den delade sessionen.
+
+    Tar samma nyckelord som run(). Alla meddelanden under körningen går
+    till `log` om den anges (annars till stdout). Returnerar statistiken
+    summerad över programmen, med varje programs egen statistik under
+    "programs" (None för ett program som misslyckades).
+    """
+    with log_to(log):
+        return _run_all(programs, **options)
+
+
+def _run_all(programs, **options):
+    if programs is None:
+        programs = configured_programs()
+    started = time.perf_counter()
+    results = {}
+    CLIENT.reset_stats()
+    # Vid profilering ett program i taget, så att stegens tid och minne inte blandas
+    workers = 1 if profiling.active() else min(PROGRAM_WORKERS, len(programs))
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        futures = {pool.submit(run, program=program, **options): program for program in programs}
+        for fut in as_completed(futures):
+            program = futures[fut]
+            try:
+                results[program.slug] = fut.result()
+            except httpclient.CircuitOpenError as e:
+                log(f"⚡ {program.slug}: {e} – {program.output_file} lämnas orörd")
+                results[program.slug] = None
+            except Exception as e:
+                log(f"❌ {program.slug}: {e!r}")
+                results[program.slug] = None
+    for line in CLIENT.summary():
+        log(line)
+    done = [stats for stats in results.values() if stats is not None]
+    if not done:
+        raise RuntimeError("Inget program kunde genereras")
+    total = {
+        key: sum(stats[key] for stats in done)
+        for key in ("episodes", "new_episodes", "rendered", "cache_hits", "cache_misses")
+    }
+    total["changed"] = any(stats["changed"] for stats in done)
+    total["fresh"] = [record for stats in done for record in stats["fresh"]]
+    total["duration"] = time.perf_counter() - started
+    total["programs"] = {program.slug: results[program.slug] for program in programs}
+    if len(programs) > 1:
+        log(f"⏱️ {len(done)} av {len(programs)} program klara på {total['duration']:.2f} s")
+    return total
+
+
+def profiled_run_all(programs=None, cprofile=None, log=print, **options):
+    """run_all() med stegprofilering; se profiling.py.
+
+    Sammanfattningen skrivs med `log` och körningen läggs som en JSON-rad
+    i PROFILE_FILE, med inställningarna och statistiken från run_all.
+    """
+    if programs is None:
+        programs = configured_programs()
+    with profiling.profile(PROFILE_FILE, cprofile=cprofile, log=log) as prof:
+        prof.info["programs"] = [program.slug for program in programs]
+        prof.info["options"] = options
+        stats = run_all(programs, log=log, **options)
+        for key in ("changed", "episodes", "new_episodes", "rendered", "cache_hits", "cache_misses"):
+            prof.info[key] = stats[key]
+    return stats
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Skapar RSS-flöde för Sommar & Vinter i P1.")
+    parser.add_argument(
+        "--archive", action="store_true", default=ARCHIVE, help="gå igenom alla sidor i avsnittslistan"
+    )
+    parser.add_argument(
+        "--max-pages", type=int, default=ARCHIVE_MAX_PAGES, help="max antal sidor i arkivläge"
+    )
+    parser.add_argument(
+        "--retention", default=CACHE_RETENTION, help='"listing", "all", "newest:N" eller "days:N"'
+    )
+    parser.add_argument(
+        "--force", action="store_true", help="skriv flödet även om inget har ändrats"
+    )
+    parser.add_argument(
+        "--full", action="store_true", help="rendera om alla avsnitt i stället för inkrementellt"
+    )
+    parser.add_argument(
+        "--verify",
+        action="store_true",
+        help="kontrollera att inkrementell rendering ger samma bytes som en full",
+    )
+    parser.add_argument(
+        "--profile",
+        action="store_true",
+        default=PROFILE,
+        help=f"mät tid och minne per steg och lägg en JSON-rad i {PROFILE_FILE}",
+    )
+    parser.add_argument(
+        "--cprofile",
+        metavar="FIL",
+        default=PROFILE_CPROFILE,
+        help="spara även cProfile-statistik i FIL (innebär --profile)",
+    )
+    parser.add_argument(
+        "--program",
+        action="append",
+        metavar="SLUG",
+        help="kör bara det här programmet ur PROGRAMS_FILE (kan anges flera gånger)",
+    )
+    args = parser.parse_args(argv)
+
+    programs = configured_programs()
+    if args.program:
+        unknown = set(args.program) - {program.slug for program in programs}
+        if unknown:
+            parser.error(f"okänt program: {', '.join(sorted(unknown))}")
+        programs = [program for program in programs if program.slug in args.program]
+    options = {
+        "archive": args.archive,
+        "retention": args.retention,
+        "max_pages": args.max_pages,
+        "force": args.force,
+        "full": args.full,
+        "verify": args.verify,
+    }
+    if args.profile or args.cprofile:
+        stats = profiled_run_all(programs, cprofile=args.cprofile, **options)
+    else:
+        stats = run_all(programs, **options)
+    return EXIT_NEW_FEED if stats["changed"] else EXIT_UNCHANGED
 
 
 if __name__ == "__main__":
-    episodes = fetch_episodes()
-    generate_rss(episodes)
+    sys.exit(main())
@@ -0,0 +1,401 @@
+"""Lagring av avsnitt för sommar.py.
+
+Två utbytbara backends med samma gränssnitt:
+
+- SqliteStore: en SQLite-fil med ljud-url som primärnyckel och index på
+  publiceringstid. Ändringar görs i transaktioner, och avsnitten kan läsas
+  ett i taget i datumordning utan att allt läses in i minnet.
+- JsonStore: det gamla formatet (cache.json), helt i minnet, men skrivs nu
+  atomärt så att en krasch mitt i en skrivning inte förstör filen.
+
+Avsnitt är Episode-objekt med ljud-url:en (audio) som nyckel. På disk
+sparas de i den kompakta formen från Episode.to_record(); renderingscachen
+(rss_item, rss_key) sparas vid sidan av avsnittet.
+
+    python store.py import cache.json    # importera till STORE_FILE
+"""
+import datetime
+import json
+import os
+import sqlite3
+import sys
+from dataclasses import dataclass, field
+from email.utils import parsedate_to_datetime
+
+DEFAULT_AUTHOR = "Sveriges Radio"
+# Fälten i flödet, i den ordning de alltid har haft i cachen
+CONTENT_FIELDS = (
+    "title",
+    "link",
+    "audio",
+    "date",
+    "description",
+    "image",
+    "duration",
+    "size",
+    "itunes_author",
+    "itunes_summary",
+    "itunes_subtitle",
+)
+# Renderingscachen i JSON-formatet
+RENDER_FIELDS = ("_rss_item", "_rss_key")
+
+
+@dataclass(slots=True)
+class Episode:
+    """Ett avsnitt, med fälten i __slots__ i stället för en dict per avsnitt.
+
+    itunes_summary och itunes_subtitle är None när de är samma text som
+    beskrivningen, vilket de nästan alltid är; `summary`/`subtitle` ger
+    texten. itunes_author internas, så alla avsnitt delar samma sträng.
+    Publiceringstiden tolkas ur `date` först när `published` används.
+    duration_probed är True när speltiden lästs ur ljudfilen (EXACT_DURATION),
+    så att varje fil bara läses en gång; misslyckas det räknas
+    duration_failures upp och duration_checked får unix-tiden för försöket,
+    så att filen inte provas om varje körning. details_checked är unix-tiden då
+    avsnittets egen sida senast hämtades (ENRICH).
+    """
+
+    title: str
+    link: str
+    audio: str
+    date: str  # RFC 2822, som i <pubDate>
+    description: str = ""
+    image: str | None = None
+    duration: str | None = None  # sekunder, som sträng
+    size: int = 0
+    itunes_author: str = DEFAULT_AUTHOR
+    itunes_summary: str | None = None
+    itunes_subtitle: str | None = None
+    duration_probed: bool = False
+    duration_failures: int = 0
+    duration_checked: float | None = None
+    details_checked: float | None = None
+    rss_key: str | None = field(default=None, repr=False, compare=False)
+    rss_item: str | None = field(default=None, repr=False, compare=False)
+    _published: datetime.datetime | None = field(default=None, init=False, repr=False, compare=False)
+
+    def __post_init__(self):
+        self.itunes_author = sys.intern(self.itunes_author)
+        if self.itunes_summary == self.description:
+            self.itunes_summary = None
+        if self.itunes_subtitle == self.description:
+            self.itunes_subtitle = None
+
+    @property
+    def summary(self):
+        return self.description if self.itunes_summary is None else self.itunes_summary
+
+    @property
+    def subtitle(self):
+        return self.description if self.itunes_subtitle is None else self.itunes_subtitle
+
+    @property
+    def published(self):
+        """Publiceringstiden som datetime i UTC."""
+        if self._published is None:
+            dt = parsedate_to_datetime(self.date)
+            # SR:s tider är UTC men sparas som "-0000", vilket ger en naiv datetime
+            if dt.tzinfo is None:
+                dt = dt.replace(tzinfo=datetime.timezone.utc)
+            self._published = dt
+        return self._published
+
+    def content(self):
+        """Alla fält i flödet som en dict, i samma form som de gamla avsnittsdictarna.
+
+        Används för hashar (item_key, episodes_digest), så att de inte ändras
+        med lagringsformatet.
+        """
+        return {
+            "title": self.title,
+            "link": self.link,
+            "audio": self.audio,
+            "date": self.date,
+            "description": self.description,
+            "image": self.image,
+            "duration": self.duration,
+            "size": self.size,
+            "itunes_author": self.itunes_author,
+            "itunes_summary": self.summary,
+            "itunes_subtitle": self.subtitle,
+        }
+
+    def to_record(self, rendered=False):
+        """Kompakt dict för cachen: fält med standardvärde utelämnas."""
+        record = {"title": self.title, "link": self.link, "audio": self.audio, "date": self.date}
+        if self.description:
+            record["description"] = self.description
+        if self.image is not None:
+            record["image"] = self.image
+        if self.duration is not None:
+            record["duration"] = self.duration
+        if self.size:
+            record["size"] = self.size
+        if self.itunes_author != DEFAULT_AUTHOR:
+            record["itunes_author"] = self.itunes_author
+        if self.itunes_summary is not None:
+            record["itunes_summary"] = self.itunes_summary
+        if self.itunes_subtitle is not None:
+            record["itunes_subtitle"] = self.itunes_subtitle
+        if self.duration_probed:
+            record["duration_probed"] = True
+        if self.duration_failures:
+            record["duration_failures"] = self.duration_failures
+            record["duration_checked"] = self.duration_checked
+        if self.details_checked is not None:
+            record["details_checked"] = self.details_checked
+        if rendered and self.rss_item is not None:
+            record["_rss_item"] = self.rss_item
+            record["_rss_key"] = self.rss_key
+        return record
+
+    @classmethod
+    def from_record(cls, record):
+        """Läser både to_record() och det gamla formatet med alla fält utskrivna."""
+        return cls(
+            **{name: record[name] for name in CONTENT_FIELDS if record.get(name) is not None},
+            duration_probed=bool(record.get("duration_probed")),
+            duration_failures=record.get("duration_failures", 0),
+            duration_checked=record.get("duration_checked"),
+            details_checked=record.get("details_checked"),
+            rss_key=record.get("_rss_key"),
+            rss_item=record.get("_rss_item"),
+        )
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS episodes (
+    audio TEXT PRIMARY KEY,
+    pub_ts REAL NOT NULL,
+    description TEXT NOT NULL,
+    fields TEXT NOT NULL,
+    rss_key TEXT,
+    rss_item TEXT
+);
+CREATE INDEX IF NOT EXISTS episodes_pub_ts ON episodes (pub_ts);
+"""
+
+
+class EpisodeView:
+    """Alla avsnitt i en butik, nyast först, lästa först när de behövs.
+
+    reversed() ger äldst först, vilket är ordningen avsnitten läggs in i
+    flödet.
+    """
+
+    def __init__(self, store):
+        self.store = store
+
+    def __len__(self):
+        return len(self.store)
+
+    def __iter__(self):
+        return self.store.episodes(newest_first=True)
+
+    def __reversed__(self):
+        return self.store.episodes(newest_first=False)
+
+
+class JsonStore:
+    """Avsnitten i en JSON-fil, som dict från ljud-url till avsnitt."""
+
+    def __init__(self, path, sort_key):
+        self.path = path
+        self.sort_key = sort_key
+        self._data = {}
+        if os.path.exists(path):
+            with open(path, "r", encoding="utf-8") as f:
+                self._data = {audio: Episode.from_record(record) for audio, record in json.load(f).items()}
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def __len__(self):
+        return len(self._data)
+
+    def close(self):
+        pass
+
+    def get(self, audio):
+        return self._data.get(audio)
+
+    def upsert(self, episodes):
+        episodes = list(episodes)
+        if episodes:
+            for ep in episodes:
+                self._data[ep.audio] = ep
+            self._write()
+
+    def delete(self, urls):
+        urls = [url for url in urls if url in self._data]
+        if urls:
+            for url in urls:
+                del self._data[url]
+            self._write()
+
+    def save_rendered(self, episodes):
+        changed = False
+        for ep in episodes:
+            stored = self._data.get(ep.audio)
+            if stored is not None:
+                stored.rss_item, stored.rss_key = ep.rss_item, ep.rss_key
+                changed = True
+        if changed:
+            self._write()
+
+    def _sorted(self):
+        # Stabil sortering: lika tider behåller insättningsordningen
+        return sorted(self._data.values(), key=self.sort_key, reverse=True)
+
+    def episodes(self, newest_first=True):
+        ordered = self._sorted()
+        return iter(ordered if newest_first else ordered[::-1])
+
+    def index(self):
+        """(ljud-url, unix-tid) för alla avsnitt, nyast först."""
+        for ep in self._sorted():
+            yield ep.audio, self.sort_key(ep).timestamp()
+
+    def _write(self):
+        tmp = f"{self.path}.tmp"
+        data = {audio: ep.to_record(rendered=True) for audio, ep in self._data.items()}
+        with open(tmp, "w", encoding="utf-8") as f:
+            json.dump(data, f, ensure_ascii=False, separators=(",", ":"))
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp, self.path)
+
+
+class SqliteStore:
+    """Avsnitten i en SQLite-databas.
+
+    Lika publiceringstider sorteras i insättningsordning (rowid), precis som
+    den stabila sorteringen i JsonStore, så att båda ger samma flöde.
+    """
+
+    def __init__(self, path, sort_key):
+        self.path = path
+        self.sort_key = sort_key
+        self.conn = sqlite3.connect(path)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute("PRAGMA synchronous=NORMAL")
+        self.conn.executescript(SCHEMA)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def __len__(self):
+        return self.conn.execute("SELECT COUNT(*) FROM episodes").fetchone()[0]
+
+    def close(self):
+        self.conn.close()
+
+    def _row(self, ep):
+        fields = ep.to_record()
+        del fields["audio"]
+        fields.pop("description", None)
+        return (
+            ep.audio,
+            self.sort_key(ep).timestamp(),
+            ep.description,
+            json.dumps(fields, ensure_ascii=False, separators=(",", ":")),
+            ep.rss_key,
+            ep.rss_item,
+        )
+
+    @staticmethod
+    def _episode(audio, description, fields, rss_key, rss_item):
+        record = json.loads(fields)
+        # Äldre rader listar i "_shared" fält som är samma text som
+        # beskrivningen; i Episode är de None, så listan behövs inte
+        record.pop("_shared", None)
+        record["audio"] = audio
+        record["description"] = description
+        ep = Episode.from_record(record)
+        if rss_item is not None:
+            ep.rss_item, ep.rss_key = rss_item, rss_key
+        return ep
+
+    def get(self, audio):
+        row = self.conn.execute(
+            "SELECT audio, description, fields, rss_key, rss_item FROM episodes WHERE audio = ?",
+            (audio,),
+        ).fetchone()
+        return self._episode(*row) if row else None
+
+    def upsert(self, episodes):
+        with self.conn:
+            self.conn.executemany(
+                """
+                INSERT INTO episodes (audio, pub_ts, description, fields, rss_key, rss_item)
+                VALUES (?, ?, ?, ?, ?, ?)
+                ON CONFLICT (audio) DO UPDATE SET
+                    pub_ts = excluded.pub_ts,
+                    description = excluded.description,
+                    fields = excluded.fields,
+                    rss_key = excluded.rss_key,
+                    rss_item = excluded.rss_item
+                """,
+                (self._row(ep) for ep in episodes),
+            )
+
+    def delete(self, urls):
+        with self.conn:
+            self.conn.executemany("DELETE FROM episodes WHERE audio = ?", ((url,) for url in urls))
+
+    def save_rendered(self, episodes):
+        with self.conn:
+            self.conn.executemany(
+                "UPDATE episodes SET rss_key = ?, rss_item = ? WHERE audio = ?",
+                ((ep.rss_key, ep.rss_item, ep.audio) for ep in episodes),
+            )
+
+    def episodes(self, newest_first=True):
+        order = "pub_ts DESC, rowid ASC" if newest_first else "pub_ts ASC, rowid DESC"
+        # En egen cursor som läses rad för rad
+        cursor = self.conn.execute(
+            f"SELECT audio, description, fields, rss_key, rss_item FROM episodes ORDER BY {order}"
+        )
+        return (self._episode(*row) for row in cursor)
+
+    def index(self):
+        """(ljud-url, unix-tid) för alla avsnitt, nyast först."""
+        yield from self.conn.execute("SELECT audio, pub_ts FROM episodes ORDER BY pub_ts DESC, rowid ASC")
+
+    def import_json(self, path):
+        """Lägger in avsnitten från en cache.json. Returnerar antalet."""
+        with open(path, "r", encoding="utf-8") as f:
+            data = json.load(f)
+        self.upsert(Episode.from_record(record) for record in data.values())
+        return len(data)
+
+
+BACKENDS = {"sqlite": SqliteStore, "json": JsonStore}
+
+
+def newest_datetime(store):
+    """Publiceringstiden för det nyaste avsnittet, eller None."""
+    for _, ts in store.index():
+        return datetime.datetime.fromtimestamp(ts, datetime.timezone.utc)
+    return None
+
+
+if __name__ == "__main__":
+    import argparse
+
+    import sommar
+
+    parser = argparse.ArgumentParser(description="Importerar en cache.json till avsnittsdatabasen.")
+    parser.add_argument("command", choices=["import"])
+    parser.add_argument("path", nargs="?", default=sommar.CACHE_FILE)
+    parser.add_argument("--db", default=sommar.STORE_FILE)
+    args = parser.parse_args()
+    with SqliteStore(args.db, sommar.episode_datetime) as db:
+        count = db.import_json(args.path)
+        print(f"📦 Importerade {count} avsnitt från {args.path} till {args.db} ({len(db)} totalt)")
@@ -0,0 +1,145 @@
+"""WebSub-notiser till hubbar när ett flöde ändrats, för servera.py.
+
+    publisher = websub.Publisher(["https://hub.example/"], session, workers=4)
+    publisher.publish(["https://example.org/sommar_i_p1.xml"])
+
+Flödet annonserar hubbarna med <atom:link rel="hub"> (WEBSUB_HUB i
+sommar.py). När flödet ändrats skickas en publish-ping till varje hubb,
+som då hämtar flödet en gång och skickar det vidare till prenumeranterna,
+i stället för att varje poddapp frågar efter det på eget schema.
+
+Pingarna skickas av `workers` trådar i bakgrunden. En ping som inte gått
+iväg än slås ihop med en ny för samma hubb och flöde. Vid nätverksfel, 429
+och 5xx görs upp till `retries` nya försök med exponentiell väntan (eller
+hubbens Retry-After); andra svar räknas som fel direkt.
+
+För att pinga för hand, t.ex. efter sommar.py från cron:
+
+    python websub.py --hub https://hub.example/ https://example.org/sommar_i_p1.xml
+"""
+import argparse
+import queue
+import random
+import threading
+import time
+
+import requests
+
+from httpclient import RETRY_STATUSES, retry_after
+
+# Hubbar får be oss vänta längre än SR
+MAX_RETRY_AFTER = 300
+
+
+class Publisher:
+    """Skickar publish-pingar till `hubs` i bakgrunden.
+
+    `on_result` anropas med "ok" eller "error" efter varje ping (hubb och
+    flöde), när alla försök är gjorda.
+    """
+
+    def __init__(
+        self,
+        hubs,
+        session,
+        workers=4,
+        retries=4,
+        backoff=2.0,
+        timeout=10,
+        log=print,
+        on_result=None,
+        sleep=time.sleep,
+    ):
+        self.hubs = list(hubs)
+        self.session = session
+        self.retries = retries
+        self.backoff = backoff
+        self.timeout = timeout
+        self.log = log
+        self.on_result = on_result
+        self.sleep = sleep
+        self._lock = threading.Lock()
+        self._pending = set()
+        self._queue = queue.Queue()
+        for _ in range(workers):
+            threading.Thread(target=self._worker, daemon=True).start()
+
+    def publish(self, topics):
+        """Köar en ping per hubb för varje flödes-url i `topics`. Returnerar antalet köade."""
+        queued = 0
+        for topic in topics:
+            for hub in self.hubs:
+                with self._lock:
+                    if (hub, topic) in self._pending:
+                        continue
+                    self._pending.add((hub, topic))
+                self._queue.put((hub, topic))
+                queued += 1
+        return queued
+
+    def join(self):
+        """Väntar tills alla köade pingar är klara."""
+        self._queue.join()
+
+    def _worker(self):
+        while True:
+            hub, topic = self._queue.get()
+            # Från och med nu behövs en ny ping om flödet ändras igen
+            with self._lock:
+                self._pending.discard((hub, topic))
+            try:
+                result = self.send(hub, topic)
+            except Exception as e:
+                result = "error"
+                self.log(f"⚠️ WebSub: ping till {hub} misslyckades: {e!r}")
+            try:
+                if self.on_result:
+                    self.on_result(result)
+            finally:
+                self._queue.task_done()
+
+    def send(self, hub, topic):
+        """Pingar `hub` om `topic`, med nya försök. Returnerar "ok" eller "error"."""
+        data = {"hub.mode": "publish", "hub.url": topic}
+        started = time.perf_counter()
+        for attempt in range(self.retries + 1):
+            wait = self.backoff * 2**attempt * random.uniform(0.5, 1.0)
+            try:
+                r = self.session.post(hub, data=data, timeout=self.timeout)
+            except requests.RequestException as e:
+                problem = repr(e)
+            else:
+                with r:
+                    if 200 <= r.status_code < 300:
+                        self.log(
+                            f"📣 WebSub: {hub} meddelad om {topic} "
+                            f"({r.status_code}, {time.perf_counter() - started:.2f} s, försök {attempt + 1})"
+                        )
+                        return "ok"
+                    problem = f"{r.status_code} {r.reason}"
+                    if r.status_code not in RETRY_STATUSES:
+                        break
+                    wait = retry_after(r.headers.get("Retry-After"), MAX_RETRY_AFTER) or wait
+            if attempt < self.retries:
+                self.log(f"⚠️ WebSub: {hub}: {problem}, försöker igen om {wait:.1f} s")
+                self.sleep(wait)
+        self.log(f"❌ WebSub: kunde inte meddela {hub} om {topic}: {problem}")
+        return "error"
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Skickar WebSub publish-pingar för ett eller flera flöden.")
+    parser.add_argument("topics", nargs="+", metavar="FLÖDES-URL")
+    parser.add_argument("--hub", action="append", required=True, help="hubbens url (kan anges flera gånger)")
+    parser.add_argument("--retries", type=int, default=4)
+    args = parser.parse_args(argv)
+
+    results = []
+    publisher = Publisher(args.hub, requests.Session(), workers=1, retries=args.retries, on_result=results.append)
+    publisher.publish(args.topics)
+    publisher.join()
+    return 0 if all(result == "ok" for result in results) else 1
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())